@@ -24,22 +24,118 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ################################################################################
 import os
+import re
 import logging
 import logging.handlers
+import datetime
+import json
+import time
+import atexit
+from functools import wraps
 from models.test_result import TestResult
 from models.test_history import TestHistory
 from models.series_summary import SeriesSummary
 from models.series_names import SeriesNames
+from models.series_version import SeriesVersion
+from models.series_feed import SeriesFeed
+from models.series_export import SeriesExport
 from models.batch import add_batch
+from models.archive import Archive
+from models.rollup import Trend, PERIODS
+from models.retention import RetentionPolicies, RetentionPolicy
+import models.retention as retention
 from common.database import Database
-import flask_table
-from flask import Flask, render_template, url_for, request
+from common.cache import MemoryCache, SqliteCache
+from common.threads import ThreadPool, PeriodicTask
+from common.admission import AdmissionControl, Rejected
+from common.profiling import ProfilerMiddleware, COMPONENTS
+from common.memory import MemoryMiddleware
+import common.memory as memory
+from common.metrics import REGISTRY, MetricsStore
+import common.compression as compression
+import common.tracing as tracing
+import common.html_table as html_table
+from flask import Flask, Response, render_template, url_for, request, jsonify
+from flask import abort, stream_with_context, g, send_from_directory
+from flask import has_request_context
 
 logger = logging.getLogger()
 
-
-class FormattedTable(flask_table.Table):
-    classes = ["table table-striped"]
+# Number of pieces of a streamed template to gather before sending them
+STREAM_BUFFER_SIZE = 50
+
+
+TABLE_CLASSES = ["table table-striped"]
+
+SERIES_TABLE = html_table.Table(
+                [html_table.LinkCol(
+                    "Series",
+                    "route_view_results_series_landing",
+                    url_kwargs=dict(series_name="series_name"),
+                    attr="series_name")],
+                classes=TABLE_CLASSES)
+
+HISTORY_TABLE = html_table.Table(
+                [html_table.Col("Result", "test_result"),
+                 html_table.Col("Batch Timestamp", "batch_timestamp"),
+                 html_table.Col("VCS", "vcs_system"),
+                 html_table.Col("VCS Revision", "vcs_revision"),
+                 html_table.Col("Test Timestamp", "test_timestamp"),
+                 html_table.Col("Metadata", "metadata")],
+                classes=TABLE_CLASSES)
+
+TREND_TABLE = html_table.Table(
+                [html_table.Col("Period", "period_start"),
+                 html_table.Col("Pass", "pass_count"),
+                 html_table.Col("Fail", "fail_count"),
+                 html_table.Col("Skip", "skip_count"),
+                 html_table.Col("Pass Rate", "pass_rate"),
+                 html_table.Col("Min Duration", "duration_min"),
+                 html_table.Col("Mean Duration", "duration_mean"),
+                 html_table.Col("Max Duration", "duration_max")],
+                classes=TABLE_CLASSES)
+
+PROFILES_TABLE = html_table.Table(
+                [html_table.Col("Time", "timestamp"),
+                 html_table.Col("Method", "method"),
+                 html_table.Col("Path", "path"),
+                 html_table.Col("Status", "status"),
+                 html_table.Col("Total ms", "duration")] +
+                [html_table.Col(name + " ms", name) for name, match in COMPONENTS] +
+                [html_table.LinkCol("pstats",
+                                    "route_debug_profile_file",
+                                    url_kwargs=dict(file_name="pstats_file"),
+                                    attr="pstats_file"),
+                 html_table.LinkCol("Collapsed Stacks",
+                                    "route_debug_profile_file",
+                                    url_kwargs=dict(file_name="collapsed_file"),
+                                    attr="collapsed_file")],
+                classes=TABLE_CLASSES)
+
+MEMORY_TABLE = html_table.Table(
+                [html_table.Col("Time", "timestamp"),
+                 html_table.Col("Method", "method"),
+                 html_table.Col("Path", "path"),
+                 html_table.Col("Status", "status"),
+                 html_table.Col("Total ms", "duration")] +
+                # Not known before Python 3.9
+                ([html_table.Col("Peak KiB", "peak")] if memory.PEAK_MEASURED else []) +
+                [html_table.Col("Retained KiB", "retained")] +
+                [html_table.Col(name + " KiB", name) for name, match in COMPONENTS] +
+                [html_table.Col("Other KiB", "other")],
+                classes=TABLE_CLASSES)
+
+ALLOCATIONS_TABLE = html_table.Table(
+                [html_table.Col("Line", "line"),
+                 html_table.Col("KiB", "size"),
+                 html_table.Col("Blocks", "count")],
+                classes=TABLE_CLASSES)
+
+TEST_TABLE = html_table.Table(
+                [html_table.Col("Test Name", "test_name"),
+                 html_table.Col("Series Name", "series_name"),
+                 html_table.Col("timestamp", "batch_timestamp")],
+                classes=TABLE_CLASSES)
 
 
 def create_logger(level, log_file=None, log_to_stdout=False):
@@ -53,6 +149,16 @@ def create_logger(level, log_file=None, log_to_stdout=False):
         logger.debug("Creating path for logs: {}".format(log_dir))
         os.makedirs(log_dir)
 
+    # Called by each startup(), so handlers already added are kept rather
+    # than added again
+    log_path = os.path.abspath(log_file) if log_file else None
+    for handler in logger.handlers:
+        if isinstance(handler, logging.handlers.RotatingFileHandler) and \
+           handler.baseFilename == log_path:
+            log_file = None
+        elif type(handler) is logging.StreamHandler:
+            log_to_stdout = False
+
     if log_file:
         log_file_size_bytes = 2 * 1024**2
         fh = logging.handlers.RotatingFileHandler(log_file,
@@ -77,12 +183,418 @@ app = Flask(__name__)
 
 app.config.from_object("config")
 
-create_logger(app.config["LOG_LEVEL"], app.config["LOG_FILE"])
+# A file of settings to use in place of those in config.py
+app.config.from_envvar("TRAPP_SETTINGS", silent=True)
+
+# Rendered responses and summaries, keyed by the version of their series
+if app.config["RESPONSE_CACHE_TYPE"] == "shared":
+    response_cache = SqliteCache(app.config["SHARED_CACHE_FILE"],
+                                 app.config["RESPONSE_CACHE_SIZE"])
+else:
+    response_cache = MemoryCache(app.config["RESPONSE_CACHE_SIZE"])
+
+# Results moved out of the database, see ARCHIVE_DIRECTORY
+if app.config["ARCHIVE_DIRECTORY"]:
+    archive = Archive(app.config["ARCHIVE_DIRECTORY"])
+else:
+    archive = None
+
+
+def retention_policies():
+    """The retention policy of each series, see RETENTION_POLICIES."""
+    return RetentionPolicies(app.config["RETENTION_POLICIES"],
+                             RetentionPolicy(count=app.config["TEST_HISTORY_SIZE"]))
+
+
+def sweep_retention():
+    retention.sweep(retention_policies(), archive, app.config["RETENTION_CHUNK_ROWS"])
+
+
+# Removes results outside their policy, see RETENTION_SWEEP_INTERVAL
+retention_sweeper = PeriodicTask("retention",
+                                 app.config["RETENTION_SWEEP_INTERVAL"],
+                                 sweep_retention,
+                                 app.config["DATABASE"] + ".retention.lock")
+
+# Threads for reading several series at once
+fan_out_pool = ThreadPool(app.config["FAN_OUT_THREADS"], "fan-out")
+
+# Limits the workers tied up adding results, so the dashboard stays responsive
+ingest_admission = AdmissionControl(app.config["ADMISSION_DIRECTORY"],
+                                    "ingest",
+                                    app.config["INGEST_MAX_IN_FLIGHT"],
+                                    app.config["INGEST_MAX_QUEUED"],
+                                    app.config["INGEST_QUEUE_TIMEOUT"],
+                                    app.config["INGEST_RETRY_AFTER"])
+
+# Limits the threads held by Server-Sent Events streams
+stream_admission = AdmissionControl(app.config["ADMISSION_DIRECTORY"],
+                                    "events",
+                                    app.config["SSE_MAX_STREAMS"],
+                                    retry_after=app.config["SSE_RETRY_AFTER"],
+                                    busy_status=503)
+
+
+def fit_admission(threads):
+    """
+    Lowers the admission limits, if needed, for a server handling threads
+    requests at once. Event streams hold at most half of them, and results
+    being added all but one of the rest, so the dashboard always has one.
+    """
+    stream_admission.fit(threads // 2 + 1)
+    ingest_admission.fit(threads - stream_admission.max_in_flight)
+
+
+# Profiles requests when asked to, see PROFILING_ENABLED
+profiler = ProfilerMiddleware(app.wsgi_app,
+                              os.path.abspath(app.config["PROFILE_DIRECTORY"]),
+                              header=app.config["PROFILE_HEADER"],
+                              query=app.config["PROFILE_QUERY"],
+                              keep=app.config["PROFILE_KEEP"])
+profiler.enabled = app.config["PROFILING_ENABLED"]
+app.wsgi_app = profiler
+
+# Accounts for the memory of every request, see MEMORY_PROFILING_ENABLED
+memory_profiler = MemoryMiddleware(app.wsgi_app, keep=app.config["MEMORY_PROFILE_KEEP"])
+memory_profiler.enabled = app.config["MEMORY_PROFILING_ENABLED"]
+app.wsgi_app = memory_profiler
+
+if memory_profiler.enabled:
+    memory.start()
+
+# Metrics of every worker are totalled in METRICS_FILE
+if app.config["METRICS_FILE"]:
+    REGISTRY.store = MetricsStore(app.config["METRICS_FILE"])
+    REGISTRY.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+    atexit.register(REGISTRY.flush, True)
+
+# Times each phase of adding results, see TRACE_INGEST
+tracing.enabled = app.config["TRACE_INGEST"]
+
+REQUEST_SECONDS = REGISTRY.histogram("trapp_http_request_duration_seconds",
+                                     "Time taken to answer requests, not including streaming the body.",
+                                     ["route", "method", "status"])
+
+CACHE_REQUESTS = REGISTRY.counter("trapp_cache_requests_total",
+                                  "Lookups in the response cache.",
+                                  ["result"])
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+REGISTRY.gauge("trapp_database_bytes",
+               "Size of the SQLite database file.",
+               lambda: _file_size(app.config["DATABASE"]))
+
+
+@REGISTRY.add_collector
+def _collect_cache_requests():
+    CACHE_REQUESTS.set_total(response_cache.hits, result="hit")
+    CACHE_REQUESTS.set_total(response_cache.misses, result="miss")
+
+
+_started = False
+
+
+def startup():
+    """
+    Sets up logging and the database, then warms the caches for the
+    WARM_UP_SERIES most recently changed series. Call once in each worker
+    process, after it has been forked, e.g. from gunicorn's post_fork hook.
+    Otherwise it is called before the first request.
+    """
+    global _started
+
+    if _started:
+        return
+
+    _started = True
+    started = time.monotonic()
+
+    create_logger(app.config["LOG_LEVEL"], app.config["LOG_FILE"])
+
+    Database.initialise(app.config["DATABASE"])
+    initialised = time.monotonic()
+
+    if retention_sweeper.interval:
+        retention_sweeper.start()
+
+    warm_up(app.config["WARM_UP_SERIES"])
+    warmed_up = time.monotonic()
+
+    logger.info("Started in {:.3f}s: database {:.3f}s, warm up {:.3f}s".format(
+                    warmed_up - started,
+                    initialised - started,
+                    warmed_up - initialised))
+
+
+def shutdown():
+    """
+    Stops the threads started by startup() and the app, writes out the
+    metrics and closes the database connections. Call before a
+    worker exits, e.g. from gunicorn's worker_exit hook.
+    """
+    global _started
+
+    retention_sweeper.stop()
+    fan_out_pool.shutdown()
+    REGISTRY.retire()
+    Database.shutdown()
+
+    _started = False
+
+
+def warm_up(series_count):
+    """
+    Compiles the templates and caches the test counts of the series_count
+    series which most recently changed, so the first requests for them are as
+    quick as any other.
+    """
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+    for series_name in SeriesVersion.get_recent_series_names(series_count):
+        series_counts(series_name)
 
 
 @app.before_first_request
 def db_initalise():
-    Database.initialise(app.config["DATABASE"])
+    startup()
+
+
+def stream_template(template_name, **context):
+    """
+    As render_template, but the response is sent as the template is rendered.
+    Any generators in context are consumed as the page is written out.
+    """
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+
+    return Response(stream_with_context(stream))
+
+
+def _versioned(version):
+    etag = version.etag
+    last_modified = version.last_modified
+
+    # Stale state is relative to the current time, not just the data
+    if app.config["DAYS_UNTIL_TEST_RESULT_STALE"]:
+        hour = datetime.datetime.utcnow().replace(minute=0,
+                                                  second=0,
+                                                  microsecond=0)
+        etag += hour.strftime("-%Y%m%d%H")
+        last_modified = max(last_modified, hour) if last_modified else hour
+
+    if last_modified:
+        last_modified = last_modified.replace(microsecond=0)
+
+    return etag, last_modified
+
+
+def series_version(series_name, **kwargs):
+    return _versioned(SeriesVersion.get(series_name))
+
+
+def global_version(**kwargs):
+    return _versioned(SeriesVersion.get_global())
+
+
+def _use_cache():
+    # Profiling a cached response would only show the cache
+    return not (profiler.enabled and
+                has_request_context() and
+                profiler.is_requested(request.environ))
+
+
+def series_counts(series_name):
+    """
+    SeriesSummary.count_tests(), kept in response_cache until the series
+    changes.
+    """
+    days_until_result_stale = app.config["DAYS_UNTIL_TEST_RESULT_STALE"]
+    etag, last_modified = series_version(series_name)
+
+    cache_key = "counts {} {} {} {}".format(Database.instance_id,
+                                            etag,
+                                            days_until_result_stale,
+                                            series_name)
+
+    cached = response_cache.get(cache_key) if _use_cache() else None
+    if cached is not None:
+        return json.loads(cached.decode())
+
+    summary = SeriesSummary.count_tests(series_name, days_until_result_stale)
+    response_cache.set(cache_key, json.dumps(summary).encode())
+
+    return summary
+
+
+def _is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        return any(request.if_none_match.contains(variant)
+                   for variant in compression.etag_variants(etag))
+
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+
+    return False
+
+
+def _response_encoding():
+    if not app.config["COMPRESSION_LEVEL"]:
+        return None
+    return compression.negotiate(request.accept_encodings)
+
+
+def _pack_response(response, body):
+    return b"\n".join([response.mimetype.encode(),
+                       response.headers.get("Content-Encoding", "").encode(),
+                       body])
+
+
+def _unpack_response(packed):
+    mimetype, content_encoding, body = packed.split(b"\n", 2)
+
+    response = app.response_class(body, mimetype=mimetype.decode())
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding.decode()
+
+    return response
+
+
+def _max_cache_entry():
+    return min(app.config["RESPONSE_CACHE_MAX_ENTRY"], response_cache.max_bytes)
+
+
+def _cache_stream(chunks, cache_key, response):
+    parts = []
+    size = 0
+    max_size = _max_cache_entry()
+
+    for chunk in chunks:
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            if size > max_size:
+                parts = None
+        yield chunk
+
+    if parts is not None:
+        response_cache.set(cache_key, _pack_response(response, b"".join(parts)))
+
+
+def conditional(get_version):
+    """
+    Tags the response of a view with the ETag and Last-Modified time returned
+    by get_version. Conditional requests which match are answered with 304
+    without running the view. Otherwise the response is served from, or
+    stored in, response_cache under the ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            etag, last_modified = get_version(**kwargs)
+
+            cache_key = "{} {} {} {}".format(Database.instance_id,
+                                             request.full_path,
+                                             etag,
+                                             _response_encoding())
+
+            if _is_not_modified(etag, last_modified):
+                response = app.response_class(status=304)
+            else:
+                cached = response_cache.get(cache_key) if _use_cache() else None
+                if cached is not None:
+                    response = _unpack_response(cached)
+                else:
+                    response = app.make_response(view(**kwargs))
+                    g.response_cache_key = cache_key
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            if app.config["CACHE_CONTROL"]:
+                response.headers["Cache-Control"] = app.config["CACHE_CONTROL"]
+            return response
+        return wrapper
+    return decorator
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+# Registered before compress_response so it runs after it
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                route=request.url_rule.rule if request.url_rule else "none",
+                                method=request.method,
+                                status=response.status_code)
+
+    REGISTRY.flush()
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    if not compression.is_compressible(response.mimetype) or \
+       response.direct_passthrough:
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    encoding = _response_encoding()
+
+    if encoding is not None and response.status_code in (200, 304):
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(compression.encoded_etag(etag, encoding))
+
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+
+    cache_key = g.pop("response_cache_key", None)
+    level = app.config["COMPRESSION_LEVEL"]
+
+    if response.is_streamed:
+        chunks = response.iter_encoded()
+
+        if encoding is not None:
+            chunks = compression.compress_stream(chunks, encoding, level)
+            response.headers["Content-Encoding"] = encoding
+            response.headers.pop("Content-Length", None)
+
+        if cache_key is not None:
+            chunks = _cache_stream(chunks, cache_key, response)
+
+        response.response = chunks
+
+    else:
+        data = response.get_data()
+
+        if encoding is not None and \
+           len(data) >= app.config["COMPRESSION_MIN_SIZE"]:
+            data = compression.compress(data, encoding, level)
+            response.set_data(data)
+            response.headers["Content-Encoding"] = encoding
+
+        if cache_key is not None and len(data) <= _max_cache_entry():
+            response_cache.set(cache_key, _pack_response(response, data))
+
+    return response
 
 
 @app.route("/debug")
@@ -90,6 +602,77 @@ def route_debug():
     return "debug"
 
 
+@app.route("/debug/profiles")
+def route_debug_profiles():
+    if not profiler.enabled:
+        abort(404)
+
+    profiles = []
+    for profile in profiler.list_profiles():
+        row = dict(profile,
+                   duration="{:.1f}".format(profile["duration"] * 1000),
+                   pstats_file=profile["name"] + ".pstats",
+                   collapsed_file=profile["name"] + ".collapsed")
+
+        for component, seconds in profile["components"].items():
+            row[component] = "{:.1f}".format(seconds * 1000)
+
+        profiles.append(row)
+
+    return render_template("profiles.jinja2",
+                           directory=profiler.directory,
+                           profiles_table=PROFILES_TABLE.render(profiles))
+
+
+@app.route("/debug/profiles/<path:file_name>")
+def route_debug_profile_file(file_name):
+    if not profiler.enabled:
+        abort(404)
+
+    return send_from_directory(profiler.directory, file_name, as_attachment=True)
+
+
+def _kib(size):
+    return "{:.1f}".format(size / 1024)
+
+
+@app.route("/debug/memory")
+def route_debug_memory():
+    if not memory_profiler.enabled:
+        abort(404)
+
+    requests = []
+    for measured in memory_profiler.requests:
+        row = dict(measured,
+                   duration="{:.1f}".format(measured["duration"] * 1000),
+                   peak=None if measured["peak"] is None else _kib(measured["peak"]),
+                   retained=_kib(measured["retained"]))
+
+        for component, (size, count) in measured["components"].items():
+            row[component] = _kib(size)
+
+        requests.append(row)
+
+    allocations = [dict(line="{}:{}".format(statistic.traceback[0].filename,
+                                            statistic.traceback[0].lineno),
+                        size=_kib(statistic.size),
+                        count=statistic.count)
+                   for statistic in memory_profiler.top()]
+
+    current, peak = memory.traced_memory()
+
+    return render_template("memory.jinja2",
+                           current=_kib(current),
+                           peak=_kib(peak),
+                           requests_table=MEMORY_TABLE.render(requests),
+                           allocations_table=ALLOCATIONS_TABLE.render(allocations))
+
+
+@app.route("/metrics")
+def route_metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/echo:<string>")
 def route_echo(string):
     return render_template("echo.jinja2", echo_string=string)
@@ -97,55 +680,48 @@ def route_echo(string):
 
 @app.route("/")
 @app.route("/results")
+@conditional(global_version)
 def route_view_results():
 
     all_series = SeriesNames.get_all()
     all_series = [dict(series_name=x[0]) for x in all_series]
 
-    class SeriesTable(FormattedTable):
-        series_name = flask_table.LinkCol(
-                        "Series",
-                        "route_view_results_series_landing",
-                        url_kwargs=dict(series_name="series_name"),
-                        attr_list="series_name")
-
-    table = SeriesTable(all_series)
-
     return render_template("series_selection.jinja2",
-                           series_list=table.__html__())
+                           series_list=SERIES_TABLE.render(all_series))
 
 
 # TODO can the below two methods be tidied up / combined?
 @app.route("/results/series/<path:series_name>/type/<result_type>")
+@conditional(series_version)
 def route_view_results_series_for_type(series_name, result_type):
 
-    series = SeriesSummary(series_name,
-                           app.config["DAYS_UNTIL_TEST_RESULT_STALE"])
-
-    types = {
-        "newly_failing": ("Newly Failing Tests",
-                          series.get_newly_failing_test_table()),
-        "passing": ("Currently Passing Tests",
-                    series.get_passing_test_table()),
-        "always_failing": ("Always Failing Tests",
-                           series.get_always_failing_test_table()),
-        "stale": ("State Tests / Tests Not Recently Run",
-                  series.get_stale_test_table())
+    titles = {
+        "newly_failing": "Newly Failing Tests",
+        "passing": "Currently Passing Tests",
+        "always_failing": "Always Failing Tests",
+        "stale": "State Tests / Tests Not Recently Run"
     }
 
-    title, table = types[result_type]
+    if result_type not in titles:
+        abort(404)
+
+    table = SeriesSummary.stream_test_table(
+                series_name,
+                result_type,
+                app.config["DAYS_UNTIL_TEST_RESULT_STALE"])
 
-    return render_template("results_for_series_single.jinja2",
+    return stream_template("results_for_series_single.jinja2",
                            series_name=series_name,
-                           title=title,
+                           title=titles[result_type],
                            table=table)
 
 
 @app.route("/results/series/<path:series_name>")
+@conditional(series_version)
 def route_view_results_series_landing(series_name):
 
-    series = SeriesSummary(series_name,
-                           app.config["DAYS_UNTIL_TEST_RESULT_STALE"])
+    summary = series_counts(series_name)
+    counts = summary["counts"]
 
     newly_failing_url = url_for(endpoint="route_view_results_series_for_type",
                                 series_name=series_name,
@@ -163,65 +739,272 @@ def route_view_results_series_landing(series_name):
                         series_name=series_name,
                         result_type="stale")
 
-    (newly_failing_stable_count,
-     newly_failing_total_count) = series.get_count_newly_failing_tests()
-
     return render_template(
             "results_for_series_links.jinja2",
             series_name=series_name,
-            total_tests=series.get_count_test_histories(),
+            total_tests=summary["total_tests"],
             newly_failing_url=newly_failing_url,
-            newly_failing_stable_count=newly_failing_stable_count,
-            newly_failing_total_count=newly_failing_total_count,
+            newly_failing_stable_count=counts["newly_failing_stable"],
+            newly_failing_total_count=counts["newly_failing"],
             passing_url=passing_url,
-            passing_count=series.get_count_passing_tests(),
+            passing_count=counts["passing"],
             always_failing_url=always_failing_url,
-            always_failing_count=series.get_count_always_failing_tests(),
+            always_failing_count=counts["always_failing"],
             stale_url=stale_url,
-            stale_count=series.get_count_not_recently_run_tests())
+            stale_count=counts["stale"])
 
 
 @app.route("/results/series/<path:series_name>/test/<path:test_name>")
+@conditional(series_version)
 def route_view_results_series_test(series_name, test_name):
 
-    history = TestHistory(series_name, test_name)
+    tests = TestHistory.iter_tests(series_name, test_name, archive)
 
-    class ItemTable(FormattedTable):
-        test_result = flask_table.Col("Result")
-        batch_timestamp = flask_table.Col("Batch Timestamp")
-        vcs_system = flask_table.Col("VCS")
-        vcs_revision = flask_table.Col("VCS Revision")
-        test_timestamp = flask_table.Col("Test Timestamp")
-        metadata = flask_table.Col("Metadata")
+    return stream_template("results_for_single_test_in_series.jinja2",
+                           series_name=series_name,
+                           test_name=test_name,
+                           trend_url=url_for("route_view_trend",
+                                             series_name=series_name,
+                                             test=test_name),
+                           is_stable=TestHistory.query_is_stable(series_name,
+                                                                 test_name),
+                           history_table=HISTORY_TABLE.stream(tests))
+
+
+@app.route("/api/series")
+@conditional(global_version)
+def route_api_series():
+    return jsonify(series=[x[0] for x in SeriesNames.get_all()])
+
+
+@app.route("/api/summary")
+@conditional(global_version)
+def route_api_summary():
+
+    series_names = [x[0] for x in SeriesNames.get_all()]
+
+    return jsonify(series=fan_out_pool.map(series_counts, series_names))
+
+
+@app.route("/api/series/<path:series_name>")
+@conditional(series_version)
+def route_api_series_summary(series_name):
+
+    series = SeriesSummary(series_name,
+                           app.config["DAYS_UNTIL_TEST_RESULT_STALE"])
 
-    table = ItemTable(history.tests)
+    return jsonify(series.as_dict())
 
-    return render_template("results_for_single_test_in_series.jinja2",
+
+@app.route("/api/series/<path:series_name>/test/<path:test_name>")
+@conditional(series_version)
+def route_api_series_test(series_name, test_name):
+
+    history = TestHistory(series_name,
+                          test_name,
+                          app.config["DAYS_UNTIL_TEST_RESULT_STALE"],
+                          archive=archive)
+
+    if not history.tests and not history.archived_tests:
+        abort(404)
+
+    return jsonify(history.as_dict())
+
+
+def _trend(series_name):
+    period = request.args.get("period", "week")
+    if period not in PERIODS:
+        abort(400)
+
+    return Trend(series_name, request.args.get("test"), period)
+
+
+@app.route("/trend/series/<path:series_name>")
+@conditional(series_version)
+def route_view_trend(series_name):
+    """
+    Results of every test in a series, or the one given by ?test=, for each
+    week, or each day with ?period=day.
+    """
+    trend = _trend(series_name)
+
+    points = []
+    for point in trend.points:
+        row = point.as_dict()
+        if point.pass_rate is not None:
+            row["pass_rate"] = "{:.0%}".format(point.pass_rate)
+        if point.duration_mean is not None:
+            row["duration_mean"] = "{:.0f}".format(point.duration_mean)
+        points.append(row)
+
+    return render_template("trend.jinja2",
                            series_name=series_name,
-                           test_name=test_name,
-                           is_stable=history.is_stable,
-                           history_table=table.__html__())
+                           test_name=trend.test_name,
+                           period=trend.period,
+                           trend_table=TREND_TABLE.render(reversed(points)))
+
+
+@app.route("/api/trend/series/<path:series_name>")
+@conditional(series_version)
+def route_api_trend(series_name):
+    return jsonify(_trend(series_name).as_dict())
+
+
+# Formats of /export/series, with the mimetype of each
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+EXPORT_TIMESTAMP_FORMATS = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+
+
+def _export_timestamp(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    for timestamp_format in EXPORT_TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+
+    abort(400)
+
+
+@app.route("/export/series/<path:series_name>")
+def route_export_series(series_name):
+    """
+    Every test in a series as NDJSON, or CSV with ?format=csv, oldest first.
+    ?since= and ?until= limit the batches to a time range, and ?test= (which
+    may be repeated) to the given tests.
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+
+    export = SeriesExport(series_name,
+                          since=_export_timestamp("since"),
+                          until=_export_timestamp("until"),
+                          test_names=request.args.getlist("test"),
+                          page_size=app.config["EXPORT_PAGE_SIZE"])
+
+    if not export.exists():
+        abort(404)
+
+    chunks = export.csv() if export_format == "csv" else export.ndjson()
+    file_name = "{}.{}".format(re.sub(r"[^A-Za-z0-9._-]+", "_", series_name),
+                               export_format)
+
+    return Response(stream_with_context(chunks),
+                    mimetype=EXPORT_FORMATS[export_format],
+                    headers={"Content-Disposition":
+                             "attachment; filename=\"{}\"".format(file_name)})
+
+
+def _server_sent_event(event_id, event, data):
+    return "id: {}\nevent: {}\ndata: {}\n\n".format(event_id,
+                                                    event,
+                                                    json.dumps(data))
+
+
+def _feed_events(feed, event_id, poll_interval, keepalive, timeout):
+    started = time.monotonic()
+    sent = started
+
+    feed.refresh()
+
+    # Clients reconnect after this many milliseconds once the stream ends
+    yield "retry: {}\n\n".format(int(poll_interval * 1000))
+
+    while True:
+        events = feed.events_since(event_id)
+
+        if events is None:
+            event_id = feed.event_id
+            sent = time.monotonic()
+            yield _server_sent_event(event_id, "summary", feed.summary)
+
+        for event in events or []:
+            event_id = event["id"]
+            sent = time.monotonic()
+            yield _server_sent_event(event_id, "update", event["data"])
+
+        now = time.monotonic()
+
+        if now - started >= timeout:
+            return
+
+        if now - sent >= keepalive:
+            sent = now
+            yield ": keepalive\n\n"
+
+        SeriesFeed.wait(poll_interval)
+        feed.refresh(poll_interval)
+
+
+@app.route("/events/series/<path:series_name>")
+def route_events_series(series_name):
+    """
+    Server-Sent Events for a series. A "summary" event with the test counts is
+    sent first, then an "update" event with the new counts and the tests which
+    changed state each time results are added.
+    """
+    days_until_result_stale = app.config["DAYS_UNTIL_TEST_RESULT_STALE"]
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+    poll_interval = app.config["SSE_POLL_INTERVAL"]
+    keepalive = app.config["SSE_KEEPALIVE"]
+    timeout = app.config["SSE_TIMEOUT"]
+
+    def generate():
+        # Only taken once the stream starts, so it is released when it is
+        # closed
+        feed = SeriesFeed.get(series_name, days_until_result_stale)
+        try:
+            yield from _feed_events(feed, last_event_id, poll_interval, keepalive, timeout)
+        finally:
+            feed.release()
+
+    slot = stream_admission.acquire()
+
+    response = Response(generate(),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"})
+    response.call_on_close(lambda: stream_admission.release(slot))
+    return response
 
 
 @app.route("/add_result", methods=["POST"])
 def route_add_result():
 
-    py_data = request.get_json()
+    with ingest_admission.admit():
+        py_data = request.get_json()
 
-    add_batch(py_data, app.config["TEST_HISTORY_SIZE"])
+        with tracing.trace("add_batch") as trace:
+            add_batch(py_data, retention_policies(), archive)
 
-    return "OK"
+    response = app.make_response("OK")
 
+    if trace is not None:
+        logger.info(trace.log_line())
+        response.headers["Server-Timing"] = trace.server_timing()
 
-def create_table(series_name):
+    return response
 
-    x = TestHistory(series_name, "test_name")
 
-    class ItemTable(FormattedTable):
-        test_name = flask_table.Col("Test Name")
-        series_name = flask_table.Col("Series Name")
-        batch_timestamp = flask_table.Col("timestamp")
+@app.errorhandler(Rejected)
+def rejected(error):
+    response = app.response_class("Busy, retry later\n",
+                                  status=error.status,
+                                  mimetype="text/plain")
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
 
-    table = ItemTable(x.tests)
+def create_table(series_name):
+
+    x = TestHistory(series_name, "test_name")
 
-    return table.__html__()
+    return TEST_TABLE.render(x.tests)
@@ -0,0 +1,185 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted. status is the HTTP status to
+    respond with and retry_after the seconds the client should wait.
+    """
+
+    def __init__(self, status, retry_after):
+        super().__init__("Rejected with {}".format(status))
+        self.status = status
+        self.retry_after = retry_after
+
+
+class SlotPool(object):
+    """
+    At most count slots held at once by every thread of every process on the
+    host. Each slot is an exclusive lock on a file, released by the kernel if
+    the holder dies.
+    """
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, "{}.{}.lock".format(name, i))
+                      for i in range(count)]
+
+    def try_acquire(self):
+        """Returns a held slot, or None if every slot is taken."""
+        for path in self.paths:
+            slot = open(path, "a")
+
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+
+        return None
+
+    @staticmethod
+    def release(slot):
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+
+class AdmissionControl(object):
+    """
+    Limits how many requests run at once across all workers. Up to max_queued
+    more wait, for at most queue_timeout seconds, for one to finish. Anything
+    beyond that is turned away immediately, with busy_status. A max_in_flight
+    of 0 admits everything.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self,
+                 directory,
+                 name,
+                 max_in_flight,
+                 max_queued=0,
+                 queue_timeout=0,
+                 retry_after=1,
+                 busy_status=429):
+
+        self.directory = directory
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.busy_status = busy_status
+
+        self.in_flight = SlotPool(directory, name + "-in-flight", max_in_flight)
+        self.queue = SlotPool(directory, name + "-queued", max_queued)
+
+        if max_in_flight:
+            os.makedirs(directory, exist_ok=True)
+
+    def fit(self, worker_slots):
+        """
+        Lowers the limits, if needed, so at least one of worker_slots, the
+        requests the server can handle at once, is never taken by requests
+        running or waiting here. Returns whether they were lowered.
+        """
+        if not self.max_in_flight:
+            return False
+
+        spare = max(worker_slots - 1, 1)
+        max_in_flight = min(self.max_in_flight, spare)
+        max_queued = min(len(self.queue.paths), spare - max_in_flight)
+
+        if max_in_flight == self.max_in_flight and \
+           max_queued == len(self.queue.paths):
+            return False
+
+        logger.warning("Admitting {} and queueing {} requests, rather than {} "
+                       "and {}, to leave one of {} threads free".format(
+                           max_in_flight, max_queued,
+                           self.max_in_flight, len(self.queue.paths),
+                           worker_slots))
+
+        self.max_in_flight = max_in_flight
+        self.in_flight.paths = self.in_flight.paths[:max_in_flight]
+        self.queue.paths = self.queue.paths[:max_queued]
+
+        return True
+
+    def acquire(self):
+        """
+        Admits a request, waiting in the queue if needed, or raises Rejected.
+        Pass what it returns to release() once the request is done.
+        """
+        if not self.max_in_flight:
+            return None
+
+        slot = self.in_flight.try_acquire()
+
+        if slot is None:
+            slot = self._wait_in_queue()
+
+        return slot
+
+    @staticmethod
+    def release(slot):
+        if slot is not None:
+            SlotPool.release(slot)
+
+    @contextmanager
+    def admit(self):
+        slot = self.acquire()
+
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+    def _wait_in_queue(self):
+        queued = self.queue.try_acquire()
+
+        if queued is None:
+            raise Rejected(self.busy_status, self.retry_after)
+
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+
+            while True:
+                time.sleep(self.POLL_INTERVAL)
+
+                slot = self.in_flight.try_acquire()
+                if slot is not None:
+                    return slot
+
+                if time.monotonic() >= deadline:
+                    raise Rejected(503, self.retry_after)
+        finally:
+            SlotPool.release(queued)
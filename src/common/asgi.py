@@ -0,0 +1,192 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import asyncio
+import sys
+import io
+import logging
+from common.threads import ThreadPool
+
+logger = logging.getLogger()
+
+
+def build_environ(scope, body):
+    """
+    Creates the WSGI environ for an ASGI HTTP scope and its request body.
+    """
+    server = scope.get("server") or ("localhost", 80)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = str(scope["client"][0])
+        environ["REMOTE_PORT"] = str(scope["client"][1])
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = "HTTP_" + name
+
+        if key in environ:
+            value = environ[key] + "," + value
+
+        environ[key] = value
+
+    # The whole body has been read, whether or not it was sent chunked
+    environ["CONTENT_LENGTH"] = str(len(body))
+
+    return environ
+
+
+class AsgiApplication(object):
+    """
+    Serves a WSGI application to an ASGI server. The event loop only receives
+    requests and sends responses. Each request, including the generation of a
+    streamed response, runs on a single thread from a bounded pool, as the
+    database connection it uses belongs to that thread.
+
+    So an open stream, e.g. Server-Sent Events or an export, holds a thread
+    until it ends, just as under a threaded WSGI server. Serving through ASGI
+    doesn't let more streams be open at once. asgi.py limits event streams to
+    half the threads, as gunicorn_config.py does.
+    """
+
+    def __init__(self, wsgi_app, threads, startup=None):
+        self.wsgi_app = wsgi_app
+        self.pool = ThreadPool(threads, "asgi")
+        self.startup = startup
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            raise ValueError("Unsupported scope: {}".format(scope["type"]))
+
+        body = await self._read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+
+        await asyncio.wrap_future(self.pool.submit(self._run_request,
+                                                   loop,
+                                                   environ,
+                                                   send))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                if self.startup is not None:
+                    await asyncio.wrap_future(self.pool.submit(self.startup))
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+
+        while True:
+            message = await receive()
+
+            if message["type"] == "http.disconnect":
+                return None
+
+            chunks.append(message.get("body", b""))
+
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    def _run_request(self, loop, environ, send):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and "started" in response:
+                raise exc_info[1].with_traceback(exc_info[2])
+
+            response["start"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin1"),
+                             value.encode("latin1"))
+                            for name, value in headers],
+            }
+
+        def send_message(message):
+            # Blocks until the message has been sent, so a slow client holds
+            # back the generation of the rest of the response
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def send_start():
+            if "started" not in response:
+                response["started"] = True
+                send_message(response["start"])
+
+        app_iter = self.wsgi_app(environ, start_response)
+
+        try:
+            for chunk in app_iter:
+                if not chunk:
+                    continue
+
+                send_start()
+                send_message({"type": "http.response.body",
+                              "body": chunk,
+                              "more_body": True})
+
+            send_start()
+            send_message({"type": "http.response.body",
+                          "body": b"",
+                          "more_body": False})
+
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
@@ -0,0 +1,208 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+
+class MemoryCache(object):
+    """
+    A least recently used cache of bytes held by the current process. Entries
+    are evicted once their total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            self._entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                logger.debug("Evicted from cache: {}".format(evicted_key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SqliteCache(object):
+    """
+    A cache of bytes in an SQLite database, shared by every process on the
+    host which opens the same file. Least recently used entries are evicted
+    once their total size exceeds max_bytes.
+
+    As every process would otherwise write on each hit, the time an entry was
+    last used is only updated every ACCESS_RESOLUTION seconds.
+    """
+
+    ACCESS_RESOLUTION = 60
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Cache (
+        cache_key   TEXT PRIMARY KEY NOT NULL,
+        value       BLOB NOT NULL,
+        size        INTEGER NOT NULL,
+        accessed    INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS cache_accessed ON Cache (accessed);
+    """
+
+    def __init__(self, cache_file, max_bytes):
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connection(self):
+        local = self._local
+
+        # A connection can't be used by a child process after fork()
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(self.cache_file,
+                                         timeout=5,
+                                         isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode = WAL")
+            local.conn.execute("PRAGMA synchronous = OFF")
+            local.conn.executescript(self.SCHEMA)
+            local.pid = os.getpid()
+
+        return local.conn
+
+    def _now(self):
+        return int(time.time()) // self.ACCESS_RESOLUTION
+
+    def get(self, key):
+        """The value of key, or None if it isn't cached or can't be read."""
+        try:
+            conn = self._connection()
+
+            row = conn.execute("SELECT value, accessed FROM Cache WHERE cache_key = ?",
+                               (key,)).fetchone()
+
+            if row is not None:
+                value, accessed = row
+
+                now = self._now()
+                if accessed != now:
+                    conn.execute("UPDATE Cache SET accessed = ? WHERE cache_key = ?",
+                                 (now, key))
+
+        except sqlite3.Error as error:
+            logger.warning("Could not read from cache: {}".format(error))
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Caches value under key, unless it is too large or can't be written."""
+        if len(value) > self.max_bytes:
+            return
+
+        try:
+            self._set(key, value)
+        except sqlite3.Error as error:
+            logger.warning("Could not write to cache: {}".format(error))
+
+    def _set(self, key, value):
+        conn = self._connection()
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""INSERT OR REPLACE INTO Cache
+                            (cache_key, value, size, accessed)
+                            VALUES (?, ?, ?, ?)""",
+                         (key, value, len(value), self._now()))
+
+            size = conn.execute("SELECT TOTAL(size) FROM Cache").fetchone()[0]
+
+            if size > self.max_bytes:
+                self._evict(conn, size - self.max_bytes)
+
+    def _evict(self, conn, excess):
+        evicted = []
+
+        for key, size in conn.execute("""SELECT cache_key, size FROM Cache
+                                         ORDER BY accessed"""):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+
+        conn.executemany("DELETE FROM Cache WHERE cache_key = ?", evicted)
+        logger.debug("Evicted {} entries from cache".format(len(evicted)))
+
+    @property
+    def size(self):
+        return int(self._connection().execute(
+                    "SELECT TOTAL(size) FROM Cache").fetchone()[0])
+
+    def clear(self):
+        self._connection().execute("DELETE FROM Cache")
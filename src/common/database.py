@@ -25,10 +25,16 @@
 ################################################################################
 import uuid
 import sqlite3
+import threading
 import logging
 import os
+from common.metrics import REGISTRY
 
 SCHEMA = """
+-- Lets pages freed by removing results be given back, see retention.py. Only
+-- changes a database created before this once it has been vacuumed.
+PRAGMA auto_vacuum = INCREMENTAL;
+
 CREATE TABLE IF NOT EXISTS Vcs (
     vcs_id          INTEGER PRIMARY KEY,
     vcs_system      TEXT NOT NULL,
@@ -71,11 +77,55 @@ CREATE TABLE IF NOT EXISTS Test (
     FOREIGN KEY(batch_id) REFERENCES Batch(batch_id),
     CONSTRAINT test_in_batch_unique UNIQUE (test_name, batch_id)
 );
+
+-- The batches of a series, oldest first, and the tests of a batch. Also used
+-- to find rows left without any tests when results are removed.
+CREATE INDEX IF NOT EXISTS batch_series ON Batch (series_id, batch_timestamp);
+CREATE INDEX IF NOT EXISTS batch_vcs ON Batch (vcs_id);
+CREATE INDEX IF NOT EXISTS test_batch ON Test (batch_id);
+CREATE INDEX IF NOT EXISTS test_metadata ON Test (metadata_id);
+
+CREATE TABLE IF NOT EXISTS SeriesVersion (
+    series_name         TEXT PRIMARY KEY NOT NULL,
+    last_batch_id       INTEGER,
+    batch_version       INTEGER NOT NULL DEFAULT 0,
+    retention_version   INTEGER NOT NULL DEFAULT 0,
+    last_modified       TIMESTAMP
+);
+
+-- Counts and durations of the removed results of each test, for each day and
+-- week, see rollup.py. By name, as the series may have been removed too.
+CREATE TABLE IF NOT EXISTS Rollup (
+    series_name     TEXT NOT NULL,
+    test_name       TEXT NOT NULL,
+    period          TEXT NOT NULL,
+    period_start    TEXT NOT NULL,
+    pass_count      INTEGER NOT NULL,
+    fail_count      INTEGER NOT NULL,
+    skip_count      INTEGER NOT NULL,
+    duration_count  INTEGER NOT NULL,
+    duration_total  INTEGER NOT NULL,
+    duration_min    INTEGER,
+    duration_max    INTEGER,
+
+    PRIMARY KEY (series_name, period, test_name, period_start)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS DatabaseInstance (
+    instance_id     TEXT NOT NULL
+);
 """
 
 
 logger = logging.getLogger()
 
+# The retention sweep uses window functions, see retention.py
+MIN_SQLITE_VERSION = (3, 25, 0)
+
+QUERY_SECONDS = REGISTRY.histogram("trapp_db_query_duration_seconds",
+                                   "Time taken by each database statement.",
+                                   ["kind"])
+
 
 class DatabaseDebug(object):
     def __init__(self, **kwds):
@@ -84,8 +134,18 @@ class DatabaseDebug(object):
 
 class Database(object):
 
-    _conn = None
-    _is_batch = False
+    # Each thread is given its own connection to the database file
+    _database_file = None
+    _local = threading.local()
+    _connections = []
+    _connections_lock = threading.Lock()
+
+    # Changes each time initialise() is called, so threads reopen connections
+    _generation = None
+
+    # Identifies the database file, to all processes, so anything cached from
+    # another database is not mistaken as current
+    instance_id = None
 
     def __init__(self):
         raise Exception("{} is a singleton".format(self.__class__.__name__))
@@ -93,53 +153,110 @@ class Database(object):
     @classmethod
     def initialise(cls, database_file):
 
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError("SQLite {} or later is needed, Python has {}".format(
+                                   ".".join(str(part) for part in MIN_SQLITE_VERSION),
+                                   sqlite3.sqlite_version))
+
         directory = os.path.dirname(database_file)
         if not os.path.exists(directory):
             logger.debug("Creating database path: {}".format(directory))
             os.makedirs(directory)
 
-        cls._conn = sqlite3.connect(database=database_file,
-                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        cls._database_file = database_file
+        cls._generation = uuid.uuid4().hex
 
-        cur = cls._conn.cursor()
+        cur = cls._connection().cursor()
         cur.executescript(SCHEMA)
 
+        cur.execute("""INSERT INTO DatabaseInstance (instance_id)
+                       SELECT ? WHERE NOT EXISTS (SELECT * FROM DatabaseInstance)""",
+                    (uuid.uuid4().hex,))
+        cls._connection().commit()
+
+        cls.instance_id = cls.query_one("SELECT instance_id FROM DatabaseInstance")
+
         logger.info("Opened database: {}".format(database_file))
 
+    @classmethod
+    def _connection(cls):
+        local = cls._local
+
+        if getattr(local, "generation", None) != cls._generation:
+            # Connections are only used by the thread which opened them, but
+            # may be closed by another in shutdown()
+            local.conn = sqlite3.connect(database=cls._database_file,
+                                         detect_types=sqlite3.PARSE_DECLTYPES,
+                                         check_same_thread=False)
+            local.generation = cls._generation
+            local.is_batch = False
+
+            with cls._connections_lock:
+                cls._connections.append(local.conn)
+
+        return local.conn
+
+    @classmethod
+    def _after_fork(cls):
+        # Connections inherited from the parent must not be used, or closed,
+        # by the child. Threads open new ones when they next need them.
+        cls._local = threading.local()
+        cls._connections = []
+        cls._connections_lock = threading.Lock()
+
     @classmethod
     def shutdown(cls):
-        cls._conn.close()
+        with cls._connections_lock:
+            for conn in cls._connections:
+                conn.close()
+            cls._connections = []
+
+        cls._generation = None
+        cls.instance_id = None
 
     @classmethod
     def query_one(cls, command, args=()):
-        cur = cls._conn.cursor()
-        cur.execute(command, args)
-        result = cur.fetchone()
+        cur = cls._connection().cursor()
+        with QUERY_SECONDS.time(kind="read"):
+            cur.execute(command, args)
+            result = cur.fetchone()
         if result is None:
             return None
         return result[0]
 
     @classmethod
     def query_row(cls, command, args=()):
-        cur = cls._conn.cursor()
-        cur.execute(command, args)
-        result = cur.fetchone()
+        cur = cls._connection().cursor()
+        with QUERY_SECONDS.time(kind="read"):
+            cur.execute(command, args)
+            result = cur.fetchone()
         return result
 
     @classmethod
     def query_rows(cls, command, args=()):
-        cur = cls._conn.cursor()
-        cur.execute(command, args)
-        result = cur.fetchall()
+        cur = cls._connection().cursor()
+        with QUERY_SECONDS.time(kind="read"):
+            cur.execute(command, args)
+            result = cur.fetchall()
         return result
 
+    @classmethod
+    def query_iter(cls, command, args=()):
+        # Rows are fetched from SQLite as the iterator is consumed. Until then
+        # the database is locked against writes, so consume it straight away.
+        cur = cls._connection().cursor()
+        with QUERY_SECONDS.time(kind="read"):
+            cur.execute(command, args)
+        return iter(cur)
+
     @classmethod
     def execute(cls, command, args=()):
-        cur = cls._conn.cursor()
-        cur.execute(command, args)
+        cur = cls._connection().cursor()
+        with QUERY_SECONDS.time(kind="write"):
+            cur.execute(command, args)
 
-        if cls._is_batch is False:
-            cls._conn.commit()
+            if cls._local.is_batch is False:
+                cls._connection().commit()
 
         return cur.lastrowid
 
@@ -157,9 +274,26 @@ class Database(object):
 
     @classmethod
     def start_batch(cls):
-        cls._is_batch = True
+        cls._connection()
+        cls._local.is_batch = True
 
     @classmethod
     def end_batch(cls):
-        cls._conn.commit()
-        cls._is_batch = False
+        with QUERY_SECONDS.time(kind="commit"):
+            cls._connection().commit()
+        cls._local.is_batch = False
+
+    @classmethod
+    def incremental_vacuum(cls):
+        # Gives free pages back to the file system. The pragma frees a page
+        # each step, executescript() steps it to the end, committing first.
+        with QUERY_SECONDS.time(kind="write"):
+            cls._connection().executescript("PRAGMA incremental_vacuum;")
+
+    @classmethod
+    def rollback(cls):
+        cls._connection().rollback()
+        cls._local.is_batch = False
+
+
+os.register_at_fork(after_in_child=Database._after_fork)
@@ -0,0 +1,191 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import re
+from flask import current_app, url_for
+from markupsafe import escape
+
+# flask_table's default text when a table has no rows
+NO_ITEMS = "No Items"
+
+
+def _get_value(item, attr):
+    try:
+        return item[attr]
+    except (KeyError, TypeError):
+        return getattr(item, attr)
+
+
+class Col(object):
+    """
+    A column whose cells hold the escaped value of attr taken from each item.
+    Rendered as flask_table.Col would.
+    """
+
+    def __init__(self, name, attr):
+        self.name = name
+        self.attr = attr
+
+    def compile(self):
+        attr = self.attr
+
+        def td(item):
+            value = _get_value(item, attr)
+            return "<td>{}</td>".format(escape("" if value is None else value))
+
+        return td
+
+
+class _UrlBuilder(object):
+    """
+    Builds the same URL as url_for(endpoint, **values), but looks up the rule
+    for the endpoint only once. Each URL is then assembled from the fixed parts
+    of the rule and the quoted values.
+    """
+
+    def __init__(self, endpoint, arguments):
+        self.endpoint = endpoint
+        self.arguments = arguments
+
+        markers = {argument: "trappurlmarker{}x".format(index)
+                   for index, argument in enumerate(arguments)}
+        order = {marker: argument for argument, marker in markers.items()}
+
+        url = url_for(endpoint, **markers)
+        pieces = re.split("(trappurlmarker[0-9]+x)", url)
+
+        self.fixed = pieces[0::2]
+        self.order = [order[marker] for marker in pieces[1::2]]
+
+        # Not public, so werkzeug may not have them, in which case url_for is
+        # used for every URL
+        rule = next(current_app.url_map.iter_rules(endpoint))
+        converters = getattr(rule, "_converters", None) or {}
+        self.converters = [getattr(converters.get(argument), "to_url", None)
+                           for argument in self.order]
+
+        # Fall back to url_for if this rule builds URLs in some other way
+        sample = {argument: "a b/<&>%?#" for argument in arguments}
+        if sorted(self.order) != sorted(arguments) or None in self.converters or \
+           self._build(sample) != url_for(endpoint, **sample):
+            self.build = self._build_slow
+
+    def _build(self, values):
+        parts = [self.fixed[0]]
+
+        for argument, to_url, fixed in zip(self.order,
+                                           self.converters,
+                                           self.fixed[1:]):
+            parts.append(to_url(values[argument]))
+            parts.append(fixed)
+
+        return "".join(parts)
+
+    def _build_slow(self, values):
+        return url_for(self.endpoint, **values)
+
+    build = _build
+
+
+class LinkCol(Col):
+    """
+    A column whose cells link to endpoint. The URL arguments are taken from
+    each item using url_kwargs, mapping argument names to attributes. Rendered
+    as flask_table.LinkCol would.
+    """
+
+    def __init__(self, name, endpoint, url_kwargs, attr):
+        super(LinkCol, self).__init__(name, attr)
+        self.endpoint = endpoint
+        self.url_kwargs = url_kwargs
+
+    def compile(self):
+        attr = self.attr
+        url_kwargs = self.url_kwargs.items()
+        builder = _UrlBuilder(self.endpoint, sorted(self.url_kwargs))
+
+        def td(item):
+            url = builder.build({argument: _get_value(item, item_attr)
+                                 for argument, item_attr in url_kwargs})
+            value = _get_value(item, attr)
+            return "<td><a href=\"{}\">{}</a></td>".format(
+                        escape(url),
+                        escape("" if value is None else value))
+
+        return td
+
+
+class Table(object):
+    """
+    Renders items as an HTML table, producing the same output as the
+    equivalent flask_table.Table. The column headings are rendered when the
+    table is created and the cells of every row are built in a single pass,
+    so one Table can be shared by every request.
+
+    Rendering needs an application context for any LinkCol.
+    """
+
+    def __init__(self, columns, classes=None):
+        self.columns = columns
+
+        if classes:
+            self.opening = "<table class=\"{}\">".format(
+                                escape(" ".join(classes)))
+        else:
+            self.opening = "<table>"
+
+        self.thead = "<thead><tr>{}</tr></thead>".format(
+                        "".join("<th>{}</th>".format(escape(column.name))
+                                for column in columns))
+
+        self.empty = "<p>{}</p>".format(escape(NO_ITEMS))
+
+    def stream(self, items):
+        """
+        Yields the table a row at a time. items can be a generator, each item
+        is rendered as it is produced and is not kept once written.
+        """
+        items = iter(items)
+
+        for first in items:
+            break
+        else:
+            yield self.empty
+            return
+
+        cells = [column.compile() for column in self.columns]
+
+        def tr(item):
+            return "<tr>" + "".join([td(item) for td in cells]) + "</tr>"
+
+        yield "{}\n{}\n<tbody>\n{}".format(self.opening, self.thead, tr(first))
+
+        for item in items:
+            yield "\n" + tr(item)
+
+        yield "\n</tbody>\n</table>"
+
+    def render(self, items):
+        return "".join(self.stream(items))
@@ -0,0 +1,193 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import time
+import datetime
+import threading
+import tracemalloc
+import logging
+from collections import deque
+from common.profiling import COMPONENTS
+
+logger = logging.getLogger()
+
+# Frames kept of each allocation, enough to find the part of the app under
+# the standard library, jinja2 or sqlite3
+TRACEBACK_FRAMES = 25
+
+# Before Python 3.9 tracemalloc's peak can't be reset, so is the most held
+# since tracing started and the peak of a block isn't known
+PEAK_MEASURED = hasattr(tracemalloc, "reset_peak")
+
+
+def _component(traceback):
+    # The innermost frame in a part of the app names it, e.g. a row fetched by
+    # sqlite3 for common/database.py is counted as Database
+    for frame in reversed(traceback):
+        filename = frame.filename.replace(os.sep, "/")
+        for name, match in COMPONENTS:
+            if match in filename:
+                return name
+    return "other"
+
+
+def summarise_components(differences):
+    """
+    Totals the bytes and blocks of tracemalloc StatisticDiffs, grouped by
+    traceback, for each component.
+    """
+    totals = {name: (0, 0) for name, match in COMPONENTS}
+    totals["other"] = (0, 0)
+
+    for difference in differences:
+        component = _component(difference.traceback)
+        size, count = totals[component]
+        totals[component] = (size + difference.size_diff,
+                             count + difference.count_diff)
+
+    return totals
+
+
+def start():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEBACK_FRAMES)
+
+
+def stop():
+    tracemalloc.stop()
+
+
+def traced_memory():
+    """The bytes held now, and the most held, since tracing started."""
+    return tracemalloc.get_traced_memory()
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+class Account(object):
+    """
+    Measures the memory allocated by a block. peak is the most held at once,
+    above what was held before, or None if PEAK_MEASURED is False. retained
+    is what is still held when hold() is called, or at the end of the block,
+    split into components.
+
+        with Account() as account:
+            summary = SeriesSummary(series_name)
+            account.hold()
+
+    Memory allocated by other threads at the same time is included.
+    """
+
+    def __init__(self):
+        self.peak = None
+        self.retained = None
+        self.components = None
+        self._before = None
+
+    def __enter__(self):
+        start()
+        self._before = _snapshot()
+        self._start_size = tracemalloc.get_traced_memory()[0]
+        if PEAK_MEASURED:
+            tracemalloc.reset_peak()
+        return self
+
+    def hold(self):
+        after = _snapshot()
+        differences = after.compare_to(self._before, "traceback")
+
+        self.retained = sum(difference.size_diff for difference in differences)
+        self.components = summarise_components(differences)
+
+    def __exit__(self, *args):
+        if PEAK_MEASURED:
+            self.peak = max(tracemalloc.get_traced_memory()[1] - self._start_size, 0)
+
+        if self.retained is None:
+            self.hold()
+
+        self._before = None
+
+
+class MemoryMiddleware(object):
+    """
+    Accounts for the memory of every request, including generating any
+    streamed response, which is sent once it has been generated in full.
+    Requests are measured one at a time so their allocations are not mixed.
+    The most recent keep are kept in memory.
+    """
+
+    def __init__(self, wsgi_app, keep=100):
+        self.wsgi_app = wsgi_app
+        self.requests = deque(maxlen=keep)
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if not self.enabled:
+            return self.wsgi_app(environ, start_response)
+
+        status = []
+
+        def measured_start_response(response_status, headers, exc_info=None):
+            status.append(response_status)
+            return start_response(response_status, headers, exc_info)
+
+        with self._lock:
+            started = time.perf_counter()
+
+            with Account() as account:
+                app_iter = self.wsgi_app(environ, measured_start_response)
+                try:
+                    body = list(app_iter)
+                finally:
+                    if hasattr(app_iter, "close"):
+                        app_iter.close()
+
+                # The body is about to be sent, so isn't counted as retained
+                size = sum(len(chunk) for chunk in body)
+
+            duration = time.perf_counter() - started
+
+        self.requests.appendleft(dict(
+            timestamp=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+            method=environ.get("REQUEST_METHOD"),
+            path=environ.get("PATH_INFO", ""),
+            status=status[0] if status else None,
+            duration=duration,
+            peak=account.peak,
+            retained=account.retained - size,
+            components=account.components))
+
+        return body
+
+    def top(self, limit=10):
+        """The lines which hold the most memory, as tracemalloc Statistics."""
+        start()
+        return _snapshot().statistics("lineno")[:limit]
@@ -0,0 +1,450 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import time
+import uuid
+import bisect
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger()
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    return ",".join('{}="{}"'.format(name,
+                                     str(value).replace("\\", "\\\\")
+                                               .replace("\n", "\\n")
+                                               .replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _sample(name, labels):
+    return "{}{{{}}}".format(name, labels) if labels else name
+
+
+class _Metric(object):
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _key(self, labels):
+        try:
+            if len(labels) == len(self.label_names):
+                return tuple(labels[name] for name in self.label_names)
+        except KeyError:
+            pass
+        raise ValueError("{} needs labels {}".format(self.name, self.label_names))
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def reset(self):
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """For counts kept elsewhere, such as cache hits."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.label_names, key), value)
+                    for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def reset(self):
+        # Per label values: [count in each bucket..., count above, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        samples = []
+
+        with self._lock:
+            for key, counts in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    labels = _format_labels(self.label_names + ("le",),
+                                            key + (_format_value(bound),))
+                    samples.append((self.name + "_bucket", labels, cumulative))
+
+                labels = _format_labels(self.label_names, key)
+                samples.append((self.name + "_count", labels, cumulative))
+                samples.append((self.name + "_sum", labels, counts[-1]))
+
+        return samples
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Gauge(object):
+    """A value worked out when the metrics are read, by the process reading them."""
+    type = "gauge"
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        return [] if value is None else [(self.name, "", value)]
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsStore(object):
+    """
+    Totals of every process's metrics, in an SQLite file they all share by
+    the processes on one host. Each process replaces its own rows. Once it
+    has exited they are added to a single set of rows, EXITED, so the totals
+    are kept without a row for every process there has ever been.
+    """
+
+    # The process_id of the totals of every process which has exited
+    EXITED = ""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Sample (
+        process_id  TEXT NOT NULL,
+        name        TEXT NOT NULL,
+        labels      TEXT NOT NULL,
+        value       REAL NOT NULL,
+
+        PRIMARY KEY (process_id, name, labels)
+    );
+
+    CREATE TABLE IF NOT EXISTS Process (
+        process_id  TEXT PRIMARY KEY,
+        pid         INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, metrics_file):
+        self.metrics_file = metrics_file
+        self._local = threading.local()
+
+        directory = os.path.dirname(metrics_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connection(self):
+        local = self._local
+
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(self.metrics_file,
+                                         timeout=5,
+                                         isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode = WAL")
+            local.conn.execute("PRAGMA synchronous = OFF")
+            local.conn.executescript(self.SCHEMA)
+            local.pid = os.getpid()
+
+        return local.conn
+
+    def write(self, process_id, samples):
+        conn = self._connection()
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""INSERT OR REPLACE INTO Process (process_id, pid)
+                            VALUES (?, ?)""", (process_id, os.getpid()))
+            conn.executemany("""INSERT OR REPLACE INTO Sample
+                                (process_id, name, labels, value)
+                                VALUES (?, ?, ?, ?)""",
+                             [(process_id, name, labels, value)
+                              for name, labels, value in samples])
+
+    def _fold(self, conn, process_id):
+        # Adds the process's rows to those of EXITED
+        conn.execute("""INSERT OR IGNORE INTO Sample
+                        (process_id, name, labels, value)
+                        SELECT ?, name, labels, 0 FROM Sample
+                        WHERE process_id = ?""", (self.EXITED, process_id))
+        conn.execute("""UPDATE Sample
+                        SET value = value + (
+                            SELECT Exited.value FROM Sample AS Exited
+                            WHERE Exited.process_id = :process_id
+                            AND Exited.name = Sample.name
+                            AND Exited.labels = Sample.labels)
+                        WHERE process_id = :exited
+                        AND (name, labels) IN (
+                            SELECT name, labels FROM Sample
+                            WHERE process_id = :process_id)""",
+                     dict(process_id=process_id, exited=self.EXITED))
+        conn.execute("DELETE FROM Sample WHERE process_id = ?", (process_id,))
+        conn.execute("DELETE FROM Process WHERE process_id = ?", (process_id,))
+
+    def retire(self, process_id):
+        """Adds the rows of a process which is about to exit to EXITED."""
+        conn = self._connection()
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._fold(conn, process_id)
+
+    def fold_exited(self):
+        """
+        Adds the rows of processes which have exited without retiring, e.g.
+        as they were killed, to EXITED. Returns how many there were.
+        """
+        conn = self._connection()
+        running = {process_id: pid
+                   for process_id, pid in conn.execute("SELECT process_id, pid FROM Process")}
+
+        exited = [process_id
+                  for (process_id,) in conn.execute("""SELECT DISTINCT process_id
+                                                       FROM Sample
+                                                       WHERE process_id != ?""",
+                                                    (self.EXITED,))
+                  if process_id not in running or not _is_running(running[process_id])]
+
+        if exited:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for process_id in exited:
+                    self._fold(conn, process_id)
+
+        return len(exited)
+
+    def read(self):
+        """{(name, labels): total} over every process."""
+        self.fold_exited()
+
+        rows = self._connection().execute("""SELECT name, labels, SUM(value)
+                                             FROM Sample
+                                             GROUP BY name, labels""")
+        return {(name, labels): value for name, labels, value in rows}
+
+    def clear(self):
+        self._connection().execute("DELETE FROM Sample")
+        self._connection().execute("DELETE FROM Process")
+
+
+class Registry(object):
+    """
+    The metrics of this process. With a store they are written out at most
+    every flush_interval seconds, and read back summed over all processes.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.store = None
+        self.flush_interval = 1
+        self.process_id = uuid.uuid4().hex
+        self._flushed = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, function):
+        return self._register(Gauge(name, documentation, function))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Called before the metrics are written out or read."""
+        self.collectors.append(collector)
+        return collector
+
+    def _samples(self):
+        for collector in self.collectors:
+            collector()
+
+        return [sample
+                for metric in self.metrics if metric.type != "gauge"
+                for sample in metric.samples()]
+
+    def flush(self, force=False):
+        if self.store is None:
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            if not force and now - self._flushed < self.flush_interval:
+                # Written out later, in case the process is idle until then
+                if self._timer is None:
+                    self._timer = threading.Timer(self._flushed + self.flush_interval - now,
+                                                  self._flush_later)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self._flushed = now
+
+        try:
+            self.store.write(self.process_id, self._samples())
+        except sqlite3.Error:
+            logger.exception("Could not write metrics")
+
+    def stop(self):
+        """Writes out the metrics now, rather than from a timer later."""
+        with self._lock:
+            timer = self._timer
+            self._timer = None
+
+        if timer is not None:
+            timer.cancel()
+
+        self.flush(force=True)
+
+    def retire(self):
+        """
+        Writes out the metrics and adds them to the totals of exited
+        processes, then starts again from nothing under a new process_id.
+        Call before the process exits.
+        """
+        self.stop()
+
+        if self.store is not None:
+            try:
+                self.store.retire(self.process_id)
+            except sqlite3.Error:
+                logger.exception("Could not write metrics")
+
+        self.after_fork()
+
+    def _flush_later(self):
+        with self._lock:
+            self._timer = None
+        self.flush(force=True)
+
+    def after_fork(self):
+        # The child starts from nothing, as its parent's counts are its own
+        self.process_id = uuid.uuid4().hex
+        self._flushed = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        for metric in self.metrics:
+            if metric.type != "gauge":
+                metric._lock = threading.Lock()
+                metric.reset()
+
+    def render(self):
+        """The metrics of every process in the Prometheus text format."""
+        if self.store is not None:
+            self.flush(force=True)
+            totals = self.store.read()
+        else:
+            totals = {(name, labels): value for name, labels, value in self._samples()}
+
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+
+            if metric.type == "gauge":
+                samples = metric.samples()
+            else:
+                names = {metric.name}
+                if metric.type == "histogram":
+                    names = {metric.name + suffix for suffix in ["_bucket", "_count", "_sum"]}
+                samples = sorted((name, labels, value)
+                                 for (name, labels), value in totals.items()
+                                 if name in names)
+
+            for name, labels, value in samples:
+                lines.append("{} {}".format(_sample(name, labels), _format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+# The metrics of the app
+REGISTRY = Registry()
+
+os.register_at_fork(after_in_child=REGISTRY.after_fork)
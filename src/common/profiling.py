@@ -0,0 +1,239 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import datetime
+import threading
+import logging
+from collections import Counter
+from urllib.parse import parse_qs
+
+logger = logging.getLogger()
+
+# Parts of the app time is totalled for. Matched against the file name, or for
+# built in functions the name, of each profiled function.
+COMPONENTS = [
+    ("SeriesSummary", "models/series_summary.py"),
+    ("TestHistory", "models/test_history.py"),
+    ("TestResult", "models/test_result.py"),
+    ("html_table", "common/html_table.py"),
+    ("flask_table", "flask_table"),
+    ("Database", "common/database.py"),
+    ("sqlite3", "sqlite3"),
+    ("templates", "jinja2"),
+]
+
+EXTENSIONS = [".pstats", ".collapsed", ".json"]
+
+
+def _component(filename, function_name):
+    for name, match in COMPONENTS:
+        if match in filename or (filename == "~" and match in function_name):
+            return name
+    return None
+
+
+def summarise_components(stats):
+    """
+    Totals the time spent in the functions, not including those they call,
+    of each component from a pstats.Stats.
+    """
+    totals = {name: 0.0 for name, match in COMPONENTS}
+
+    for (filename, line, function_name), (cc, nc, tt, ct, callers) in stats.stats.items():
+        component = _component(filename.replace(os.sep, "/"), function_name)
+        if component is not None:
+            totals[component] += tt
+
+    return totals
+
+
+class StackSampler(threading.Thread):
+    """
+    Records the stack of another thread every interval seconds, counting how
+    often each stack is seen. Written out as collapsed stacks these can be
+    turned into a flame graph.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        super().__init__(name="stack sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename),
+                                            code.co_name))
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        with open(path, "w") as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write("{} {}\n".format(stack, count))
+
+
+class ProfilerMiddleware(object):
+    """
+    Profiles requests which send header, or have query in their query string,
+    including generating any streamed response. The response is sent once it
+    has been generated in full.
+
+    For each request a .pstats file, the collapsed stacks and a .json summary
+    are written to directory. Only the most recent keep are kept.
+    """
+
+    def __init__(self,
+                 wsgi_app,
+                 directory,
+                 header="X-Profile",
+                 query="profile",
+                 keep=100,
+                 interval=0.001):
+
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self.query = query
+        self.keep = keep
+        self.interval = interval
+        self.enabled = True
+
+    def is_requested(self, environ):
+        if environ.get(self.environ_key):
+            return True
+        return self.query in parse_qs(environ.get("QUERY_STRING", ""),
+                                      keep_blank_values=True)
+
+    def __call__(self, environ, start_response):
+        if not self.enabled or not self.is_requested(environ):
+            return self.wsgi_app(environ, start_response)
+
+        status = []
+
+        def profiled_start_response(response_status, headers, exc_info=None):
+            status.append(response_status)
+            return start_response(response_status, headers, exc_info)
+
+        profile = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), self.interval)
+
+        started = time.perf_counter()
+        sampler.start()
+        profile.enable()
+
+        try:
+            app_iter = self.wsgi_app(environ, profiled_start_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+        finally:
+            profile.disable()
+            sampler.stop()
+
+        duration = time.perf_counter() - started
+
+        try:
+            self.save(environ, status[0] if status else None, duration, profile, sampler)
+        except OSError:
+            logger.exception("Could not save profile")
+
+        return body
+
+    def save(self, environ, status, duration, profile, sampler):
+        os.makedirs(self.directory, exist_ok=True)
+
+        now = datetime.datetime.utcnow()
+        path = environ.get("PATH_INFO", "")
+
+        name = "{}-{}-{}".format(now.strftime("%Y%m%dT%H%M%S%f"),
+                                 environ.get("REQUEST_METHOD", ""),
+                                 re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:80])
+        base = os.path.join(self.directory, name)
+
+        profile.dump_stats(base + ".pstats")
+        sampler.write_collapsed(base + ".collapsed")
+
+        summary = dict(name=name,
+                       timestamp=now.strftime("%Y-%m-%dT%H:%M:%S"),
+                       method=environ.get("REQUEST_METHOD"),
+                       path=path,
+                       query_string=environ.get("QUERY_STRING", ""),
+                       status=status,
+                       duration=duration,
+                       samples=sum(sampler.stacks.values()),
+                       components=summarise_components(pstats.Stats(profile)))
+
+        with open(base + ".json", "w") as output:
+            json.dump(summary, output, indent=4, sort_keys=True)
+
+        logger.info("Profiled {} {} in {:.3f}s: {}".format(
+                        summary["method"], path, duration, name))
+        self.prune()
+
+    def list_profiles(self):
+        """The summaries of the saved profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        profiles = []
+        for file_name in sorted(os.listdir(self.directory), reverse=True):
+            if file_name.endswith(".json"):
+                with open(os.path.join(self.directory, file_name)) as summary:
+                    profiles.append(json.load(summary))
+
+        return profiles
+
+    def prune(self):
+        names = sorted(file_name[:-len(".json")]
+                       for file_name in os.listdir(self.directory)
+                       if file_name.endswith(".json"))
+
+        for name in names[:max(len(names) - self.keep, 0)]:
+            for extension in EXTENSIONS:
+                path = os.path.join(self.directory, name + extension)
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,173 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import time
+import fcntl
+import threading
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Every ThreadPool, as the threads of the parent don't exist in a forked child
+_pools = weakref.WeakSet()
+
+
+class ThreadPool(object):
+    """
+    A bounded pool of threads for running independent database reads at the
+    same time. SQLite releases the GIL while it executes a query, and every
+    thread has its own connection, so the reads overlap.
+
+    The threads are only started when first needed.
+    """
+
+    def __init__(self, max_workers, name="pool"):
+        self.max_workers = max_workers
+        self.name = name
+        self._executor = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        _pools.add(self)
+
+    def _after_fork(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                                    max_workers=self.max_workers,
+                                    thread_name_prefix=self.name,
+                                    initializer=self._mark_worker)
+            return self._executor
+
+    def _mark_worker(self):
+        self._local.is_worker = True
+
+    def submit(self, function, *args, **kwargs):
+        return self._get_executor().submit(function, *args, **kwargs)
+
+    def map(self, function, items):
+        """
+        Returns [function(item) for item in items], calling function from the
+        pool. A pool thread calling map() runs each item itself, as waiting on
+        the rest of a busy pool could deadlock.
+        """
+        items = list(items)
+
+        if self.max_workers <= 1 or len(items) <= 1 or \
+           getattr(self._local, "is_worker", False):
+            return [function(item) for item in items]
+
+        return list(self._get_executor().map(function, items))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class PeriodicTask(object):
+    """
+    Calls function every interval seconds from a daemon thread. Every process
+    on the host may start one for the same lock_file, only one of them calls
+    function at a time and the others skip that turn. The lock file holds
+    when function last returned, so the others also skip it until interval
+    seconds after that rather than each calling it in turn.
+    """
+
+    def __init__(self, name, interval, function, lock_file):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.lock_file = lock_file
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """
+        Calls function now, unless another process is or called it less than
+        interval seconds ago. Returns if it was called.
+        """
+        with open(self.lock_file, "a+") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            try:
+                lock.seek(0)
+                try:
+                    last = float(lock.read())
+                except ValueError:
+                    last = None
+
+                started = time.time()
+                if last is not None and 0 <= started - last < self.interval:
+                    return False
+
+                self.function()
+
+                lock.truncate(0)
+                lock.write(repr(started))
+                lock.flush()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("{} failed".format(self.name))
+
+
+def _after_fork():
+    for pool in _pools:
+        pool._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,153 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Traces are only recorded while enabled, see TRACE_INGEST
+enabled = False
+
+_local = threading.local()
+
+
+class Trace(object):
+    """The time spent in each span while the trace was current."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.durations = {}
+        self.fields = {}
+        self._stack = []
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+
+    def server_timing(self):
+        """A Server-Timing header value, in milliseconds."""
+        timings = list(self.durations.items())
+        if self.duration is not None:
+            timings.append(("total", self.duration))
+
+        return ", ".join("{};dur={:.2f}".format(name, seconds * 1000)
+                         for name, seconds in timings)
+
+    def log_line(self):
+        """The trace as a line of JSON."""
+        return json.dumps(dict(self.fields,
+                               event=self.name,
+                               duration_ms=round((self.duration or 0) * 1000, 2),
+                               phases_ms={name: round(seconds * 1000, 2)
+                                          for name, seconds in self.durations.items()}),
+                          sort_keys=True)
+
+
+class _Span(object):
+
+    def __init__(self, trace, name, histogram):
+        self.trace = trace
+        self.name = name
+        self.histogram = histogram
+
+    def __enter__(self):
+        if self.trace is not None:
+            # Nested spans are named after those they are in, e.g. save.insert
+            stack = self.trace._stack
+            if stack:
+                self.name = stack[-1] + "." + self.name
+            stack.append(self.name)
+
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.started
+
+        if self.histogram is not None:
+            self.histogram.observe(seconds, phase=self.name)
+
+        if self.trace is not None:
+            self.trace._stack.pop()
+            self.trace.add(self.name, seconds)
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+def span(name, histogram=None):
+    """
+    Times a block for the current trace, and for histogram (by phase) if one
+    is given. Without either nothing is timed.
+    """
+    trace = getattr(_local, "trace", None)
+
+    if trace is None and histogram is None:
+        return _NO_SPAN
+
+    return _Span(trace, name, histogram)
+
+
+def annotate(**fields):
+    """Adds fields to the log line of the current trace, if there is one."""
+    trace = getattr(_local, "trace", None)
+
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+@contextmanager
+def trace(name):
+    """
+    Makes a new Trace current in this thread for the duration of the block,
+    if tracing is enabled. Yields None otherwise.
+    """
+    if not enabled:
+        yield None
+        return
+
+    previous = getattr(_local, "trace", None)
+    _local.trace = new_trace = Trace(name)
+
+    try:
+        yield new_trace
+    finally:
+        new_trace.duration = time.perf_counter() - new_trace.started
+        _local.trace = previous
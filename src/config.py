@@ -5,6 +5,118 @@ LOG_LEVEL = logging.INFO
 
 DATABASE = "data/flask_db.sqlite"
 
+# Lock files shared by every worker to limit concurrent /add_result requests
+ADMISSION_DIRECTORY = "data/admission"
+
 TEST_HISTORY_SIZE = 20
 
+# Retention of the series matching each pattern, as for fnmatch. The first
+# pattern to match applies. "count" is the most results kept of each test, in
+# place of TEST_HISTORY_SIZE, and "days" the age after which results are
+# removed. None doesn't limit either. e.g.
+# {"nightly-*": dict(count=100, days=365), "pr-*": dict(count=5, days=30)}
+RETENTION_POLICIES = {}
+
+# Seconds between sweeps removing every result outside its policy, including
+# those of tests no longer run. One worker sweeps at a time, removing
+# RETENTION_CHUNK_ROWS results in each transaction. 0 disables the sweep.
+RETENTION_SWEEP_INTERVAL = 3600
+RETENTION_CHUNK_ROWS = 500
+
+# Results removed to keep within TEST_HISTORY_SIZE are moved to compressed
+# files here, one for each series, and still shown in the history of a test.
+# None deletes them. tools/archive.py moves results older than a given age.
+ARCHIVE_DIRECTORY = None
+
+# Number of the most recently updated series to cache summaries of at startup
+WARM_UP_SERIES = 5
+
 DAYS_UNTIL_TEST_RESULT_STALE = 0
+
+# Cache-Control header sent with dashboard and API responses. "no-cache" lets
+# browsers and proxies keep a copy but revalidate it (ETag / Last-Modified) on
+# every request. None omits the header.
+CACHE_CONTROL = "no-cache"
+
+# zlib level used to gzip / deflate responses for clients which accept it.
+# 0 disables compression. Responses smaller than COMPRESSION_MIN_SIZE bytes are
+# sent uncompressed unless streamed.
+COMPRESSION_LEVEL = 6
+COMPRESSION_MIN_SIZE = 1024
+
+# Bytes of rendered, and compressed, responses kept
+RESPONSE_CACHE_SIZE = 32 * 1024**2
+
+# Largest response cached, in bytes. Streamed responses are held in memory
+# until they are complete, so are no longer cached once they are larger.
+RESPONSE_CACHE_MAX_ENTRY = 1024**2
+
+# "shared" keeps cached responses in SHARED_CACHE_FILE, used by every worker on
+# the host, "memory" keeps a separate cache in each worker.
+RESPONSE_CACHE_TYPE = "shared"
+SHARED_CACHE_FILE = "data/cache.sqlite"
+
+# Threads asgi.py runs requests on. Each thread has its own database connection.
+ASGI_THREADS = 16
+
+# Threads used to read several series at once, e.g. for /api/summary
+FAN_OUT_THREADS = 4
+
+# Rows read from the database at a time by /export/series. The database is
+# free for writers between each.
+EXPORT_PAGE_SIZE = 1000
+
+# Server-Sent Events. Seconds between checks for results added by other
+# processes, between keepalive comments, and before the stream is closed
+# (clients reconnect automatically).
+SSE_POLL_INTERVAL = 2
+SSE_KEEPALIVE = 15
+SSE_TIMEOUT = 300
+
+# Server-Sent Events streams open at once across all workers. Each holds a
+# thread until it closes, so others are answered with 503, asking the client to
+# retry after SSE_RETRY_AFTER seconds. gunicorn_config.py lowers it, if needed,
+# to half the threads. 0 disables the limit.
+SSE_MAX_STREAMS = 8
+SSE_RETRY_AFTER = 30
+
+# /add_result requests allowed to run at once across all workers, and how many
+# more may wait up to INGEST_QUEUE_TIMEOUT seconds for one to finish. Others
+# are rejected, with 429 if the queue is full or 503 if the wait timed out,
+# asking the client to retry after INGEST_RETRY_AFTER seconds.
+# Waiting requests hold a worker, so INGEST_MAX_IN_FLIGHT + INGEST_MAX_QUEUED
+# must be below the number of workers (times threads) for the dashboard to stay
+# responsive. gunicorn_config.py lowers them if they aren't. Writes to SQLite
+# are one at a time anyway, so requests beyond a few in flight only wait, and
+# clients which don't retry rely on the queue. 0 disables limits.
+INGEST_MAX_IN_FLIGHT = 2
+INGEST_MAX_QUEUED = 8
+INGEST_QUEUE_TIMEOUT = 30
+INGEST_RETRY_AFTER = 5
+
+# Requests are profiled if PROFILING_ENABLED and they have a PROFILE_HEADER
+# header, or PROFILE_QUERY in the query string, e.g. /results?profile. The
+# latest PROFILE_KEEP profiles are saved to PROFILE_DIRECTORY and listed at
+# /debug/profiles.
+PROFILING_ENABLED = False
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY = "profile"
+PROFILE_DIRECTORY = "data/profiles"
+PROFILE_KEEP = 100
+
+# Debugging only, as it slows every request. With MEMORY_PROFILING_ENABLED the
+# peak and retained memory of each request are listed at /debug/memory, for the
+# latest MEMORY_PROFILE_KEEP requests to each worker. Requests are then answered
+# one at a time.
+MEMORY_PROFILING_ENABLED = False
+MEMORY_PROFILE_KEEP = 100
+
+# Times the phases of each request to /add_result, returning them in a
+# Server-Timing header and logging them as a line of JSON.
+TRACE_INGEST = False
+
+# Metrics at /metrics. Each worker writes its own to METRICS_FILE at most every
+# METRICS_FLUSH_INTERVAL seconds, and /metrics reports the total of them all.
+# None reports only the metrics of the worker answering.
+METRICS_FILE = "data/metrics.sqlite"
+METRICS_FLUSH_INTERVAL = 1
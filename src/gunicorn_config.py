@@ -0,0 +1,57 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+# gunicorn settings, e.g.
+#   PYTHONPATH="$PYTHONPATH:src/" gunicorn --config src/gunicorn_config.py app:app
+#
+# The app is imported once before the workers are forked. Each worker then
+# opens its own database connections and warms its caches before it is sent
+# any requests.
+
+bind = "0.0.0.0:8000"
+workers = 2
+preload_app = True
+
+# Each /events stream holds a thread until SSE_TIMEOUT, which would take a
+# sync worker away from every other request
+worker_class = "gthread"
+threads = 8
+
+
+def on_starting(server):
+    # Event streams and results being added never take every thread from the
+    # dashboard
+    import app
+    app.fit_admission(server.cfg.workers * server.cfg.threads)
+
+
+def post_fork(server, worker):
+    import app
+    app.startup()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
@@ -0,0 +1,472 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import re
+import json
+import zlib
+import heapq
+import fcntl
+import itertools
+import struct
+import logging
+import calendar
+import datetime
+from urllib.parse import quote
+from models.test_result import TestResult
+
+logger = logging.getLogger()
+
+# Every chunk starts with this and the length of the rest of the chunk
+CHUNK_MAGIC = b"TRA2"
+CHUNK_HEADER = struct.Struct(">4sI")
+
+# Chunk files are named after the first and last of the moves they hold
+CHUNK_FILE = re.compile(r"(\d+)-(\d+)\.archive")
+CHUNK_NAME = "{:08d}-{:08d}.archive"
+LOCK_FILE = "lock"
+
+# Chunk files aren't merged beyond this many results, so a merge never
+# rewrites much of a series
+MAX_CHUNK_ROWS = 20000
+
+# Columns of the results of each test, compressed together so a history
+# only decompresses the results of its test
+COLUMNS = ["test_result", "batch_timestamp", "test_timestamp", "test_duration",
+           "vcs", "metadata"]
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class ArchivedResult(object):
+    """A test result read back from an archive."""
+
+    __slots__ = ["test_name", "series_name", "batch_timestamp", "test_result",
+                 "vcs_system", "vcs_revision", "metadata", "test_timestamp",
+                 "test_duration"]
+
+    def __init__(self, test_name, series_name, batch_timestamp, test_result,
+                 vcs_system=None, vcs_revision=None, metadata=None,
+                 test_timestamp=None, test_duration=None):
+        self.test_name = test_name
+        self.series_name = series_name
+        self.batch_timestamp = batch_timestamp
+        self.test_result = test_result
+        self.vcs_system = vcs_system
+        self.vcs_revision = vcs_revision
+        self.metadata = metadata
+        self.test_timestamp = test_timestamp
+        self.test_duration = test_duration
+
+    def __repr__(self):
+        return "<{} - name: {} series_name: {} timestamp: \"{}\" test_result: {}>".format(
+                    self.__class__.__name__,
+                    self.test_name,
+                    self.series_name,
+                    self.batch_timestamp,
+                    self.test_result)
+
+    as_dict = TestResult.as_dict
+
+
+def _run_length_encode(values):
+    runs = []
+    for value in values:
+        if runs and runs[-1][0] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+    return runs
+
+
+def _run_length_decode(runs):
+    return [value for value, count in runs for _ in range(count)]
+
+
+def _seconds(timestamp):
+    return calendar.timegm(timestamp.timetuple())
+
+
+def _compress(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+
+
+def encode_chunk(results):
+    """
+    Packs results of one series into a chunk. The results of each test are
+    compressed separately, sorted by time so they compress to runs, and the
+    header lists where each test is, with its rows and newest batch
+    timestamp, so a history only reads the chunks holding its test. Batch
+    timestamps are stored as the seconds since the previous one and test
+    timestamps as seconds after their batch. Revisions and metadata are
+    stored once each.
+    """
+    results = sorted(results, key=lambda result: (result.test_name, result.batch_timestamp))
+
+    tests = {}
+    blocks = []
+    offset = 0
+    vcs_values = {}
+    metadata_values = {}
+
+    for test_name, test_results in itertools.groupby(results, key=lambda result: result.test_name):
+        columns = {name: [] for name in COLUMNS}
+        rows = 0
+        previous = 0
+
+        for result in test_results:
+            batch_seconds = _seconds(result.batch_timestamp)
+
+            columns["test_result"].append(result.test_result)
+            columns["batch_timestamp"].append(batch_seconds - previous)
+            columns["test_timestamp"].append(
+                None if result.test_timestamp is None
+                else _seconds(result.test_timestamp) - batch_seconds)
+            columns["test_duration"].append(result.test_duration)
+            columns["vcs"].append(
+                None if result.vcs_system is None
+                else vcs_values.setdefault((result.vcs_system, result.vcs_revision), len(vcs_values)))
+            columns["metadata"].append(
+                None if result.metadata is None
+                else metadata_values.setdefault(result.metadata, len(metadata_values)))
+
+            rows += 1
+            previous = batch_seconds
+
+        columns["test_result"] = _run_length_encode(columns["test_result"])
+        block = _compress([columns[name] for name in COLUMNS])
+
+        # [offset, length, rows, newest batch timestamp]
+        tests[test_name] = [offset, len(block), rows, previous]
+        blocks.append(block)
+        offset += len(block)
+
+    values = _compress(dict(vcs=list(vcs_values), metadata=list(metadata_values)))
+
+    header = json.dumps(dict(rows=len(results),
+                             tests=tests,
+                             values=[offset, len(values)]),
+                        separators=(",", ":")).encode()
+
+    body = struct.pack(">I", len(header)) + header + b"".join(blocks) + values
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, len(body)) + body
+
+
+class _Chunk(object):
+    """
+    The header of an open chunk file. The results of each test are read
+    from the file, and decompressed, as they are asked for.
+    """
+
+    def __init__(self, chunk_file):
+        header = chunk_file.read(CHUNK_HEADER.size)
+        size = os.fstat(chunk_file.fileno()).st_size
+
+        if len(header) < CHUNK_HEADER.size:
+            raise ValueError("Damaged chunk in {}".format(chunk_file.name))
+        magic, length = CHUNK_HEADER.unpack(header)
+        if magic != CHUNK_MAGIC or CHUNK_HEADER.size + length != size:
+            raise ValueError("Damaged chunk in {}".format(chunk_file.name))
+
+        header_length, = struct.unpack(">I", chunk_file.read(4))
+        header = json.loads(chunk_file.read(header_length).decode())
+
+        self.rows = header["rows"]
+        self.tests = header["tests"]
+
+        self._file = chunk_file
+        self._start = CHUNK_HEADER.size + 4 + header_length
+        self._values_at = header["values"]
+        self._values = None
+
+    def close(self):
+        self._file.close()
+
+    def _read(self, offset, length):
+        self._file.seek(self._start + offset)
+        return json.loads(zlib.decompress(self._file.read(length)).decode())
+
+    def newest(self, test_name):
+        """The newest batch timestamp of a test in the chunk, in seconds."""
+        return self.tests[test_name][3]
+
+    def test_results(self, series_name, test_name):
+        """ArchivedResults of a test, oldest first."""
+        offset, length, rows, newest = self.tests[test_name]
+        test_results, deltas, test_offsets, test_durations, vcs_indexes, metadata_indexes = \
+            self._read(offset, length)
+
+        if self._values is None:
+            self._values = self._read(*self._values_at)
+        vcs_values = self._values["vcs"]
+        metadata_values = self._values["metadata"]
+
+        test_results = _run_length_decode(test_results)
+
+        results = []
+        seconds = 0
+        for index in range(rows):
+            # Deltas are from the start of the test
+            seconds += deltas[index]
+            offset = test_offsets[index]
+            vcs = (None, None) if vcs_indexes[index] is None else vcs_values[vcs_indexes[index]]
+            metadata = metadata_indexes[index]
+
+            results.append(ArchivedResult(
+                test_name,
+                series_name,
+                EPOCH + datetime.timedelta(seconds=seconds),
+                test_results[index],
+                vcs[0],
+                vcs[1],
+                None if metadata is None else metadata_values[metadata],
+                None if offset is None else EPOCH + datetime.timedelta(seconds=seconds + offset),
+                test_durations[index]))
+
+        return results
+
+    def history(self, series_name, test_name):
+        """The results of a test in the chunk, newest first."""
+        return reversed(self.test_results(series_name, test_name))
+
+    def results(self, series_name):
+        """Every result in the chunk, a test at a time."""
+        for test_name in sorted(self.tests, key=lambda name: self.tests[name][0]):
+            yield from self.test_results(series_name, test_name)
+
+
+def merge_history(tests, archived):
+    """
+    Tests from the database and from the archive, both newest first, as one
+    history. An archived result of a batch still in the database, left by a
+    move which didn't finish, is dropped.
+    """
+    timestamp = None
+
+    for test in heapq.merge(tests, archived,
+                            key=lambda test: test.batch_timestamp,
+                            reverse=True):
+        if test.batch_timestamp == timestamp:
+            continue
+        timestamp = test.batch_timestamp
+        yield test
+
+
+class Archive(object):
+    """
+    Results moved out of the database, in a directory for each series in
+    directory. Each move writes a chunk file, only renamed into place once
+    it is on disk, so a crash never leaves a file half written. Small chunk
+    files are merged with the one before them, so a series only has a few to
+    read however many moves it has had.
+    """
+
+    def __init__(self, directory, max_chunk_rows=MAX_CHUNK_ROWS):
+        self.directory = directory
+        self.max_chunk_rows = max_chunk_rows
+
+    def path(self, series_name):
+        return os.path.join(self.directory, quote(series_name, safe=""))
+
+    @staticmethod
+    def _chunk_files(path):
+        """
+        (first, last, name) of each chunk file of a series, oldest first.
+        Files already merged into another, left by a merge which didn't
+        finish, are left out.
+        """
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return []
+
+        files = []
+        for name in names:
+            match = CHUNK_FILE.fullmatch(name)
+            if match:
+                files.append((int(match.group(1)), int(match.group(2)), name))
+
+        # A merged file sorts before those it holds
+        files.sort(key=lambda chunk_file: (chunk_file[0], -chunk_file[1]))
+
+        chunk_files = []
+        for first, last, name in files:
+            if chunk_files and last <= chunk_files[-1][1]:
+                continue
+            chunk_files.append((first, last, name))
+        return chunk_files
+
+    @classmethod
+    def _open_chunks(cls, path):
+        """
+        Opens each chunk file of a series, oldest first, having only read
+        their headers. Open files can still be read once merged and removed.
+        """
+        while True:
+            chunks = []
+            try:
+                for first, last, name in cls._chunk_files(path):
+                    chunk_file = open(os.path.join(path, name), "rb")
+                    try:
+                        chunks.append(_Chunk(chunk_file))
+                    except ValueError as error:
+                        logger.warning(str(error))
+                        chunk_file.close()
+                return chunks
+            except FileNotFoundError:
+                # Merged since being listed, lists them again
+                for chunk in chunks:
+                    chunk.close()
+
+    @staticmethod
+    def _write(path, name, chunk):
+        """Writes a chunk file, renaming it into place once it is on disk."""
+        temporary = os.path.join(path, name + ".tmp")
+
+        with open(temporary, "wb") as chunk_file:
+            chunk_file.write(chunk)
+            chunk_file.flush()
+            os.fsync(chunk_file.fileno())
+
+        os.replace(temporary, os.path.join(path, name))
+
+        directory = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    @classmethod
+    def _rows(cls, path, name):
+        with open(os.path.join(path, name), "rb") as chunk_file:
+            return _Chunk(chunk_file).rows
+
+    def _merge(self, path, series_name, chunk_files):
+        """
+        Merges the last chunk file into the one before it while it is at
+        least half its size, so their sizes halve towards the newest.
+        """
+        rows = [self._rows(path, name) for first, last, name in chunk_files[-2:]]
+
+        while len(rows) == 2 and rows[0] <= 2 * rows[1] and sum(rows) <= self.max_chunk_rows:
+            (first, middle, previous), (start, last, name) = chunk_files[-2:]
+            merged = CHUNK_NAME.format(first, last)
+
+            results = []
+            for chunk_name in [previous, name]:
+                with open(os.path.join(path, chunk_name), "rb") as chunk_file:
+                    results.extend(_Chunk(chunk_file).results(series_name))
+
+            self._write(path, merged, encode_chunk(results))
+            os.remove(os.path.join(path, previous))
+            os.remove(os.path.join(path, name))
+
+            chunk_files[-2:] = [(first, last, merged)]
+            rows[-2:] = [sum(rows)]
+            if len(chunk_files) >= 2:
+                rows.insert(0, self._rows(path, chunk_files[-2][2]))
+
+    @classmethod
+    def _tidy(cls, path):
+        """Removes files left by a write or merge which didn't finish."""
+        keep = set(name for first, last, name in cls._chunk_files(path))
+        keep.add(LOCK_FILE)
+
+        for name in os.listdir(path):
+            if name not in keep:
+                logger.warning("Removing unfinished chunk file {}".format(os.path.join(path, name)))
+                os.remove(os.path.join(path, name))
+
+    def append(self, results):
+        """
+        Adds results, of any series, as a new chunk file of their series.
+        Written to disk before returning, so they can then be removed from
+        the database.
+        """
+        series = {}
+        for result in results:
+            series.setdefault(result.series_name, []).append(result)
+
+        for series_name, series_results in series.items():
+            path = self.path(series_name)
+            os.makedirs(path, exist_ok=True)
+
+            with open(os.path.join(path, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                self._tidy(path)
+                chunk_files = self._chunk_files(path)
+
+                move = chunk_files[-1][1] + 1 if chunk_files else 1
+                name = CHUNK_NAME.format(move, move)
+                self._write(path, name, encode_chunk(series_results))
+
+                chunk_files.append((move, move, name))
+                self._merge(path, series_name, chunk_files)
+
+    def history(self, series_name, test_name):
+        """
+        Yields the archived results of a test, newest first. Only chunks
+        holding the test are read, each once the next result could be in it.
+        """
+        chunks = self._open_chunks(self.path(series_name))
+
+        try:
+            pending = sorted((chunk for chunk in chunks if test_name in chunk.tests),
+                             key=lambda chunk: chunk.newest(test_name))
+
+            # The next result of each chunk read so far, newest on top
+            read = []
+            order = itertools.count()
+
+            while pending or read:
+                while pending and \
+                      (not read or pending[-1].newest(test_name) >= -read[0][0]):
+                    results = pending.pop().history(series_name, test_name)
+                    self._push(read, next(order), results)
+
+                seconds, index, result, results = heapq.heappop(read)
+                yield result
+                self._push(read, index, results)
+        finally:
+            for chunk in chunks:
+                chunk.close()
+
+    @staticmethod
+    def _push(read, index, results):
+        result = next(results, None)
+        if result is not None:
+            heapq.heappush(read, (-_seconds(result.batch_timestamp), index, result, results))
+
+    def results(self, series_name):
+        """Every archived result of a series, in the order they were moved."""
+        chunks = self._open_chunks(self.path(series_name))
+
+        try:
+            for chunk in chunks:
+                yield from chunk.results(series_name)
+        finally:
+            for chunk in chunks:
+                chunk.close()
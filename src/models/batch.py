@@ -27,31 +27,147 @@ import json
 import logging
 from models.test_result import TestResult
 from models.test_history import TestHistory
+from models.series_version import SeriesVersion
+from models.series_feed import SeriesFeed
+from models.retention import RetentionPolicies
 from common.database import Database
+from common.metrics import REGISTRY
+import common.tracing as tracing
 
 logger = logging.getLogger()
 
+BATCHES_INGESTED = REGISTRY.counter("trapp_ingest_batches_total",
+                                    "Requests to add results which succeeded.")
 
-def add_batch(json_data, limit_test_results):
+ROWS_INGESTED = REGISTRY.counter("trapp_ingest_rows_total",
+                                 "Test results added.")
 
-    if isinstance(json_data, str):
-        py_data = json.loads(json_data)
-    else:
-        py_data = json_data
+INGEST_PHASE_SECONDS = REGISTRY.histogram("trapp_ingest_phase_seconds",
+                                          "Time taken by each phase of adding results.",
+                                          ["phase"])
 
-    py_data = [py_data] if isinstance(py_data, dict) else py_data
 
+class IdCache(object):
+    """
+    The ids of series, batches, revisions and metadata saved by one writer,
+    so they are only looked up once. Only valid while nothing else removes
+    results, e.g. for an offline import.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.batches = {}
+        self.vcs = {}
+        self.metadata = {}
+
+    def ids(self, entry):
+        series_name = entry["series_name"]
+
+        return dict(series_id=self.series.get(series_name),
+                    batch_id=self.batches.get((series_name, entry["batch_timestamp"])),
+                    vcs_id=self.vcs.get((entry.get("vcs_system"), entry.get("vcs_revision"))),
+                    metadata_id=self.metadata.get(entry.get("metadata")))
+
+    def add(self, entry, result):
+        self.series[result.series_name] = result.series_id
+        self.batches[(result.series_name, entry["batch_timestamp"])] = result.batch_id
+
+        if result.vcs_id is not None:
+            self.vcs[(result.vcs_system, result.vcs_revision)] = result.vcs_id
+
+        if result.metadata_id is not None:
+            self.metadata[result.metadata] = result.metadata_id
+
+
+def save_results(py_data, id_cache=None):
+    """
+    Saves a list of results, as accepted by add_batch, and records the new
+    version of each series. Results already in the database are skipped.
+    Returns the latest batch_id of each series. Nothing is committed.
+    """
+    batches = {}
+    with tracing.span("save", INGEST_PHASE_SECONDS):
+        for entry in py_data:
+            with tracing.span("resolve"):
+                if id_cache is None:
+                    result = TestResult(**entry)
+                else:
+                    result = TestResult(**entry, **id_cache.ids(entry))
+            result.db_save()
+
+            if id_cache is not None:
+                id_cache.add(entry, result)
+
+            batches[result.series_name] = max(result.batch_id,
+                                              batches.get(result.series_name, 0))
+
+    with tracing.span("version", INGEST_PHASE_SECONDS):
+        for series_name, batch_id in batches.items():
+            SeriesVersion.record_batch(series_name, batch_id)
+
+    return batches
+
+
+def add_batch(json_data, limit_test_results, archive=None):
+    """
+    Adds results, then removes the oldest of each of their tests beyond
+    limit_test_results, a count or the RetentionPolicies giving one for each
+    series. Those removed are moved to archive, if given.
+    """
+
+    with tracing.span("parse", INGEST_PHASE_SECONDS):
+        if isinstance(json_data, str):
+            py_data = json.loads(json_data)
+        else:
+            py_data = json_data
+
+        py_data = [py_data] if isinstance(py_data, dict) else py_data
+
+    # Otherwise a bad result would leave the database locked by this thread
     Database.start_batch()
 
-    for entry in py_data:
-        result = TestResult(**entry)
-        result.db_save()
+    try:
+        batches = save_results(py_data)
 
-    Database.end_batch()
+        with tracing.span("commit", INGEST_PHASE_SECONDS):
+            Database.end_batch()
+
+    except BaseException:
+        Database.rollback()
+        raise
+
+    ROWS_INGESTED.inc(len(py_data))
+    BATCHES_INGESTED.inc()
+    tracing.annotate(rows=len(py_data), series=len(batches))
 
     if limit_test_results:
 
-        for entry in py_data:
-            result = TestResult(**entry)
-            history = TestHistory(result.series_name, result.test_name)
-            history.cleanup_db(limit_test_results)
+        with tracing.span("retention", INGEST_PHASE_SECONDS):
+            # Removed together, and only once any archive has them
+            Database.start_batch()
+
+            try:
+                removed = []
+                for entry in py_data:
+                    limit = limit_test_results
+                    if isinstance(limit, RetentionPolicies):
+                        limit = limit.for_series(entry["series_name"]).count
+                    if not limit:
+                        continue
+
+                    with tracing.span("history"):
+                        result = TestResult(**entry)
+                        history = TestHistory(result.series_name, result.test_name)
+                    removed.extend(history.cleanup_db(limit))
+
+                if archive is not None:
+                    with tracing.span("archive"):
+                        archive.append(removed)
+
+                Database.end_batch()
+
+            except BaseException:
+                Database.rollback()
+                raise
+
+    SeriesFeed.notify(batches)
@@ -0,0 +1,263 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import fnmatch
+import logging
+import datetime
+from models.archive import ArchivedResult
+from models.test_result import SQL_TEST_QUERY
+from models.series_version import SeriesVersion
+import models.rollup as rollup
+from common.database import Database
+from common.metrics import REGISTRY
+
+logger = logging.getLogger()
+
+RETENTION_SWEPT = REGISTRY.counter("trapp_retention_swept_total",
+                                   "Test results removed by the retention sweep.")
+
+# Results removed in each transaction, and the most variables in a statement
+CHUNK_ROWS = 500
+
+SQL_EXPIRED_BY_AGE = """
+SELECT
+    Test.test_id
+FROM Batch
+    INNER JOIN Test
+        ON Test.batch_id = Batch.batch_id
+WHERE Batch.series_id = ? AND Batch.batch_timestamp < ?
+ORDER BY Batch.batch_timestamp
+"""
+
+# The same results as TestHistory.cleanup_db() removes from every test of a
+# series. The last success of each test and the first failure since are kept,
+# and the newest of the rest up to the limit less those kept.
+SQL_EXPIRED_BY_COUNT = """
+WITH History AS (
+    SELECT
+        Test.test_id,
+        Test.test_name,
+        Test.test_result,
+        Batch.batch_timestamp,
+        MAX(CASE WHEN Test.test_result = 'PASS' THEN Batch.batch_timestamp END)
+            OVER (PARTITION BY Test.test_name) AS last_success
+    FROM Batch
+        INNER JOIN Test
+            ON Test.batch_id = Batch.batch_id
+    WHERE Batch.series_id = ?
+),
+FirstFail AS (
+    SELECT
+        test_name,
+        MIN(batch_timestamp) AS first_fail
+    FROM History
+    WHERE test_result = 'FAIL'
+        AND (last_success IS NULL OR batch_timestamp > last_success)
+    GROUP BY test_name
+),
+Milestones AS (
+    SELECT
+        History.test_id,
+        History.test_name,
+        History.batch_timestamp,
+        (History.batch_timestamp IS History.last_success OR
+         History.batch_timestamp IS FirstFail.first_fail) AS milestone
+    FROM History
+        LEFT JOIN FirstFail
+            ON History.test_name = FirstFail.test_name
+),
+Positions AS (
+    SELECT
+        test_id,
+        milestone,
+        batch_timestamp,
+        ROW_NUMBER() OVER (PARTITION BY test_name, milestone
+                           ORDER BY batch_timestamp DESC) AS position,
+        SUM(milestone) OVER (PARTITION BY test_name) AS milestones
+    FROM Milestones
+)
+SELECT
+    test_id
+FROM Positions
+WHERE NOT milestone AND position > MAX(? - milestones, 0)
+ORDER BY batch_timestamp
+"""
+
+SQL_DELETE_UNUSED_BATCH = """
+DELETE FROM Batch WHERE batch_id = ?
+    AND NOT EXISTS (SELECT * FROM Test WHERE Test.batch_id = Batch.batch_id)"""
+
+SQL_DELETE_UNUSED_SERIES = """
+DELETE FROM Series WHERE series_id = ?
+    AND NOT EXISTS (SELECT * FROM Batch WHERE Batch.series_id = Series.series_id)"""
+
+SQL_DELETE_UNUSED_VCS = """
+DELETE FROM Vcs WHERE vcs_id = ?
+    AND NOT EXISTS (SELECT * FROM Batch WHERE Batch.vcs_id = Vcs.vcs_id)"""
+
+SQL_DELETE_UNUSED_METADATA = """
+DELETE FROM Metadata WHERE metadata_id = ?
+    AND NOT EXISTS (SELECT * FROM Test WHERE Test.metadata_id = Metadata.metadata_id)"""
+
+
+class RetentionPolicy(object):
+    """
+    Keeps at most count results of each test in a series, and none of the
+    batches more than days old. None for either doesn't limit it.
+    """
+
+    def __init__(self, count=None, days=None):
+        self.count = count
+        self.days = days
+
+    def __repr__(self):
+        return "<{} - count: {} days: {}>".format(self.__class__.__name__,
+                                                  self.count,
+                                                  self.days)
+
+
+class RetentionPolicies(object):
+    """
+    The policy of each series, from the first pattern, as for fnmatch, which
+    matches its name. Series matching none have the default.
+    """
+
+    def __init__(self, policies, default):
+        self.policies = [(pattern, policy if isinstance(policy, RetentionPolicy)
+                          else RetentionPolicy(**policy))
+                         for pattern, policy in policies.items()]
+        self.default = default
+
+    def for_series(self, series_name):
+        for pattern, policy in self.policies:
+            if fnmatch.fnmatchcase(series_name, pattern):
+                return policy
+        return self.default
+
+
+def expired_by_age(series_id, before):
+    """The results of a series from batches before the given time, oldest first."""
+    return [row[0] for row in Database.query_rows(SQL_EXPIRED_BY_AGE, (series_id, before))]
+
+
+def expired_by_count(series_id, count):
+    """The results of a series beyond the newest count of each test, oldest first."""
+    return [row[0] for row in Database.query_rows(SQL_EXPIRED_BY_COUNT, (series_id, count))]
+
+
+def remove_tests(series_name, test_ids, archive=None, chunk_rows=CHUNK_ROWS):
+    """
+    Removes results of a series, and anything left unused, chunk_rows at a
+    time, each chunk in its own transaction. Each chunk is folded into the
+    rollups first, and moved to the archive if given. Returns the number
+    removed.
+    """
+    removed = 0
+
+    for start in range(0, len(test_ids), chunk_rows):
+        chunk = test_ids[start:start + chunk_rows]
+        variables = ",".join("?" * len(chunk))
+
+        rows = Database.query_rows(SQL_TEST_QUERY + """
+                                   WHERE Test.test_id IN ({})""".format(variables),
+                                   chunk)
+        if not rows:
+            continue
+
+        Database.start_batch()
+
+        try:
+            results = [ArchivedResult(*row[:9]) for row in rows]
+            rollup.fold(results)
+
+            if archive is not None:
+                archive.append(results)
+
+            Database.execute("DELETE FROM Test WHERE test_id IN ({})".format(variables),
+                             chunk)
+
+            for batch_id in set(row[10] for row in rows):
+                Database.execute(SQL_DELETE_UNUSED_BATCH, (batch_id,))
+            for series_id in set(row[11] for row in rows):
+                Database.execute(SQL_DELETE_UNUSED_SERIES, (series_id,))
+            for metadata_id in set(row[12] for row in rows) - {None}:
+                Database.execute(SQL_DELETE_UNUSED_METADATA, (metadata_id,))
+            for vcs_id in set(row[13] for row in rows) - {None}:
+                Database.execute(SQL_DELETE_UNUSED_VCS, (vcs_id,))
+
+            SeriesVersion.record_retention(series_name)
+            Database.end_batch()
+
+        except BaseException:
+            Database.rollback()
+            raise
+
+        removed += len(rows)
+
+        # Gives the freed pages back, if auto_vacuum is incremental
+        Database.incremental_vacuum()
+
+    return removed
+
+
+def enforce(series_name, policy, archive=None, chunk_rows=CHUNK_ROWS, now=None):
+    """Removes the results of a series outside its policy. Returns the number removed."""
+    removed = 0
+
+    series_id = Database.query_one("SELECT series_id FROM Series WHERE series_name = ?",
+                                   (series_name,))
+
+    if series_id is not None and policy.days is not None:
+        now = datetime.datetime.utcnow() if now is None else now
+        before = now - datetime.timedelta(days=policy.days)
+
+        removed += remove_tests(series_name, expired_by_age(series_id, before),
+                                archive, chunk_rows)
+
+    if series_id is not None and policy.count:
+        removed += remove_tests(series_name, expired_by_count(series_id, policy.count),
+                                archive, chunk_rows)
+
+    return removed
+
+
+def sweep(policies, archive=None, chunk_rows=CHUNK_ROWS, now=None):
+    """
+    Enforces the policy of every series. Returns the number of results
+    removed from each.
+    """
+    series_names = [row[0] for row in
+                    Database.query_rows("SELECT series_name FROM Series ORDER BY series_name")]
+
+    removed = {}
+    for series_name in series_names:
+        removed[series_name] = enforce(series_name,
+                                       policies.for_series(series_name),
+                                       archive, chunk_rows, now)
+
+    RETENTION_SWEPT.inc(sum(removed.values()))
+    logger.info("Retention sweep removed {} results".format(sum(removed.values())))
+
+    return removed
@@ -0,0 +1,235 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+from common.database import Database
+from common.metrics import REGISTRY
+
+logger = logging.getLogger()
+
+ROLLUP_FOLDED = REGISTRY.counter("trapp_rollup_folded_total",
+                                 "Test results folded into rollups before being removed.")
+
+# The start of the day, or week from Monday, of a batch, as SQLite date()
+# gives it
+PERIODS = {
+    "day": "date(Batch.batch_timestamp)",
+    "week": "date(Batch.batch_timestamp, 'weekday 0', '-6 days')",
+}
+
+# Creates the rollup of a period, if new, for SQL_FOLD to add to. Rather than
+# an upsert, which needs SQLite 3.24.
+SQL_CREATE_ROLLUP = """
+INSERT OR IGNORE INTO Rollup
+    (series_name, test_name, period, period_start,
+     pass_count, fail_count, skip_count,
+     duration_count, duration_total, duration_min, duration_max)
+VALUES (:series_name, :test_name, :period, :period_start, 0, 0, 0, 0, 0, NULL, NULL)
+"""
+
+SQL_FOLD = """
+UPDATE Rollup SET
+    pass_count = pass_count + :pass_count,
+    fail_count = fail_count + :fail_count,
+    skip_count = skip_count + :skip_count,
+    duration_count = duration_count + :duration_count,
+    duration_total = duration_total + :duration_total,
+    duration_min = IFNULL(MIN(duration_min, :duration_min),
+                          IFNULL(duration_min, :duration_min)),
+    duration_max = IFNULL(MAX(duration_max, :duration_max),
+                          IFNULL(duration_max, :duration_max))
+WHERE series_name = :series_name AND period = :period
+    AND test_name = :test_name AND period_start = :period_start
+"""
+
+SQL_ROLLUP_TREND = """
+SELECT
+    period_start,
+    SUM(pass_count),
+    SUM(fail_count),
+    SUM(skip_count),
+    SUM(duration_count),
+    SUM(duration_total),
+    MIN(duration_min),
+    MAX(duration_max)
+FROM Rollup
+WHERE series_name = ? AND period = ? {}
+GROUP BY period_start
+"""
+
+# The same for the results still in the database
+SQL_TEST_TREND = """
+SELECT
+    {} AS period_start,
+    SUM(Test.test_result = 'PASS'),
+    SUM(Test.test_result = 'FAIL'),
+    SUM(Test.test_result = 'SKIP'),
+    COUNT(Test.test_duration),
+    IFNULL(SUM(Test.test_duration), 0),
+    MIN(Test.test_duration),
+    MAX(Test.test_duration)
+FROM Test
+    INNER JOIN Batch
+        ON Test.batch_id = Batch.batch_id
+    INNER JOIN Series
+        ON Batch.series_id = Series.series_id
+WHERE Series.series_name = ? {}
+GROUP BY period_start
+"""
+
+
+def period_start(timestamp, period):
+    day = timestamp.date()
+    if period == "week":
+        day -= datetime.timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def fold(results):
+    """
+    Adds results, about to be removed, to the rollups of each day and week
+    of their test. Part of the caller's transaction, so should be removed in
+    the same one.
+    """
+    rollups = {}
+
+    for result in results:
+        for period in PERIODS:
+            key = (result.series_name, result.test_name, period,
+                   period_start(result.batch_timestamp, period))
+            rollup = rollups.setdefault(key, [0, 0, 0, 0, 0, None, None])
+
+            rollup[["PASS", "FAIL", "SKIP"].index(result.test_result)] += 1
+
+            duration = result.test_duration
+            if duration is not None:
+                rollup[3] += 1
+                rollup[4] += duration
+                rollup[5] = duration if rollup[5] is None else min(rollup[5], duration)
+                rollup[6] = duration if rollup[6] is None else max(rollup[6], duration)
+
+    for key, rollup in rollups.items():
+        args = dict(zip(["series_name", "test_name", "period", "period_start",
+                         "pass_count", "fail_count", "skip_count",
+                         "duration_count", "duration_total", "duration_min", "duration_max"],
+                        key + tuple(rollup)))
+        Database.execute(SQL_CREATE_ROLLUP, args)
+        Database.execute(SQL_FOLD, args)
+
+    ROLLUP_FOLDED.inc(sum(rollup[0] + rollup[1] + rollup[2]
+                          for key, rollup in rollups.items() if key[2] == "day"))
+
+
+def _ignoring_none(function, *values):
+    values = [value for value in values if value is not None]
+    return function(values) if values else None
+
+
+class TrendPoint(object):
+
+    def __init__(self, period_start, pass_count=0, fail_count=0, skip_count=0,
+                 duration_count=0, duration_total=0, duration_min=None,
+                 duration_max=None):
+        self.period_start = period_start
+        self.pass_count = pass_count
+        self.fail_count = fail_count
+        self.skip_count = skip_count
+        self.duration_count = duration_count
+        self.duration_total = duration_total
+        self.duration_min = duration_min
+        self.duration_max = duration_max
+
+    def add(self, other):
+        self.pass_count += other.pass_count
+        self.fail_count += other.fail_count
+        self.skip_count += other.skip_count
+        self.duration_count += other.duration_count
+        self.duration_total += other.duration_total
+        self.duration_min = _ignoring_none(min, self.duration_min, other.duration_min)
+        self.duration_max = _ignoring_none(max, self.duration_max, other.duration_max)
+
+    @property
+    def pass_rate(self):
+        # Of the results which weren't skipped
+        run = self.pass_count + self.fail_count
+        return self.pass_count / run if run else None
+
+    @property
+    def duration_mean(self):
+        if not self.duration_count:
+            return None
+        return self.duration_total / self.duration_count
+
+    def as_dict(self):
+        return dict(period_start=self.period_start,
+                    pass_count=self.pass_count,
+                    fail_count=self.fail_count,
+                    skip_count=self.skip_count,
+                    pass_rate=self.pass_rate,
+                    duration_min=self.duration_min,
+                    duration_mean=self.duration_mean,
+                    duration_max=self.duration_max)
+
+
+# Results of a test, or every test of a series, counted for each day or week.
+# Removed results are read from their rollups, so the trend goes back further
+# than the history.
+class Trend(object):
+
+    def __init__(self, series_name, test_name=None, period="week"):
+        if period not in PERIODS:
+            raise ValueError("No period {}".format(period))
+
+        self.series_name = series_name
+        self.test_name = test_name
+        self.period = period
+
+        test_clause = "" if test_name is None else "AND test_name = ?"
+        args = (series_name,) if test_name is None else (series_name, test_name)
+
+        rollup_rows = Database.query_rows(SQL_ROLLUP_TREND.format(test_clause),
+                                          (series_name, period) + args[1:])
+
+        test_rows = Database.query_rows(SQL_TEST_TREND.format(
+                                            PERIODS[period],
+                                            test_clause.replace("test_name", "Test.test_name")),
+                                        args)
+
+        points = {}
+        for row in rollup_rows + test_rows:
+            point = TrendPoint(*row)
+            if point.period_start in points:
+                points[point.period_start].add(point)
+            else:
+                points[point.period_start] = point
+
+        self.points = [points[start] for start in sorted(points)]
+
+    def as_dict(self):
+        return dict(series_name=self.series_name,
+                    test_name=self.test_name,
+                    period=self.period,
+                    points=[point.as_dict() for point in self.points])
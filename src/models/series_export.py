@@ -0,0 +1,152 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import io
+import csv
+import json
+import logging
+from models.test_result import SQL_TEST_QUERY
+from common.database import Database
+
+logger = logging.getLogger()
+
+# The fields of each exported test, the same as accepted by add_batch
+FIELDS = ["test_name",
+          "series_name",
+          "batch_timestamp",
+          "test_result",
+          "vcs_system",
+          "vcs_revision",
+          "metadata",
+          "test_timestamp",
+          "test_duration"]
+
+# Timestamps are formatted by SQLite rather than converted to datetimes. The
+# last two columns, the unconverted batch_timestamp and test_id, are where the
+# next page starts.
+SQL_EXPORT = """
+SELECT
+    test_name,
+    series_name,
+    strftime('%Y-%m-%dT%H:%M:%S', batch_timestamp),
+    test_result,
+    vcs_system,
+    vcs_revision,
+    metadata,
+    strftime('%Y-%m-%dT%H:%M:%S', test_timestamp),
+    test_duration,
+    CAST(batch_timestamp AS TEXT),
+    test_id
+FROM (""" + SQL_TEST_QUERY + """
+    WHERE Series.series_name = :series_name
+    AND (Batch.batch_timestamp, Test.test_id) > (:after_timestamp, :after_test_id)
+    {filters}
+)
+ORDER BY batch_timestamp, test_id
+LIMIT :page_size
+"""
+
+
+class SeriesExport(object):
+    """
+    Every test in a series, oldest batch first, optionally only those in
+    batches from since until before until, or with one of test_names.
+
+    Rows are read straight from the database a page at a time, so the
+    database isn't locked, and memory used, for the whole export.
+    """
+
+    def __init__(self,
+                 series_name,
+                 since=None,
+                 until=None,
+                 test_names=None,
+                 page_size=1000):
+
+        self.series_name = series_name
+        self.page_size = page_size
+
+        filters = []
+        self.args = dict(series_name=series_name, page_size=page_size)
+
+        if since is not None:
+            filters.append("AND Batch.batch_timestamp >= :since")
+            self.args["since"] = since
+
+        if until is not None:
+            filters.append("AND Batch.batch_timestamp < :until")
+            self.args["until"] = until
+
+        if test_names:
+            names = {"test_name_{}".format(index): name
+                     for index, name in enumerate(test_names)}
+            filters.append("AND Test.test_name IN ({})".format(
+                               ", ".join(":" + key for key in names)))
+            self.args.update(names)
+
+        self.command = SQL_EXPORT.format(filters="\n    ".join(filters))
+
+    def exists(self):
+        return Database.query_one("""SELECT COUNT () FROM Series
+                                     WHERE series_name = ?""",
+                                  (self.series_name,)) > 0
+
+    def pages(self):
+        """Yields lists of rows, holding FIELDS in order."""
+        args = dict(self.args, after_timestamp="", after_test_id=0)
+
+        while True:
+            page = Database.query_rows(self.command, args)
+
+            if not page:
+                return
+
+            args["after_timestamp"], args["after_test_id"] = page[-1][-2:]
+
+            yield [row[:len(FIELDS)] for row in page]
+
+            if len(page) < self.page_size:
+                return
+
+    def ndjson(self):
+        """Yields the tests as lines of JSON objects, a page at a time."""
+        for page in self.pages():
+            yield "".join(json.dumps(dict(zip(FIELDS, row))) + "\n"
+                          for row in page)
+
+    def csv(self):
+        """Yields the tests as CSV, with a header row, a page at a time."""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(FIELDS)
+
+        for page in self.pages():
+            writer.writerows(page)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+        if output.tell():
+            yield output.getvalue()
@@ -0,0 +1,194 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+from models.series_summary import SeriesSummary
+from models.series_version import SeriesVersion
+from common.database import Database
+from collections import deque
+import threading
+import logging
+import time
+
+logger = logging.getLogger()
+
+
+# Follows the state of every test in a series for Server-Sent Events. A feed
+# is shared by everyone watching the series in this process, so the states are
+# only recomputed once each time the series changes, however many are watching.
+# It is dropped once nobody has watched it for KEEP_IDLE seconds.
+class SeriesFeed(object):
+
+    # Number of past updates kept to replay to clients which reconnect
+    HISTORY = 32
+
+    # Seconds a feed is kept once nobody is watching, for clients which
+    # reconnect after their stream times out
+    KEEP_IDLE = 60
+
+    # Notified whenever results are added in this process
+    changed = threading.Condition()
+
+    _feeds = {}
+    _feeds_lock = threading.Lock()
+
+    def __init__(self, series_name, days_until_result_stale=0):
+        self.series_name = series_name
+        self.days_until_result_stale = days_until_result_stale
+
+        self.event_id = None
+        self.summary = None
+        self.events = deque(maxlen=self.HISTORY)
+
+        self._etag = None
+        self._states = None
+        self._checked = None
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._listeners = 0
+        self._released = None
+
+    @classmethod
+    def get(cls, series_name, days_until_result_stale=0):
+        """The feed of a series, which the caller must release() when done."""
+        key = (series_name, days_until_result_stale)
+
+        with cls._feeds_lock:
+            cls._drop_idle()
+
+            if key not in cls._feeds:
+                cls._feeds[key] = cls(series_name, days_until_result_stale)
+
+            feed = cls._feeds[key]
+            feed._listeners += 1
+            return feed
+
+    def release(self):
+        with self._feeds_lock:
+            self._listeners -= 1
+            self._released = time.monotonic()
+            self._drop_idle()
+
+    @classmethod
+    def _drop_idle(cls):
+        now = time.monotonic()
+
+        for key, feed in list(cls._feeds.items()):
+            if feed._listeners == 0 and now - feed._released >= cls.KEEP_IDLE:
+                del cls._feeds[key]
+
+    @classmethod
+    def notify(cls, series_names):
+        """
+        Called once results for the series have been committed by this
+        process. Other processes find out by polling the SeriesVersion.
+        """
+        with cls._feeds_lock:
+            for (series_name, days), feed in cls._feeds.items():
+                if series_name in series_names:
+                    feed._dirty = True
+
+        with cls.changed:
+            cls.changed.notify_all()
+
+    @classmethod
+    def wait(cls, timeout):
+        with cls.changed:
+            cls.changed.wait(timeout)
+
+    def refresh(self, poll_interval=0):
+        """
+        Checks if the series has changed, at most once every poll_interval
+        seconds unless notified, and records an update if it has.
+        """
+        with self._lock:
+            now = time.monotonic()
+
+            if not self._dirty and now - self._checked < poll_interval:
+                return
+
+            self._dirty = False
+            self._checked = now
+
+            version = SeriesVersion.get(self.series_name)
+            etag = "{}-{}".format(Database.instance_id, version.etag)
+
+            if etag == self._etag:
+                return
+
+            states = dict(SeriesSummary.query_test_states(
+                                self.series_name,
+                                self.days_until_result_stale))
+
+            summary = SeriesSummary.count_states(self.series_name,
+                                                 states.items())
+
+            # Versions only increase, in every process, so are used as the
+            # event ids
+            event_id = version.batch_version + version.retention_version
+
+            if self._states is not None:
+                self.events.append(dict(id=event_id,
+                                        previous_id=self.event_id,
+                                        data=dict(summary,
+                                                  changes=self._changes(states))))
+
+            self.event_id = event_id
+            self.summary = summary
+            self._etag = etag
+            self._states = states
+
+    def _changes(self, states):
+        changes = []
+
+        for test_name in sorted(set(states) | set(self._states)):
+            state = states.get(test_name)
+            previous_state = self._states.get(test_name)
+
+            if state == previous_state:
+                continue
+
+            changes.append(dict(
+                test_name=test_name,
+                state=state.name if state else None,
+                previous_state=previous_state.name if previous_state else None))
+
+        return changes
+
+    def events_since(self, event_id):
+        """
+        The updates a client which has seen event_id has missed. None if they
+        are no longer known, in which case the client needs the summary.
+        """
+        with self._lock:
+            if event_id == self.event_id:
+                return []
+
+            events = [event for event in self.events
+                      if event_id is not None and event["id"] > event_id]
+
+            if not events or events[0]["previous_id"] > event_id:
+                return None
+
+            return events
@@ -26,8 +26,9 @@
 import models.error
 from models.test_history import TestHistory, TestState
 from common.database import Database
+import common.html_table as html_table
 import logging
-import flask_table
+import datetime
 
 logger = logging.getLogger()
 
@@ -44,15 +45,68 @@ ORDER BY Test.test_name
 """
 
 
-class SeriesTable(flask_table.Table):
-    classes = ["table table-striped"]
-    test_name = flask_table.LinkCol("Test Name",
-                                    "route_view_results_series_test",
-                                    url_kwargs=dict(test_name="test_name",
-                                                    series_name="series_name"),
-                                    attr_list="test_name")
+# Works out the same TestState as TestHistory for every test in a series
+# without reading each history
+SQL_TEST_STATES = """
+SELECT
+    test_name,
+    CASE
+        WHEN last_run IS NULL THEN {skipped}
+        WHEN last_run < :stale_threshold THEN {stale}
+        WHEN last_result = 'PASS' THEN {passing}
+        WHEN pass_count > 0 THEN {newly_failing}
+        ELSE {always_failing}
+    END AS state
+FROM (
+    SELECT
+        Test.test_name AS test_name,
+        -- SQLite takes a bare column from the row which holds the MAX()
+        Test.test_result AS last_result,
+        MAX(CASE WHEN Test.test_result != 'SKIP'
+            THEN Batch.batch_timestamp END) AS last_run,
+        SUM(Test.test_result = 'PASS') AS pass_count
+    FROM Test
+        INNER JOIN Batch
+            ON Test.batch_id = Batch.batch_id
+        INNER JOIN Series
+            ON Batch.series_id = Series.series_id
+    WHERE Series.series_name IS :series_name
+    GROUP BY Test.test_name
+)
+""".format(**{state.name: state.value for state in TestState})
 
-    is_stable = flask_table.Col("Considered Stable")
+# The states of the tests listed under each category of the dashboard
+CATEGORY_STATES = {
+    "newly_failing": (TestState.newly_failing,),
+    "passing": (TestState.passing,),
+    "always_failing": (TestState.always_failing,),
+    "stale": (TestState.stale, TestState.skipped),
+}
+
+STATE_CATEGORIES = {state: category
+                    for category, states in CATEGORY_STATES.items()
+                    for state in states}
+
+
+SERIES_TABLE = html_table.Table(
+                [html_table.LinkCol(
+                    "Test Name",
+                    "route_view_results_series_test",
+                    url_kwargs=dict(test_name="test_name",
+                                    series_name="series_name"),
+                    attr="test_name"),
+                 html_table.Col("Considered Stable", "is_stable")],
+                classes=["table table-striped"])
+
+
+# A test as listed in the tables of a SeriesSummary, without its history
+class TestSummary(object):
+
+    def __init__(self, series_name, test_name, state, is_stable):
+        self.series_name = series_name
+        self.test_name = test_name
+        self.state = state
+        self.is_stable = is_stable
 
 
 class SeriesSummary(object):
@@ -81,6 +135,120 @@ class SeriesSummary(object):
         self.passing_tests = [history for history in self.test_histories if history.state == TestState.passing]
         self.stale_tests = [history for history in self.test_histories if history.state == TestState.stale or history.state == TestState.skipped]
 
+    @staticmethod
+    def query_test_states(series_name,
+                          days_until_result_stale=0,
+                          category=None,
+                          datetime_utc_now=None):
+        """
+        Yields the name and TestState of each test in the series, ordered by
+        name. If category is given only tests in that category are returned.
+        """
+        if days_until_result_stale:
+            current_time = datetime.datetime.utcnow() if datetime_utc_now is None else datetime_utc_now
+            stale_threshold = current_time - datetime.timedelta(days=days_until_result_stale)
+        else:
+            stale_threshold = None
+
+        args = dict(series_name=series_name, stale_threshold=stale_threshold)
+
+        where = ""
+        if category is not None:
+            states = CATEGORY_STATES[category]
+            where = "WHERE state IN ({})".format(
+                        ", ".join(str(state.value) for state in states))
+
+        # Read in full, so the database isn't locked while a page listing
+        # the tests is sent
+        rows = Database.query_rows(
+                    """SELECT test_name, state FROM ({})
+                    {}
+                    ORDER BY test_name""".format(SQL_TEST_STATES, where),
+                    args)
+
+        return ((test_name, TestState(state)) for test_name, state in rows)
+
+    @classmethod
+    def iter_tests(cls,
+                   series_name,
+                   category,
+                   days_until_result_stale=0,
+                   datetime_utc_now=None):
+        """
+        Yields a TestSummary for each test in one category, in the order they
+        appear in the tables of a SeriesSummary. Only the histories of tests
+        in the category are read.
+        """
+        states = cls.query_test_states(series_name,
+                                       days_until_result_stale,
+                                       category,
+                                       datetime_utc_now)
+
+        # Stable newly failing tests are listed first
+        unstable_tests = []
+
+        for test_name, state in states:
+            test = TestSummary(series_name,
+                               test_name,
+                               state,
+                               TestHistory.query_is_stable(series_name,
+                                                           test_name))
+
+            if state == TestState.newly_failing and test.is_stable is False:
+                unstable_tests.append(test)
+                continue
+
+            yield test
+
+        for test in unstable_tests:
+            yield test
+
+    @classmethod
+    def count_tests(cls,
+                    series_name,
+                    days_until_result_stale=0,
+                    datetime_utc_now=None):
+        """
+        The same counts as SeriesSummary(series_name).as_dict() without
+        reading the history of every test.
+        """
+        states = cls.query_test_states(series_name,
+                                       days_until_result_stale,
+                                       datetime_utc_now=datetime_utc_now)
+
+        return cls.count_states(series_name, states)
+
+    @staticmethod
+    def count_states(series_name, states):
+        """
+        Counts the tests in each category given the name and TestState of each
+        test, as returned by query_test_states().
+        """
+        counts = {category: 0 for category in CATEGORY_STATES}
+        counts["newly_failing_stable"] = 0
+        total_tests = 0
+
+        for test_name, state in states:
+            total_tests += 1
+            counts[STATE_CATEGORIES[state]] += 1
+
+            if state == TestState.newly_failing and \
+               TestHistory.query_is_stable(series_name, test_name):
+                counts["newly_failing_stable"] += 1
+
+        return dict(series_name=series_name,
+                    total_tests=total_tests,
+                    counts=counts)
+
+    @classmethod
+    def stream_test_table(cls,
+                          series_name,
+                          category,
+                          days_until_result_stale=0):
+        return SERIES_TABLE.stream(cls.iter_tests(series_name,
+                                                  category,
+                                                  days_until_result_stale))
+
     def debug(self):
         logger.debug("test histories in list: " +
                      str(self.get_count_test_histories()))
@@ -109,18 +277,38 @@ class SeriesSummary(object):
     def get_count_not_recently_run_tests(self):
         return len(self.stale_tests)
 
+    def as_dict(self):
+        def summarise(histories):
+            return [dict(test_name=history.test_name,
+                         is_stable=history.is_stable)
+                    for history in histories]
+
+        (newly_failing_stable_count,
+         newly_failing_total_count) = self.get_count_newly_failing_tests()
+
+        return dict(
+            series_name=self.series_name,
+            total_tests=self.get_count_test_histories(),
+            counts=dict(
+                newly_failing=newly_failing_total_count,
+                newly_failing_stable=newly_failing_stable_count,
+                passing=self.get_count_passing_tests(),
+                always_failing=self.get_count_always_failing_tests(),
+                stale=self.get_count_not_recently_run_tests()),
+            tests=dict(
+                newly_failing=summarise(self.newly_failing_tests),
+                passing=summarise(self.passing_tests),
+                always_failing=summarise(self.always_failing_tests),
+                stale=summarise(self.stale_tests)))
+
     def get_always_failing_test_table(self):
-        table = SeriesTable(self.always_failing_tests)
-        return table.__html__()
+        return SERIES_TABLE.render(self.always_failing_tests)
 
     def get_newly_failing_test_table(self):
-        table = SeriesTable(self.newly_failing_tests)
-        return table.__html__()
+        return SERIES_TABLE.render(self.newly_failing_tests)
 
     def get_passing_test_table(self):
-        table = SeriesTable(self.passing_tests)
-        return table.__html__()
+        return SERIES_TABLE.render(self.passing_tests)
 
     def get_stale_test_table(self):
-        table = SeriesTable(self.stale_tests)
-        return table.__html__()
+        return SERIES_TABLE.render(self.stale_tests)
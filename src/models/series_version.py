@@ -0,0 +1,145 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+from common.database import Database
+import logging
+import datetime
+
+logger = logging.getLogger()
+
+SQL_SERIES_VERSION = """
+SELECT
+        SeriesVersion.series_name,
+        SeriesVersion.last_batch_id,
+        SeriesVersion.batch_version,
+        SeriesVersion.retention_version,
+        SeriesVersion.last_modified
+FROM SeriesVersion
+"""
+
+
+# Tracks when the data behind a series last changed. Cheap to look up so that
+# callers can decide whether anything needs recomputing before building a
+# SeriesSummary or TestHistory.
+class SeriesVersion(object):
+
+    def __init__(self,
+                 series_name,
+                 last_batch_id=None,
+                 batch_version=0,
+                 retention_version=0,
+                 last_modified=None):
+
+        self.series_name = series_name
+        self.last_batch_id = last_batch_id
+        self.batch_version = batch_version
+        self.retention_version = retention_version
+        self.last_modified = last_modified
+
+    def __repr__(self):
+        return "<{} {:#08x} - series_name: {} etag: {}>".format(
+                    self.__class__.__name__,
+                    id(self),
+                    self.series_name,
+                    self.etag)
+
+    @property
+    def etag(self):
+        return "{}-{}-{}".format(self.last_batch_id,
+                                 self.batch_version,
+                                 self.retention_version)
+
+    @classmethod
+    def get(cls, series_name):
+        row = Database.query_row(
+                SQL_SERIES_VERSION + """
+                WHERE SeriesVersion.series_name = (?)""",
+                (series_name,))
+
+        if row is None:
+            return cls(series_name)
+
+        return cls(*row)
+
+    @classmethod
+    def get_global(cls):
+        # Summarises every series so that pages listing all series can be
+        # versioned too. Series removed by retention bump their
+        # retention_version so still change the result.
+        row = Database.query_row("""
+                SELECT
+                    MAX(SeriesVersion.last_batch_id),
+                    TOTAL(SeriesVersion.batch_version),
+                    TOTAL(SeriesVersion.retention_version)
+                FROM SeriesVersion""")
+
+        last_modified = Database.query_one("""
+                SELECT SeriesVersion.last_modified FROM SeriesVersion
+                ORDER BY SeriesVersion.last_modified DESC
+                LIMIT 1""")
+
+        return cls(None,
+                   last_batch_id=row[0],
+                   batch_version=int(row[1]),
+                   retention_version=int(row[2]),
+                   last_modified=last_modified)
+
+    @staticmethod
+    def get_recent_series_names(count):
+        """The names of the count series which most recently changed."""
+        rows = Database.query_rows(
+                """SELECT SeriesVersion.series_name FROM SeriesVersion
+                ORDER BY SeriesVersion.last_modified DESC
+                LIMIT (?)""",
+                (count,))
+
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _db_ensure(series_name):
+        Database.execute("""INSERT OR IGNORE INTO SeriesVersion (series_name)
+                         VALUES (?)""",
+                         (series_name,))
+
+    @classmethod
+    def record_batch(cls, series_name, batch_id):
+        cls._db_ensure(series_name)
+        Database.execute(
+                """UPDATE SeriesVersion SET
+                    last_batch_id = MAX(IFNULL(last_batch_id, 0), ?),
+                    batch_version = batch_version + 1,
+                    last_modified = ?
+                WHERE series_name = (?)""",
+                (batch_id, datetime.datetime.utcnow(), series_name))
+
+    @classmethod
+    def record_retention(cls, series_name):
+        cls._db_ensure(series_name)
+        Database.execute(
+                """UPDATE SeriesVersion SET
+                    retention_version = retention_version + 1,
+                    last_modified = ?
+                WHERE series_name = (?)""",
+                (datetime.datetime.utcnow(), series_name))
@@ -25,13 +25,47 @@
 ################################################################################
 import models.error
 from models.test_result import TestResult, SQL_TEST_QUERY
+from models.series_version import SeriesVersion
+from models.archive import merge_history
+import models.rollup as rollup
 from common.database import Database
+from common.metrics import REGISTRY
+import common.tracing as tracing
 import logging
 import datetime
 from enum import Enum, unique
 
 logger = logging.getLogger()
 
+RETENTION_DELETED = REGISTRY.counter("trapp_retention_deleted_total",
+                                     "Test results removed to keep within the limit per test.")
+
+SQL_HISTORY_CLAUSE = """
+WHERE (Test.test_name = ? AND Series.series_name = ?)
+ORDER BY Batch.batch_timestamp DESC
+"""
+
+SQL_TEST_HISTORY = SQL_TEST_QUERY + SQL_HISTORY_CLAUSE
+
+# The history a page at a time, newest first, from before the batch_timestamp
+# and test_id of the last test of the previous page
+SQL_TEST_HISTORY_PAGE = SQL_TEST_QUERY + """
+WHERE (Test.test_name = :test_name AND Series.series_name = :series_name)
+    AND (Batch.batch_timestamp, Test.test_id) < (:before_timestamp, :before_test_id)
+ORDER BY Batch.batch_timestamp DESC, Test.test_id DESC
+LIMIT :page_size
+"""
+
+SQL_TEST_HISTORY_RESULTS = """
+SELECT
+        Test.test_result
+FROM Test
+    INNER JOIN Batch
+        ON Test.batch_id = Batch.batch_id
+    INNER JOIN Series
+        ON Batch.series_id = Series.series_id
+""" + SQL_HISTORY_CLAUSE
+
 
 @unique
 class TestState(Enum):
@@ -42,6 +76,47 @@ class TestState(Enum):
     skipped = 4
 
 
+# TODO - We could do with this logic.
+# For instance, if a test is passing and failing against the same VCS
+# commit.
+def determine_stability(test_results):
+    """
+    Decides if a test is stable from its results, newest first. Only looks at
+    each result once so can be fed directly from a database cursor.
+    """
+    last_result = None
+    pass_count = 0
+    changes_count = 0
+    non_skip_count = 0
+
+    for test_result in test_results:
+
+        if last_result is None:
+            last_result = test_result
+
+        if test_result == "SKIP":
+            continue
+
+        non_skip_count += 1
+
+        if test_result != last_result:
+            changes_count += 1
+            last_result = test_result
+
+        if test_result == "PASS":
+            pass_count += 1
+
+    if non_skip_count == 0:
+        return False
+
+    if pass_count / non_skip_count <= 0.6:
+        return False
+    elif changes_count > non_skip_count / 3:
+        return False
+    else:
+        return True
+
+
 # A history of the same test in the same series
 class TestHistory(object):
 
@@ -49,7 +124,8 @@ class TestHistory(object):
                  series_name,
                  test_name,
                  days_until_result_stale=0,
-                 datetime_utc_now=None):
+                 datetime_utc_now=None,
+                 archive=None):
 
         self.test_name = test_name
         self.series_name = series_name
@@ -60,55 +136,99 @@ class TestHistory(object):
         else:
             self.timestamp_stale_threshold = None
 
-        rows = Database.query_rows(
-                SQL_TEST_QUERY + """
-                WHERE (Test.test_name = ? AND Series.series_name = ?)
-                ORDER BY Batch.batch_timestamp DESC""",
-                (test_name, series_name))
+        rows = Database.query_rows(SQL_TEST_HISTORY, (test_name, series_name))
 
         self.tests = [TestResult(*r) for r in rows]
 
+        # Older results moved out of the database. Only listed, the state of
+        # the test is worked out from those still in the database, unless
+        # every result has been moved.
+        if archive is None:
+            self.archived_tests = []
+        else:
+            self.archived_tests = list(archive.history(series_name, test_name))
+
+        self._recent_tests = self.tests or self.archived_tests
+
         self._determine_if_stable()
         self._get_milestones()
         self._get_state()
         self._get_last_run()
 
+    @staticmethod
+    def query_pages(series_name, test_name, page_size=1000):
+        """
+        Yields the tests of the history, newest first, in lists of at most
+        page_size. Each page is read in full, so the database isn't locked
+        while the last one is used.
+        """
+        args = dict(series_name=series_name,
+                    test_name=test_name,
+                    before_timestamp="9999-12-31",
+                    before_test_id=0,
+                    page_size=page_size)
+
+        while True:
+            page = [TestResult(*row)
+                    for row in Database.query_rows(SQL_TEST_HISTORY_PAGE, args)]
+
+            if not page:
+                return
+
+            args["before_timestamp"] = page[-1].batch_timestamp
+            args["before_test_id"] = page[-1].test_id
+
+            yield page
+
+            if len(page) < page_size:
+                return
+
+    @staticmethod
+    def iter_tests(series_name, test_name, archive=None, page_size=1000):
+        """
+        The same tests as TestHistory(series_name, test_name).tests but read
+        from the database a page at a time as they are used. With an archive,
+        its results are included too, in order.
+        """
+        tests = (test
+                 for page in TestHistory.query_pages(series_name,
+                                                     test_name,
+                                                     page_size)
+                 for test in page)
+
+        if archive is None:
+            return tests
+
+        return merge_history(tests, archive.history(series_name, test_name))
+
+    @staticmethod
+    def query_is_stable(series_name, test_name):
+        """
+        The same as TestHistory(series_name, test_name).is_stable without
+        creating any TestResult objects.
+        """
+        rows = Database.query_iter(SQL_TEST_HISTORY_RESULTS,
+                                   (test_name, series_name))
+        return determine_stability(row[0] for row in rows)
+
+    def as_dict(self):
+        return dict(series_name=self.series_name,
+                    test_name=self.test_name,
+                    is_stable=self.is_stable,
+                    state=self.state.name,
+                    tests=[test.as_dict()
+                           for test in merge_history(self.tests, self.archived_tests)])
+
     def _get_last_run(self):
-        self.last_run = self.tests[0].batch_timestamp
+        self.last_run = self._recent_tests[0].batch_timestamp if self._recent_tests else None
 
-    # TODO - We could do with this logic.
-    # For instance, if a test is passing and failing against the same VCS
-    # commit.
     def _determine_if_stable(self):
-        last_result = self.tests[0].test_result
-        pass_count = 0
-        changes_count = 0
-
-        non_skips = [test for test in self.tests if test.test_result != "SKIP"]
-
-        if len(non_skips) == 0:
-            self.is_stable = False
-            return
-
-        for test in non_skips:
-
-            if test.test_result != last_result:
-                changes_count += 1
-                last_result = test.test_result
-
-            if test.test_result == "PASS":
-                pass_count += 1
-
-        if pass_count / len(non_skips) <= 0.6:
-            self.is_stable = False
-        elif changes_count > len(non_skips) / 3:
-            self.is_stable = False
-        else:
-            self.is_stable = True
+        self.is_stable = determine_stability(test.test_result
+                                             for test in self._recent_tests)
 
     def _get_state(self):
 
-        non_skipped_tests = [test for test in self.tests if test.test_result != "SKIP"]
+        non_skipped_tests = [test for test in self._recent_tests if test.test_result != "SKIP"]
 
         if len(non_skipped_tests) == 0:
             self.state = TestState.skipped
@@ -139,7 +259,7 @@ class TestHistory(object):
         self.not_recently_run = False
         self.always_skipped = False
 
-        for test in self.tests:
+        for test in self._recent_tests:
             if self.last_success is None:
                 if test.test_result == "PASS":
                     self.last_success = test
@@ -151,8 +271,12 @@ class TestHistory(object):
     # TODO - potentially could use VCS as part of batch consideration - remove
     # tests with same VCS? (Would all have to have the same result)
     def cleanup_db(self, keep_count):
+        """
+        Deletes the oldest results beyond keep_count, except the milestones,
+        and returns them. They are still counted in the rollups of the test.
+        """
         if len(self.tests) <= keep_count:
-            return
+            return []
 
         entires_to_remove = len(self.tests) - keep_count
 
@@ -182,7 +306,16 @@ class TestHistory(object):
             logger.debug("Going to remove {}".format(str(test)))
             removed_tests.append(test)
             entires_to_remove -= 1
-            test.db_delete()
+            with tracing.span("delete"):
+                test.db_delete()
 
         for removed_test in removed_tests:
             self.tests.remove(removed_test)
+
+        rollup.fold(removed_tests)
+
+        if removed_tests:
+            RETENTION_DELETED.inc(len(removed_tests))
+            SeriesVersion.record_retention(self.series_name)
+
+        return removed_tests
@@ -26,6 +26,7 @@
 import models.error as error
 import logging
 from common.database import Database
+import common.tracing as tracing
 import json
 import datetime
 
@@ -34,6 +35,11 @@ logger = logging.getLogger()
 TEST_RESULTS = ["PASS", "FAIL", "SKIP"]
 TIMESTAMP_FORMAT = "%Y-%m-%d{}%H:%M:%S"
 
+# Fields which must be given to add a result, and those which may be
+MANDATORY_FIELDS = ["test_name", "series_name", "batch_timestamp", "test_result"]
+OPTIONAL_FIELDS = ["vcs_system", "vcs_revision", "metadata", "test_timestamp",
+                   "test_duration"]
+
 SQL_TEST_QUERY = """
 SELECT
         Test.test_name,
@@ -144,6 +150,23 @@ class TestResult(object):
 
         return True
 
+    def as_dict(self):
+        # Same fields, and timestamp format, as accepted by add_batch
+        def timestamp_to_string(timestamp):
+            if timestamp is None:
+                return None
+            return timestamp.strftime(TIMESTAMP_FORMAT.format("T"))
+
+        return dict(test_name=self.test_name,
+                    series_name=self.series_name,
+                    batch_timestamp=timestamp_to_string(self.batch_timestamp),
+                    test_result=self.test_result,
+                    vcs_system=self.vcs_system,
+                    vcs_revision=self.vcs_revision,
+                    metadata=self.metadata,
+                    test_timestamp=timestamp_to_string(self.test_timestamp),
+                    test_duration=self.test_duration)
+
     def _db_test_save(self):
 
         if self.test_id is not None:
@@ -270,11 +293,12 @@ class TestResult(object):
                             (self.batch_timestamp, self.series_id))
 
     def db_save(self):
-        self._db_vcs_save()
-        self._db_metadata_save()
-        self._db_series_save()
-        self._db_batch_save()
-        self._db_test_save()
+        with tracing.span("insert"):
+            self._db_vcs_save()
+            self._db_metadata_save()
+            self._db_series_save()
+            self._db_batch_save()
+            self._db_test_save()
 
     def db_delete(self):
         Database.execute("""DELETE FROM Test WHERE Test.test_id = (?)""",
@@ -396,6 +420,35 @@ class TestResult(object):
 
         return True
 
+    @classmethod
+    def validate(cls, entry):
+        """
+        Checks a result, as accepted by add_batch, could be added without
+        touching the database. Raises a UserError if not. Returns the result
+        with its timestamps as datetimes.
+        """
+        if not isinstance(entry, dict):
+            raise error.InvalidArgument("Result is not an object")
+
+        missing = [field for field in MANDATORY_FIELDS if entry.get(field) is None]
+        if missing:
+            raise error.InvalidArgument("Missing {}".format(", ".join(missing)))
+
+        unknown = set(entry) - set(MANDATORY_FIELDS) - set(OPTIONAL_FIELDS)
+        if unknown:
+            raise error.InvalidArgument("Unknown {}".format(", ".join(sorted(unknown))))
+
+        if entry["test_result"] not in TEST_RESULTS:
+            raise error.InvalidArgument(
+                    "Result was {}".format(entry["test_result"]))
+
+        entry = dict(entry)
+        for field in ["batch_timestamp", "test_timestamp"]:
+            if isinstance(entry.get(field), str):
+                entry[field] = cls._string_to_datetime(entry[field])
+
+        return entry
+
     @staticmethod
     def _string_to_datetime(timestamp):
         if "T" in timestamp:
@@ -0,0 +1,47 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import os
+import atexit
+import shutil
+import tempfile
+
+# Files the app shares between its workers are kept out of the data directory
+# while testing, in a directory of their own removed afterwards
+_directory = tempfile.mkdtemp(prefix="trapp-test-")
+atexit.register(shutil.rmtree, _directory, True)
+
+_settings_file = os.path.join(_directory, "settings.py")
+with open(_settings_file, "w") as settings:
+    settings.write("METRICS_FILE = {!r}\n".format(
+                    os.path.join(_directory, "metrics.sqlite")))
+    settings.write("PROFILE_DIRECTORY = {!r}\n".format(
+                    os.path.join(_directory, "profiles")))
+    settings.write("SHARED_CACHE_FILE = {!r}\n".format(
+                    os.path.join(_directory, "cache.sqlite")))
+    settings.write("ADMISSION_DIRECTORY = {!r}\n".format(
+                    os.path.join(_directory, "admission")))
+
+os.environ["TRAPP_SETTINGS"] = _settings_file
@@ -0,0 +1,250 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import threading
+import time
+import tempfile
+import common.database
+from common.admission import AdmissionControl, Rejected
+import app as app_module
+from app import app, ingest_admission, shutdown
+from unittest import mock
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_admission.sqlite"
+
+DELETE_DB = True
+
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def admission(self, *args):
+        return AdmissionControl(self.directory.name, "test", *args)
+
+    def test_in_flight(self):
+        admission = self.admission(2)
+
+        with admission.admit():
+            with admission.admit():
+                with self.assertRaises(Rejected) as context:
+                    with admission.admit():
+                        pass
+                self.assertEqual(context.exception.status, 429)
+
+            # A slot is free again
+            with admission.admit():
+                pass
+
+    def test_unlimited(self):
+        admission = self.admission(0)
+
+        with admission.admit():
+            with admission.admit():
+                pass
+
+    def test_queue(self):
+        admission = self.admission(1, 1, 5, 3)
+
+        entered = threading.Event()
+        release = threading.Event()
+        queued_done = threading.Event()
+
+        def hold():
+            with admission.admit():
+                entered.set()
+                release.wait(5)
+
+        def queued():
+            with admission.admit():
+                queued_done.set()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        entered.wait(5)
+
+        waiter = threading.Thread(target=queued)
+        waiter.start()
+
+        # Wait until the queue slot has been taken
+        for _ in range(100):
+            slot = admission.queue.try_acquire()
+            if slot is None:
+                break
+            admission.queue.release(slot)
+            time.sleep(0.01)
+
+        with self.assertRaises(Rejected) as context:
+            with admission.admit():
+                pass
+        self.assertEqual(context.exception.status, 429)
+        self.assertEqual(context.exception.retry_after, 3)
+
+        release.set()
+        holder.join()
+        waiter.join()
+        self.assertTrue(queued_done.is_set())
+
+    def test_queue_timeout(self):
+        admission = self.admission(1, 1, 0.1)
+
+        with admission.admit():
+            with self.assertRaises(Rejected) as context:
+                with admission.admit():
+                    pass
+            self.assertEqual(context.exception.status, 503)
+
+    def test_fit(self):
+        admission = self.admission(2, 4)
+        self.assertFalse(admission.fit(8))
+
+        # One of the workers is always left for reading
+        self.assertTrue(admission.fit(4))
+        self.assertEqual(admission.max_in_flight, 2)
+        self.assertEqual(len(admission.queue.paths), 1)
+
+        self.assertTrue(admission.fit(2))
+        self.assertEqual(admission.max_in_flight, 1)
+        self.assertEqual(len(admission.queue.paths), 0)
+
+        with admission.admit():
+            self.assertRaises(Rejected, admission.admit().__enter__)
+
+        # Nothing can be left with a single worker, but requests are admitted
+        admission = self.admission(2, 4)
+        admission.fit(1)
+        self.assertEqual(admission.max_in_flight, 1)
+        self.assertEqual(len(admission.queue.paths), 0)
+
+        self.assertFalse(self.admission(0).fit(1))
+
+    def test_fit_admission(self):
+        ingest = AdmissionControl(self.directory.name, "ingest", 4, 8)
+        streams = AdmissionControl(self.directory.name, "events", 8)
+
+        with mock.patch("app.ingest_admission", ingest):
+            with mock.patch("app.stream_admission", streams):
+                app_module.fit_admission(8)
+
+        # Half the threads for streams, all but one of the rest for results
+        self.assertEqual(streams.max_in_flight, 4)
+        self.assertEqual(ingest.max_in_flight, 3)
+        self.assertEqual(len(ingest.queue.paths), 0)
+
+    def test_route(self):
+        result_data = {
+            "test_name": "test name",
+            "series_name": "admitted",
+            "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+            "test_result": "PASS",
+        }
+
+        def post():
+            return self.client.post("/add_result",
+                                    data=json.dumps(result_data),
+                                    content_type="application/json")
+
+        self.assertEqual(post().status_code, 200)
+
+        # Take every slot, as other workers would
+        slots = [ingest_admission.in_flight.try_acquire()
+                 for _ in range(app.config["INGEST_MAX_IN_FLIGHT"])]
+        queued = [ingest_admission.queue.try_acquire()
+                  for _ in range(app.config["INGEST_MAX_QUEUED"])]
+
+        try:
+            response = post()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers["Retry-After"],
+                             str(app.config["INGEST_RETRY_AFTER"]))
+
+            # Reading is unaffected
+            self.assertEqual(self.client.get("/api/series").status_code, 200)
+
+        finally:
+            for slot in slots + queued:
+                ingest_admission.in_flight.release(slot)
+
+        self.assertEqual(post().status_code, 200)
+
+    def test_route_queues(self):
+        result_data = {
+            "test_name": "test name",
+            "series_name": "queued",
+            "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+            "test_result": "PASS",
+        }
+
+        # Overlapping requests wait for those in flight rather than being
+        # turned away
+        slots = [ingest_admission.in_flight.try_acquire()
+                 for _ in range(app.config["INGEST_MAX_IN_FLIGHT"])]
+        release = threading.Timer(0.2, lambda: [ingest_admission.in_flight.release(slot)
+                                                for slot in slots])
+        release.start()
+
+        try:
+            response = self.client.post("/add_result",
+                                        data=json.dumps(result_data),
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+        finally:
+            release.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import common.database
+from app import app, shutdown
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_api.sqlite"
+
+DELETE_DB = True
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def post_results(self, result_data):
+        response = self.client.post("/add_result",
+                                    data=json.dumps(result_data),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    def get_json(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(response.get_data(as_text=True))
+
+    def test_series_summary(self):
+        result_data = [
+            {
+                "test_name": "passing test",
+                "series_name": "api",
+                "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+                "test_result": "PASS",
+            },
+            {
+                "test_name": "failing test",
+                "series_name": "api",
+                "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+                "test_result": "FAIL",
+            },
+        ]
+
+        self.post_results(result_data)
+
+        response, data = self.get_json("/api/series")
+        self.assertEqual(data["series"], ["api"])
+
+        response, data = self.get_json("/api/series/api")
+        self.assertEqual(data["series_name"], "api")
+        self.assertEqual(data["total_tests"], 2)
+        self.assertEqual(data["counts"]["passing"], 1)
+        self.assertEqual(data["counts"]["always_failing"], 1)
+        self.assertEqual(data["counts"]["newly_failing"], 0)
+        self.assertEqual(data["tests"]["passing"],
+                         [{"test_name": "passing test", "is_stable": True}])
+        self.assertEqual(data["tests"]["always_failing"],
+                         [{"test_name": "failing test", "is_stable": False}])
+
+    def test_test_history(self):
+        result_data = {
+            "test_name": "test name",
+            "series_name": "api",
+            "batch_timestamp": "2018-01-01T10:00:00",
+            "test_result": "PASS",
+            "vcs_system": "git",
+            "vcs_revision": "somesha1",
+            "metadata": "some metadata",
+            "test_timestamp": "2018-01-01T10:01:00",
+            "test_duration": 60
+        }
+
+        self.post_results(result_data)
+
+        response, data = self.get_json("/api/series/api/test/test name")
+        self.assertEqual(data["state"], "passing")
+        self.assertEqual(data["tests"], [result_data])
+
+    def test_etag(self):
+        result_data = {
+            "test_name": "test name",
+            "series_name": "api",
+            "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+            "test_result": "PASS",
+        }
+
+        self.post_results(result_data)
+
+        for url in ["/api/series",
+                    "/api/series/api",
+                    "/api/series/api/test/test name"]:
+
+            response, data = self.get_json(url)
+            etag = response.headers["ETag"]
+            self.assertFalse(etag.startswith("W/"))
+
+            # Unchanged data - not modified
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b"")
+            self.assertEqual(response.headers["ETag"], etag)
+
+        # New data - full response with a new tag
+        response, data = self.get_json("/api/series/api")
+        etag = response.headers["ETag"]
+
+        result_data["batch_timestamp"] = str(datetime.datetime(2018, 1, 2))
+        self.post_results(result_data)
+
+        response, data = self.get_json("/api/series/api",
+                                       headers={"If-None-Match": etag})
+        self.assertNotEqual(response.headers["ETag"], etag)
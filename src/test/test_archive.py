@@ -0,0 +1,283 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import random
+import tempfile
+import datetime
+import json
+import operator
+from common.database import Database
+import models.batch
+from models.archive import Archive, ArchivedResult, merge_history, _Chunk
+from models.test_history import TestHistory
+from models.test_result import TestResult
+from models.series_version import SeriesVersion
+import tools.archive
+from tools.dataset import DatasetShape, generate_batches
+import app
+from unittest import mock
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_archive.sqlite"
+
+DELETE_DB = True
+
+SHAPE = DatasetShape(series=2, batches_per_series=8, tests_per_batch=6,
+                     flake_rate=0.5, fail_rate=0.3, metadata_cardinality=3)
+
+
+def archived(result):
+    return ArchivedResult(**TestResult.validate(result))
+
+
+def newest_first(results):
+    return sorted(results, key=lambda result: result["batch_timestamp"], reverse=True)
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = Archive(self.directory.name)
+
+        self.batches = list(generate_batches(SHAPE))
+        self.results = [result for batch in self.batches for result in batch]
+
+    def tearDown(self):
+        self.directory.cleanup()
+        app.archive = None
+
+        # The tool closes the database
+        Database.initialise(TEST_DATABASE_PATH)
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def history(self, series_name, test_name):
+        return newest_first(result for result in self.results
+                            if result["series_name"] == series_name and
+                            result["test_name"] == test_name)
+
+    def archive_history(self, series_name, test_name):
+        return list(self.archive.history(series_name, test_name))
+
+    def api_history(self, series_name, test_name):
+        response = self.client.get("/api/series/{}/test/{}".format(series_name, test_name))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data(as_text=True))["tests"]
+
+    def test_round_trip(self):
+        self.archive.append(archived(result) for result in self.results[:20])
+        self.archive.append(archived(result) for result in self.results[20:])
+
+        self.assertEqual([result.as_dict() for result in self.archive.history("series 0", "test 1")],
+                         self.history("series 0", "test 1"))
+
+        self.assertEqual(list(self.archive.history("series 0", "missing")), [])
+        self.assertEqual(list(self.archive.history("missing", "test 1")), [])
+
+        # Smaller than the results as JSON
+        path = self.archive.path("series 0")
+        self.assertLess(sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)),
+                        len(repr(self.results)) / 4)
+
+    def test_history_is_read_lazily(self):
+        # A chunk for each batch, in no particular order, and few merged
+        self.archive = Archive(self.directory.name, max_chunk_rows=12)
+        for batch in random.Random(1).sample(self.batches, len(self.batches)):
+            self.archive.append(archived(result) for result in batch)
+        self.assertGreater(len(os.listdir(self.archive.path("series 1"))), 3)
+
+        self.assertEqual([result.as_dict() for result in self.archive.history("series 1", "test 2")],
+                         self.history("series 1", "test 2"))
+
+        # Only the chunk holding the newest result is read for it
+        with mock.patch.object(_Chunk, "test_results", autospec=True,
+                               side_effect=_Chunk.test_results) as results:
+            history = self.archive.history("series 1", "test 2")
+            self.assertEqual(next(history).as_dict(), self.history("series 1", "test 2")[0])
+            self.assertEqual(results.call_count, 1)
+            history.close()
+
+    def test_merging(self):
+        for result in self.results:
+            self.archive.append([archived(result)])
+
+        # Merged into a few files, newest smallest
+        path = self.archive.path("series 0")
+        self.assertLessEqual(len(os.listdir(path)), 8)
+        chunks = self.archive._open_chunks(path)
+        rows = [chunk.rows for chunk in chunks]
+        for chunk in chunks:
+            chunk.close()
+        self.assertEqual(rows, sorted(rows, reverse=True))
+
+        # Merged chunks hold a test at a time
+        key = operator.itemgetter("test_name", "batch_timestamp")
+        self.assertEqual(sorted((result.as_dict() for result in self.archive.results("series 0")), key=key),
+                         sorted((result for result in self.results if result["series_name"] == "series 0"), key=key))
+        self.assertEqual([result.as_dict() for result in self.archive.history("series 0", "test 4")],
+                         self.history("series 0", "test 4"))
+
+    def test_unfinished_chunk_files(self):
+        self.archive.append(archived(result) for result in self.results[:10])
+        self.archive.append(archived(result) for result in self.results[10:20])
+        path = self.archive.path("series 0")
+        self.assertIn("00000001-00000002.archive", os.listdir(path))
+
+        # As if the process died while writing a chunk, and while removing
+        # those it had merged
+        for name in ["00000003-00000003.archive.tmp", "00000002-00000002.archive"]:
+            with open(os.path.join(path, name), "wb") as chunk_file:
+                chunk_file.write(b"partial")
+
+        self.assertEqual(len(list(self.archive.results("series 0"))), 20)
+
+        self.archive.append(archived(result) for result in self.results[20:30])
+        self.assertEqual(len(list(self.archive.results("series 0"))), 30)
+        for name in os.listdir(path):
+            with open(os.path.join(path, name), "rb") as chunk_file:
+                self.assertNotIn(b"partial", chunk_file.read())
+
+    def test_merge_history(self):
+        later = datetime.datetime(2018, 1, 2)
+        earlier = datetime.datetime(2018, 1, 1)
+
+        tests = [ArchivedResult("test", "series", later, "PASS", metadata="database")]
+        archived = [ArchivedResult("test", "series", later, "PASS", metadata="archive"),
+                    ArchivedResult("test", "series", earlier, "FAIL")]
+
+        self.assertEqual([(test.batch_timestamp, test.metadata)
+                          for test in merge_history(tests, archived)],
+                         [(later, "database"), (earlier, None)])
+
+    def test_retention(self):
+        for batch in self.batches:
+            models.batch.add_batch(batch, 3, self.archive)
+
+        in_database = Database.query_one("SELECT COUNT () FROM Test")
+        self.assertLess(in_database, len(self.results))
+        self.assertEqual(in_database + len(list(self.archive.results("series 0"))) +
+                         len(list(self.archive.results("series 1"))),
+                         len(self.results))
+
+        # Moved and deleted together
+        self.assertLessEqual(len(TestHistory("series 1", "test 2").tests), 5)
+
+        app.archive = self.archive
+        for test_name in ["test 0", "test 2", "test 5"]:
+            self.assertEqual(self.api_history("series 1", test_name),
+                             self.history("series 1", test_name))
+
+        response = self.client.get("/results/series/series 1/test/test 2")
+        self.assertEqual(response.get_data(as_text=True).count("<tr>") - 1,
+                         len(self.history("series 1", "test 2")))
+
+        # Only listed, the state is from the database
+        history = TestHistory("series 1", "test 2", archive=self.archive)
+        self.assertEqual(len(history.as_dict()["tests"]), len(self.history("series 1", "test 2")))
+        self.assertEqual(history.is_stable, TestHistory("series 1", "test 2").is_stable)
+
+    def test_move_older_than(self):
+        for batch in self.batches:
+            models.batch.add_batch(batch, 0)
+
+        version = SeriesVersion.get("series 0")
+        now = datetime.datetime(2018, 1, 1, 4) + datetime.timedelta(days=7)
+        cutoff = now - datetime.timedelta(days=7)
+
+        old = [result for result in self.results if result["batch_timestamp"] < cutoff.isoformat()]
+        self.assertTrue(0 < len(old) < len(self.results))
+
+        moved = tools.archive.run(TEST_DATABASE_PATH, self.directory.name, 7, now=now)
+        self.assertEqual(sum(moved.values()), len(old))
+
+        Database.initialise(TEST_DATABASE_PATH)
+        self.assertEqual(Database.query_one("SELECT COUNT () FROM Test"),
+                         len(self.results) - len(old))
+        self.assertEqual(Database.query_one("""SELECT COUNT () FROM Batch
+                                               WHERE batch_timestamp < ?""", (cutoff,)), 0)
+        self.assertNotEqual(SeriesVersion.get("series 0").etag, version.etag)
+
+        # Nothing left to move
+        self.assertEqual(sum(tools.archive.run(TEST_DATABASE_PATH, self.directory.name, 7, now=now).values()), 0)
+
+        Database.initialise(TEST_DATABASE_PATH)
+        app.archive = self.archive
+        self.assertEqual(self.api_history("series 0", "test 3"),
+                         self.history("series 0", "test 3"))
+
+    def test_move_everything(self):
+        for batch in self.batches:
+            models.batch.add_batch(batch, 0)
+
+        self.assertEqual(tools.archive.main([TEST_DATABASE_PATH, self.directory.name,
+                                             "--days", "0", "--series", "series 1"]), 0)
+
+        Database.initialise(TEST_DATABASE_PATH)
+        self.assertEqual(Database.query_rows("SELECT series_name FROM Series"), [("series 0",)])
+        self.assertEqual(len(list(self.archive.results("series 1"))),
+                         sum(1 for result in self.results if result["series_name"] == "series 1"))
+
+        # Still listed, with its state worked out from the archive
+        app.archive = self.archive
+        self.assertEqual(self.api_history("series 1", "test 2"),
+                         self.history("series 1", "test 2"))
+
+        history = TestHistory("series 1", "test 2", archive=self.archive)
+        self.assertEqual(history.tests, [])
+        self.assertEqual(history.last_run,
+                         self.archive_history("series 1", "test 2")[0].batch_timestamp)
+        self.assertNotEqual(history.state.name, "skipped")
+
+        response = self.client.get("/api/series/series 1/test/missing")
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
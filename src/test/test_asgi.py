@@ -0,0 +1,263 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import threading
+import asyncio
+import common.database
+import models.batch
+from models.series_summary import SeriesSummary
+from common.asgi import AsgiApplication
+from app import app, shutdown
+from unittest import mock
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_asgi.sqlite"
+
+DELETE_DB = True
+
+
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+        self.application = AsgiApplication(app, 4)
+
+    def tearDown(self):
+        self.application.pool.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self, series_count=1, test_count=100):
+        results = []
+
+        for series in range(series_count):
+            for day in range(1, 4):
+                for test in range(test_count):
+                    results.append({
+                        "test_name": "test {}".format(test),
+                        "series_name": "series {}".format(series),
+                        "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+                        "test_result": "PASS" if day != 3 or test % 3 else "FAIL",
+                    })
+
+        models.batch.add_batch(json.dumps(results), 0)
+
+    async def request(self, path, method="GET", body=b"", headers=()):
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(name.encode(), value.encode()) for name, value in headers],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 1234),
+        }
+
+        received = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.application(scope, receive, send)
+
+        self.assertEqual(sent[0]["type"], "http.response.start")
+        self.assertFalse(sent[-1]["more_body"])
+
+        return (sent[0]["status"],
+                dict((name.decode(), value.decode()) for name, value in sent[0]["headers"]),
+                b"".join(message["body"] for message in sent[1:]),
+                sent[1:])
+
+    def get(self, path, **kwargs):
+        return asyncio.run(self.request(path, **kwargs))
+
+    def test_routes(self):
+        self.add_results()
+
+        paths = ["/",
+                 "/api/series/series 0",
+                 "/results/series/series 0",
+                 "/results/series/series 0/type/passing",
+                 "/results/series/series 0/test/test 1"]
+
+        for path in paths:
+            status, headers, body, messages = self.get(path)
+            expected = self.client.get(path)
+
+            self.assertEqual(status, 200)
+            self.assertEqual(body, expected.get_data())
+            self.assertEqual(headers["etag"], expected.headers["ETag"])
+
+        status, headers, body, messages = self.get("/results/series/series 0/type/missing")
+        self.assertEqual(status, 404)
+
+    def test_streaming(self):
+        self.add_results(test_count=2000)
+
+        status, headers, body, messages = self.get("/results/series/series 0/type/passing")
+        self.assertEqual(status, 200)
+        self.assertGreater(len(messages), 2)
+
+    def test_not_modified(self):
+        self.add_results()
+
+        status, headers, body, messages = self.get("/api/series")
+        status, headers, body, messages = self.get("/api/series",
+                                                   headers=[("If-None-Match", headers["etag"])])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+
+    def test_add_result(self):
+        result_data = {
+            "test_name": "test name",
+            "series_name": "posted",
+            "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+            "test_result": "PASS",
+        }
+
+        status, headers, body, messages = self.get(
+                                            "/add_result",
+                                            method="POST",
+                                            body=json.dumps(result_data).encode(),
+                                            headers=[("Content-Type", "application/json")])
+        self.assertEqual(status, 200)
+
+        status, headers, body, messages = self.get("/api/series")
+        self.assertEqual(json.loads(body.decode())["series"], ["posted"])
+
+    def test_bad_batch_from_other_thread(self):
+        # A batch failing part way through mustn't leave the database locked
+        good = {
+            "test_name": "test name",
+            "series_name": "posted",
+            "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+            "test_result": "PASS",
+        }
+        bad = [good, {"test_name": "no result", "series_name": "posted"}]
+        errors = []
+
+        def add(results):
+            try:
+                models.batch.add_batch(json.dumps(results), 0)
+            except Exception as error:
+                errors.append(error)
+
+        for results in [bad, good]:
+            thread = threading.Thread(target=add, args=(results,))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], TypeError)
+
+        status, headers, body, messages = self.get("/api/series")
+        self.assertEqual(json.loads(body.decode())["series"], ["posted"])
+
+    def test_concurrent_requests(self):
+        self.add_results()
+
+        # Each request waits for the other, which only completes if they are
+        # handled at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        threads = set()
+
+        get_all = models.series_names.SeriesNames.get_all
+
+        def wait_for_other():
+            threads.add(threading.get_ident())
+            barrier.wait()
+            return get_all()
+
+        async def both():
+            return await asyncio.gather(self.request("/"),
+                                        self.request("/api/series"))
+
+        with mock.patch("models.series_names.SeriesNames.get_all",
+                        side_effect=wait_for_other):
+            responses = asyncio.run(both())
+
+        self.assertEqual([response[0] for response in responses], [200, 200])
+        self.assertEqual(len(threads), 2)
+
+    def test_summary(self):
+        self.add_results(series_count=5)
+
+        status, headers, body, messages = self.get("/api/summary")
+        self.assertEqual(status, 200)
+
+        summary = json.loads(body.decode())
+        expected = [SeriesSummary.count_tests("series {}".format(series))
+                    for series in range(5)]
+        self.assertEqual(summary["series"], expected)
+
+    def test_lifespan(self):
+        received = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        asyncio.run(self.application({"type": "lifespan"}, receive, send))
+
+        self.assertEqual(sent, ["lifespan.startup.complete",
+                                "lifespan.shutdown.complete"])
+
+
+if __name__ == '__main__':
+    unittest.main()
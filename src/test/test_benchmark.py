@@ -0,0 +1,166 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import tempfile
+import common.database
+from tools.dataset import DatasetShape, generate_batches
+import tools.benchmark as benchmark
+import common.memory as memory
+from app import app, shutdown
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_benchmark.sqlite"
+
+DELETE_DB = True
+
+SHAPE = DatasetShape(series=2, batches_per_series=4, tests_per_batch=10,
+                     flake_rate=0.5, fail_rate=0.5)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def tearDown(self):
+        # The benchmark switches the app to its own database
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def test_dataset(self):
+        batches = list(generate_batches(SHAPE))
+
+        self.assertEqual(len(batches), 8)
+        self.assertEqual(sum(len(batch) for batch in batches), SHAPE.rows)
+        self.assertEqual(batches, list(generate_batches(SHAPE)))
+
+        results = set(result["test_result"] for batch in batches for result in batch)
+        self.assertEqual(results, {"PASS", "FAIL"})
+
+    def test_run(self):
+        results = benchmark.run(SHAPE, repeat=1)
+
+        self.assertEqual(results["shape"], SHAPE.as_dict())
+        self.assertGreater(results["results"]["db_size"], 0)
+        self.assertEqual(results["rows"], SHAPE.rows)
+
+        for name in ["ingest", "retention", "series_summary", "test_history"] + \
+                    ["route_" + route for route in benchmark.ROUTES]:
+            self.assertIn(name, results["results"])
+            self.assertEqual(results["units"][name], "seconds")
+
+        # Serialisable
+        json.dumps(results)
+
+    def test_rows(self):
+        # Each series has its own number of tests, so shape.rows doesn't apply
+        shape = DatasetShape(series=3, batches_per_series=2, tests_per_batch=10,
+                             test_count_alpha=1.2)
+        rows = sum(len(batch) for batch in generate_batches(shape))
+        self.assertNotEqual(rows, shape.rows)
+
+        results = benchmark.run(shape, repeat=1)
+        self.assertEqual(results["rows"], rows)
+        self.assertAlmostEqual(results["ingest_rows_per_second"],
+                               rows / results["results"]["ingest"])
+
+    def test_run_memory(self):
+        shape = DatasetShape(series=1, batches_per_series=3, tests_per_batch=10)
+        results = benchmark.run(shape, repeat=1, measure_memory=True)["results"]
+
+        names = ["series_summary_retained", "series_summary_TestHistory",
+                 "test_history_retained"]
+        peaks = ["series_summary_peak", "series_counts_peak", "route_series_peak"]
+
+        for name in names + peaks:
+            if name in peaks and not memory.PEAK_MEASURED:
+                self.assertNotIn(benchmark.MEMORY_PREFIX + name, results)
+            else:
+                self.assertIn(benchmark.MEMORY_PREFIX + name, results)
+
+        # The summary holds every history
+        self.assertGreater(results["memory_series_summary_retained"],
+                           results["memory_test_history_retained"])
+
+    def test_compare(self):
+        baseline = dict(shape=SHAPE.as_dict(),
+                        results=dict(ingest=1.0, retention=0.001, db_size=1000))
+
+        results = dict(shape=SHAPE.as_dict(),
+                       results=dict(ingest=1.2, retention=0.003, db_size=1000))
+        self.assertEqual(benchmark.compare(results, baseline), [])
+
+        results["results"]["ingest"] = 1.5
+        results["results"]["db_size"] = 2000
+        self.assertEqual(benchmark.compare(results, baseline),
+                         [("db_size", 1000, 2000), ("ingest", 1.0, 1.5)])
+
+        results["shape"] = dict(SHAPE.as_dict(), series=3)
+        self.assertRaises(ValueError, benchmark.compare, results, baseline)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+
+            args = ["--series", "1", "--batches", "3", "--tests", "5",
+                    "--repeat", "1"]
+
+            self.assertEqual(benchmark.main(args + ["--output", output]), 0)
+
+            with open(output) as results_file:
+                results = json.load(results_file)
+
+            # An impossibly quick baseline
+            for name in results["results"]:
+                results["results"][name] /= 1000
+
+            with open(output, "w") as results_file:
+                json.dump(results, results_file)
+
+            self.assertEqual(benchmark.main(args + ["--baseline", output]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import tempfile
+import datetime
+import json
+from common.database import Database
+import tools.bulk_import as bulk_import
+from tools.dataset import DatasetShape, generate_batches
+from models.series_summary import SeriesSummary
+from app import app, shutdown
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_bulk_import.sqlite"
+
+DELETE_DB = True
+
+SHAPE = DatasetShape(series=2, batches_per_series=4, tests_per_batch=10)
+
+JUNIT = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+    <testsuite name="suite" timestamp="2018-02-01T10:00:00.123">
+        <properties>
+            <property name="vcs_system" value="git"/>
+            <property name="vcs_revision" value="abc"/>
+        </properties>
+        <testcase classname="module" name="passes" time="1.6"/>
+        <testcase classname="module" name="fails" time="0.2"><failure message="no"/></testcase>
+        <testcase name="errors"><error/></testcase>
+        <testcase name="skipped"><skipped/></testcase>
+    </testsuite>
+</testsuites>
+"""
+
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.directory.name, "archive")
+        os.makedirs(os.path.join(self.archive, "nested"))
+
+        self.batches = list(generate_batches(SHAPE))
+        self.rows = sum(len(batch) for batch in self.batches)
+
+        for index, batch in enumerate(self.batches):
+            if index % 2:
+                self.write("nested/{:02}.ndjson".format(index),
+                           "".join(json.dumps(result) + "\n" for result in batch))
+            else:
+                self.write("{:02}.json".format(index), json.dumps(batch))
+
+        self.checkpoint = TEST_DATABASE_PATH + bulk_import.CHECKPOINT_SUFFIX
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+        # The import uses its own database
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        Database.initialise(TEST_DATABASE_PATH)
+
+        if os.path.isfile(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def write(self, name, content):
+        with open(os.path.join(self.archive, name), "w") as output:
+            output.write(content)
+
+    def count_tests(self):
+        Database.initialise(TEST_DATABASE_PATH)
+        return Database.query_one("SELECT COUNT () FROM Test")
+
+    def test_import(self):
+        for workers in [1, 2]:
+            summary = bulk_import.run(self.archive, TEST_DATABASE_PATH,
+                                      workers=workers,
+                                      transaction_rows=15,
+                                      relaxed=True)
+
+            if workers == 1:
+                self.assertEqual(summary["rows"], self.rows)
+                self.assertEqual(summary["added"], len(self.batches))
+                self.assertEqual(summary["errors"], [])
+                self.assertGreater(summary["rows_per_second"], 0)
+            else:
+                # Everything was in the checkpoint
+                self.assertEqual(summary["skipped"], len(self.batches))
+                self.assertEqual(summary["rows"], 0)
+
+        self.assertEqual(self.count_tests(), self.rows)
+        self.assertEqual(Database.query_one("PRAGMA journal_mode"), "delete")
+
+    def test_workers(self):
+        summary = bulk_import.run(self.archive, TEST_DATABASE_PATH, workers=3)
+
+        self.assertEqual(summary["rows"], self.rows)
+        self.assertEqual(self.count_tests(), self.rows)
+
+    def test_resume(self):
+        # As if stopped after the first file, with the next uncommitted
+        first = sorted(name for name in os.listdir(self.archive) if name.endswith(".json"))[0]
+        bulk_import.Checkpoint(self.checkpoint).add([first])
+
+        summary = bulk_import.run(self.archive, TEST_DATABASE_PATH, workers=1)
+
+        self.assertEqual(summary["skipped"], 1)
+        self.assertEqual(summary["rows"], self.rows - len(self.batches[0]))
+
+        self.assertEqual(self.count_tests(), self.rows - len(self.batches[0]))
+
+        # Importing files again only adds what is missing
+        os.remove(self.checkpoint)
+        bulk_import.run(self.archive, TEST_DATABASE_PATH, workers=1)
+        self.assertEqual(self.count_tests(), self.rows)
+
+    def test_errors(self):
+        self.write("bad.json", "[{")
+        self.write("invalid.ndjson", json.dumps(dict(self.batches[0][0], test_result="MAYBE")))
+
+        self.assertEqual(bulk_import.main([self.archive, TEST_DATABASE_PATH,
+                                           "--workers", "1"]), 1)
+
+        checkpoint = bulk_import.Checkpoint(self.checkpoint)
+        self.assertNotIn("bad.json", checkpoint.done)
+        self.assertNotIn("invalid.ndjson", checkpoint.done)
+        self.assertEqual(self.count_tests(), self.rows)
+
+    def test_junit(self):
+        self.write("report.xml", JUNIT)
+
+        path, results, problem = bulk_import.parse_file(os.path.join(self.archive, "report.xml"))
+        self.assertIn("series_name", problem)
+
+        path, results, problem = bulk_import.parse_file(os.path.join(self.archive, "report.xml"), "nightly")
+        self.assertIsNone(problem)
+        self.assertEqual([(result["test_name"], result["test_result"], result["test_duration"])
+                          for result in results],
+                         [("module.passes", "PASS", 2),
+                          ("module.fails", "FAIL", 0),
+                          ("errors", "FAIL", None),
+                          ("skipped", "SKIP", None)])
+        self.assertEqual(results[0]["batch_timestamp"], datetime.datetime(2018, 2, 1, 10))
+        self.assertEqual(results[0]["vcs_revision"], "abc")
+
+        summary = bulk_import.run(self.archive, TEST_DATABASE_PATH,
+                                  series_name="nightly", workers=1)
+        self.assertEqual(summary["rows"], self.rows + 4)
+
+        Database.initialise(TEST_DATABASE_PATH)
+        self.assertEqual(SeriesSummary.count_tests("nightly")["counts"]["passing"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import tempfile
+import multiprocessing
+import common.database
+import models.batch
+from common.cache import MemoryCache, SqliteCache
+from models.series_summary import SeriesSummary
+import app
+from unittest import mock
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_cache.sqlite"
+
+DELETE_DB = True
+
+
+def set_in_child(cache_file):
+    SqliteCache(cache_file, 1024).set("child", b"from child")
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def check_cache(self, cache):
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", b"1" * 40)
+        self.assertEqual(cache.get("a"), b"1" * 40)
+
+        cache.set("b", b"2" * 40)
+        cache.get("a")
+
+        # Over max_bytes, so the least recently used entry goes
+        cache.set("c", b"3" * 40)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1" * 40)
+        self.assertEqual(cache.get("c"), b"3" * 40)
+        self.assertEqual(cache.size, 80)
+
+        # Too large to keep
+        cache.set("d", b"4" * 101)
+        self.assertIsNone(cache.get("d"))
+
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size, 0)
+
+    def test_memory_cache(self):
+        self.check_cache(MemoryCache(100))
+
+    def test_sqlite_cache(self):
+        # Every get is recorded as an access
+        with mock.patch.object(SqliteCache, "ACCESS_RESOLUTION", 1e-9):
+            with mock.patch("time.time", side_effect=range(1000)):
+                self.check_cache(SqliteCache(self.cache_file, 100))
+
+    def test_sqlite_cache_shared(self):
+        # As in two different workers
+        first = SqliteCache(self.cache_file, 1024)
+        second = SqliteCache(self.cache_file, 1024)
+
+        first.set("key", b"value")
+        self.assertEqual(second.get("key"), b"value")
+
+        process = multiprocessing.get_context("fork").Process(target=set_in_child,
+                                                              args=(self.cache_file,))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(first.get("child"), b"from child")
+
+    def test_sqlite_cache_errors(self):
+        # A cache which can't be used is only a miss
+        with open(self.cache_file, "wb") as cache_file:
+            cache_file.write(b"not a database" * 100)
+
+        cache = SqliteCache(self.cache_file, 1024)
+
+        with self.assertLogs(level="WARNING"):
+            cache.set("key", b"value")
+            self.assertIsNone(cache.get("key"))
+
+        self.assertEqual(cache.misses, 1)
+
+    def test_series_counts(self):
+        models.batch.add_batch([{
+            "test_name": "test {}".format(test),
+            "series_name": "counted",
+            "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+            "test_result": "PASS",
+        } for test in range(10)], 0)
+
+        shared = SqliteCache(self.cache_file, 1024**2)
+
+        with mock.patch("app.response_cache", shared):
+            expected = SeriesSummary.count_tests("counted")
+            self.assertEqual(app.series_counts("counted"), expected)
+
+            # Worked out once, by any worker, until the series changes
+            with mock.patch("models.series_summary.SeriesSummary.count_tests") as count_tests:
+                self.assertEqual(app.series_counts("counted"), expected)
+                self.assertFalse(count_tests.called)
+
+            models.batch.add_batch([{
+                "test_name": "test new",
+                "series_name": "counted",
+                "batch_timestamp": str(datetime.datetime(2018, 1, 2)),
+                "test_result": "FAIL",
+            }], 0)
+
+            self.assertEqual(app.series_counts("counted")["total_tests"], 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import zlib
+import common.database
+import models.batch
+from app import app, response_cache, shutdown
+from unittest import mock
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_compression.sqlite"
+
+DELETE_DB = True
+
+SERIES_NAME = "compressed"
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self, test_count):
+        results = []
+
+        for day in range(1, 4):
+            for test in range(test_count):
+                results.append({
+                    "test_name": "test {:04}".format(test),
+                    "series_name": SERIES_NAME,
+                    "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+                    "test_result": "PASS" if day != 3 or test % 2 else "FAIL",
+                })
+
+        models.batch.add_batch(results, 0)
+
+    def get(self, url, encoding=None, **headers):
+        if encoding is not None:
+            headers["Accept-Encoding"] = encoding
+        response = self.client.get(url, headers=headers)
+        # Streamed pages are only generated, and cached, as they are read
+        response.get_data()
+        return response
+
+    def decompress(self, response):
+        wbits = {"gzip": 16 + zlib.MAX_WBITS,
+                 "deflate": zlib.MAX_WBITS}[response.headers["Content-Encoding"]]
+        return zlib.decompress(response.get_data(), wbits)
+
+    def test_encodings(self):
+        self.add_results(200)
+
+        urls = ["/api/series/" + SERIES_NAME,
+                "/results/series/{}/type/passing".format(SERIES_NAME),
+                "/results/series/{}/test/test 0001".format(SERIES_NAME)]
+
+        for url in urls:
+            plain = self.get(url)
+            self.assertEqual(plain.status_code, 200)
+            self.assertNotIn("Content-Encoding", plain.headers)
+            self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+            for encoding in ["gzip", "deflate"]:
+                response = self.get(url, encoding)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers["Content-Encoding"], encoding)
+                self.assertEqual(self.decompress(response), plain.get_data())
+                self.assertIn("Accept-Encoding", response.headers["Vary"])
+
+            # gzip is preferred unless the client says otherwise
+            response = self.get(url, "deflate, gzip")
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            response = self.get(url, "deflate;q=1, gzip;q=0.5")
+            self.assertEqual(response.headers["Content-Encoding"], "deflate")
+            response = self.get(url, "br")
+            self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_small_responses(self):
+        self.add_results(1)
+
+        response = self.get("/api/series", "gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_disabled(self):
+        self.add_results(200)
+
+        app.config["COMPRESSION_LEVEL"] = 0
+        try:
+            response = self.get("/api/series/" + SERIES_NAME, "gzip")
+        finally:
+            app.config["COMPRESSION_LEVEL"] = 6
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_etags(self):
+        self.add_results(200)
+
+        url = "/api/series/" + SERIES_NAME
+
+        plain = self.get(url)
+        compressed = self.get(url, "gzip")
+
+        plain_etag = plain.get_etag()[0]
+        compressed_etag = compressed.get_etag()[0]
+        self.assertEqual(compressed_etag, plain_etag + "-gzip")
+
+        for etag in [plain_etag, compressed_etag]:
+            response = self.get(url, "gzip", **{"If-None-Match": '"{}"'.format(etag)})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_etag()[0], compressed_etag)
+
+    def test_response_cache(self):
+        self.add_results(200)
+
+        urls = ["/api/series/" + SERIES_NAME,
+                "/results/series/{}/type/passing".format(SERIES_NAME)]
+
+        for url in urls:
+            for encoding in [None, "gzip"]:
+                first = self.get(url, encoding)
+
+                # The view should not run when the rendered page is cached
+                with mock.patch("models.series_summary.SeriesSummary.query_test_states") as query:
+                    second = self.get(url, encoding)
+                    self.assertFalse(query.called)
+
+                self.assertEqual(first.get_data(), second.get_data())
+                self.assertEqual(first.headers.get("Content-Encoding"),
+                                 second.headers.get("Content-Encoding"))
+                self.assertEqual(first.get_etag(), second.get_etag())
+
+        # New results change the ETag, so the cached page is not used
+        models.batch.add_batch([{
+            "test_name": "test new",
+            "series_name": SERIES_NAME,
+            "batch_timestamp": str(datetime.datetime(2018, 1, 4)),
+            "test_result": "PASS",
+        }], 0)
+
+        response = self.get("/results/series/{}/type/passing".format(SERIES_NAME))
+        self.assertIn(b"test new", response.get_data())
+
+    def test_response_cache_size(self):
+        self.add_results(200)
+
+        url = "/results/series/{}/type/passing".format(SERIES_NAME)
+
+        max_bytes = response_cache.max_bytes
+        response_cache.max_bytes = 100
+        try:
+            self.get(url)
+            with mock.patch("models.series_summary.SeriesSummary.query_test_states",
+                            side_effect=RuntimeError):
+                self.assertRaises(RuntimeError, self.get, url)
+        finally:
+            response_cache.max_bytes = max_bytes
+
+    def test_response_cache_max_entry(self):
+        self.add_results(200)
+
+        url = "/results/series/{}/type/passing".format(SERIES_NAME)
+
+        # Streamed responses larger than an entry are sent but not kept
+        with mock.patch.dict(app.config, RESPONSE_CACHE_MAX_ENTRY=100):
+            self.assertEqual(self.get(url).status_code, 200)
+            with mock.patch("models.series_summary.SeriesSummary.query_test_states",
+                            side_effect=RuntimeError):
+                self.assertRaises(RuntimeError, self.get, url)
+
+        self.get(url)
+        with mock.patch("models.series_summary.SeriesSummary.query_test_states",
+                        side_effect=RuntimeError):
+            self.assertEqual(self.get(url).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import io
+import tempfile
+import collections
+import common.database
+from common.database import Database
+from tools.dataset import DatasetShape, REALISTIC, generate_batches
+import tools.dataset as dataset
+from models.test_result import TestResult
+from unittest import mock
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_dataset.sqlite"
+
+DELETE_DB = True
+
+
+class TestDataset(unittest.TestCase):
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        common.database.Database.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def test_uniform(self):
+        shape = DatasetShape(series=3, batches_per_series=5, tests_per_batch=20)
+        batches = list(generate_batches(shape))
+
+        self.assertEqual(len(batches), 15)
+        self.assertEqual(set(len(batch) for batch in batches), {20})
+        self.assertEqual(batches, list(generate_batches(shape)))
+
+        shape.seed = 1
+        self.assertNotEqual(batches, list(generate_batches(shape)))
+
+    def test_realistic(self):
+        shape = DatasetShape(**dict(REALISTIC.as_dict(), series=50, batches_per_series=20))
+        batches = list(generate_batches(shape))
+        results = [result for batch in batches for result in batch]
+
+        # Every result is valid
+        for result in results[:1000]:
+            TestResult(**result)
+
+        # A few series are much larger than the rest
+        sizes = sorted(len(batches[series + shape.batches_per_series - 1])
+                       for series in range(0, len(batches), shape.batches_per_series))
+        self.assertGreaterEqual(sizes[0], shape.tests_per_batch)
+        self.assertGreater(sizes[-1], 4 * sizes[len(sizes) // 2])
+
+        counts = collections.Counter(result["test_result"] for result in results)
+        self.assertGreater(counts["FAIL"], 0)
+        self.assertGreater(counts["SKIP"], 0)
+        self.assertGreater(counts["PASS"], counts["FAIL"] + counts["SKIP"])
+
+        # Revisions shared by pairs of batches
+        for series in range(0, len(batches), shape.batches_per_series):
+            revisions = [batch[0]["vcs_revision"] for batch in batches[series:series + shape.batches_per_series]]
+            self.assertEqual(len(set(revisions)), shape.batches_per_series // 2)
+
+        metadata = collections.Counter(result["metadata"] for result in results)
+        self.assertLessEqual(len(metadata), shape.metadata_cardinality)
+        self.assertGreater(metadata.most_common()[0][1], 10 * metadata.most_common()[-1][1])
+
+        durations = [result["test_duration"] for result in results if result["test_result"] != "SKIP"]
+        self.assertGreater(max(durations), 10 * shape.mean_duration)
+
+    def test_formats(self):
+        shape = DatasetShape(series=2, batches_per_series=2, tests_per_batch=5)
+        expected = [result for batch in generate_batches(shape) for result in batch]
+
+        output = io.StringIO()
+        dataset.write_json(generate_batches(shape), output)
+        self.assertEqual(json.loads(output.getvalue()), expected)
+
+        output = io.StringIO()
+        dataset.write_ndjson(generate_batches(shape), output)
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()],
+                         expected)
+
+    def test_main(self):
+        args = ["--series", "2", "--batches-per-series", "3", "--tests-per-batch", "4",
+                "--test-count-alpha", "0", "--growth", "0"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.ndjson")
+            self.assertEqual(dataset.main(args + ["--format", "ndjson", "--output", output]), 0)
+
+            with open(output) as results:
+                self.assertEqual(len(results.readlines()), 24)
+
+        with mock.patch("sys.stdout", io.StringIO()):
+            self.assertEqual(dataset.main(args + ["--load", TEST_DATABASE_PATH]), 0)
+
+        self.assertEqual(Database.get_debug().countTest, 24)
+        self.assertEqual(Database.get_debug().countSeries, 2)
+        self.assertEqual(Database.get_debug().countBatch, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
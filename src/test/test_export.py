@@ -0,0 +1,158 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import csv
+import io
+import json
+import common.database
+import models.batch
+from models.series_export import SeriesExport, FIELDS
+import app
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_export.sqlite"
+
+DELETE_DB = True
+
+SERIES_NAME = "export/series"
+
+
+def results(day, tests=5):
+    return [{"test_name": "test {}".format(test),
+             "series_name": SERIES_NAME,
+             "batch_timestamp": "2018-01-{:02}T10:00:00".format(day),
+             "test_result": "PASS" if test % 2 else "FAIL",
+             "vcs_system": "git",
+             "vcs_revision": "revision {}".format(day),
+             "metadata": "metadata {}".format(test % 2) if test else None,
+             "test_timestamp": "2018-01-{:02}T10:00:{:02}".format(day, test) if test else None,
+             "test_duration": test * 10 if test else None} for test in range(tests)]
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+        self.page_size = app.app.config["EXPORT_PAGE_SIZE"]
+
+        # Added out of order
+        for day in [3, 1, 2]:
+            models.batch.add_batch(results(day), 0)
+
+        models.batch.add_batch([dict(result, series_name="other")
+                                for result in results(1)], 0)
+
+    def tearDown(self):
+        app.app.config["EXPORT_PAGE_SIZE"] = self.page_size
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def export(self, query=""):
+        response = self.client.get("/export/series/" + SERIES_NAME + query)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def ndjson(self, query=""):
+        response = self.export(query)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_ndjson(self):
+        expected = results(1) + results(2) + results(3)
+
+        self.assertEqual(self.ndjson(), expected)
+
+        # Pages join up
+        for page_size in [1, 4, 5, 15, 16]:
+            app.app.config["EXPORT_PAGE_SIZE"] = page_size
+            self.assertEqual(self.ndjson(), expected, page_size)
+
+    def test_csv(self):
+        response = self.export("?format=csv")
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertIn('filename="export_series.csv"', response.headers["Content-Disposition"])
+
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows[0], FIELDS)
+        self.assertEqual(len(rows), 16)
+        self.assertEqual(rows[2], ["test 1", SERIES_NAME, "2018-01-01T10:00:00",
+                                   "PASS", "git", "revision 1", "metadata 1",
+                                   "2018-01-01T10:00:01", "10"])
+        self.assertEqual(rows[1][6:], ["", "", ""])
+
+    def test_filters(self):
+        exported = self.ndjson("?since=2018-01-02&until=2018-01-03T10:00:00")
+        self.assertEqual(exported, results(2))
+
+        exported = self.ndjson("?test=test%201&test=test%203&since=2018-01-02T10:00:00")
+        self.assertEqual(exported, [result for result in results(2) + results(3)
+                                    if result["test_name"] in ("test 1", "test 3")])
+
+    def test_reimport(self):
+        exported = self.ndjson()
+
+        models.batch.add_batch([dict(result, series_name="copy") for result in exported], 0)
+
+        copied = [dict(result, series_name=SERIES_NAME)
+                  for chunk in SeriesExport("copy").ndjson()
+                  for result in map(json.loads, chunk.splitlines())]
+        self.assertEqual(copied, exported)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get("/export/series/missing").status_code, 404)
+        self.assertEqual(self.client.get("/export/series/" + SERIES_NAME + "?format=xml").status_code, 400)
+        self.assertEqual(self.client.get("/export/series/" + SERIES_NAME + "?since=yesterday").status_code, 400)
+
+    def test_compressed(self):
+        response = self.client.get("/export/series/" + SERIES_NAME,
+                                   headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        response.get_data()
+
+
+if __name__ == '__main__':
+    unittest.main()
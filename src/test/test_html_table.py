@@ -0,0 +1,171 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import common.database
+import common.html_table as html_table
+import models.batch
+import models.series_summary
+from models.test_history import TestHistory
+from app import app, SERIES_TABLE, HISTORY_TABLE, shutdown
+import flask_table
+from unittest import mock
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_html_table.sqlite"
+
+DELETE_DB = True
+
+
+# The flask_table definitions the tables in the app used to be rendered with
+class FormattedTable(flask_table.Table):
+    classes = ["table table-striped"]
+
+
+class FlaskSeriesNameTable(FormattedTable):
+    series_name = flask_table.LinkCol(
+                    "Series",
+                    "route_view_results_series_landing",
+                    url_kwargs=dict(series_name="series_name"),
+                    attr_list="series_name")
+
+
+class FlaskSeriesTable(FormattedTable):
+    test_name = flask_table.LinkCol("Test Name",
+                                    "route_view_results_series_test",
+                                    url_kwargs=dict(test_name="test_name",
+                                                    series_name="series_name"),
+                                    attr_list="test_name")
+
+    is_stable = flask_table.Col("Considered Stable")
+
+
+class FlaskHistoryTable(FormattedTable):
+    test_result = flask_table.Col("Result")
+    batch_timestamp = flask_table.Col("Batch Timestamp")
+    vcs_system = flask_table.Col("VCS")
+    vcs_revision = flask_table.Col("VCS Revision")
+    test_timestamp = flask_table.Col("Test Timestamp")
+    metadata = flask_table.Col("Metadata")
+
+
+NAMES = ["plain", "with space", "a/b/c", "<script>&\"'", "100% ?#", "ünïcödé"]
+
+
+class TestHtmlTable(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def test_series_names(self):
+        items = [dict(series_name=name) for name in NAMES]
+
+        with app.test_request_context():
+            self.assertEqual(SERIES_TABLE.render(items),
+                             FlaskSeriesNameTable(items).__html__())
+            self.assertEqual(SERIES_TABLE.render([]),
+                             FlaskSeriesNameTable([]).__html__())
+
+    def test_series_and_history(self):
+        result_data = []
+        for day, name in enumerate(NAMES, 1):
+            result_data.append({
+                "test_name": name,
+                "series_name": NAMES[day % len(NAMES)],
+                "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+                "test_result": "PASS",
+                "vcs_system": "git" if day % 2 else None,
+                "vcs_revision": name if day % 2 else None,
+                "metadata": name if day % 3 else None,
+                "test_timestamp": str(datetime.datetime(2018, 1, day)),
+                "test_duration": day
+            })
+
+        models.batch.add_batch(json.dumps(result_data), 0)
+
+        histories = [TestHistory(entry["series_name"], entry["test_name"])
+                     for entry in result_data]
+        tests = [test for history in histories for test in history.tests]
+
+        with app.test_request_context():
+            self.assertEqual(models.series_summary.SERIES_TABLE.render(histories),
+                             FlaskSeriesTable(histories).__html__())
+            self.assertEqual(HISTORY_TABLE.render(tests),
+                             FlaskHistoryTable(tests).__html__())
+
+    def test_url_builder(self):
+        values = dict(series_name="a b/<&>", test_name="100% ?#")
+
+        with app.test_request_context():
+            builder = html_table._UrlBuilder("route_view_results_series_test",
+                                             sorted(values))
+
+            # Rule was understood - URLs are not built with url_for
+            self.assertEqual(builder.build, builder._build)
+            self.assertEqual(builder.build(values),
+                             html_table.url_for(
+                                "route_view_results_series_test", **values))
+
+        with app.test_request_context(base_url="http://localhost/prefix"):
+            builder = html_table._UrlBuilder("route_view_results_series_test",
+                                             sorted(values))
+            self.assertTrue(builder.build(values).startswith("/prefix/"))
+
+        # Without the rule's converters, URLs are built with url_for
+        with app.test_request_context():
+            with mock.patch.object(app.url_map, "iter_rules",
+                                   return_value=iter([object()])):
+                builder = html_table._UrlBuilder("route_view_results_series_test",
+                                                 sorted(values))
+
+            self.assertEqual(builder.build, builder._build_slow)
+            self.assertEqual(builder.build(values),
+                             html_table.url_for(
+                                "route_view_results_series_test", **values))
@@ -0,0 +1,125 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import common.database
+from app import app, shutdown
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_http_caching.sqlite"
+
+DELETE_DB = True
+
+
+class TestHttpCaching(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def post_results(self, day):
+        result_data = {
+            "test_name": "test name",
+            "series_name": "cached",
+            "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+            "test_result": "PASS",
+        }
+
+        response = self.client.post("/add_result",
+                                    data=json.dumps(result_data),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_read_routes(self):
+        self.post_results(1)
+
+        for url in ["/",
+                    "/results",
+                    "/results/series/cached",
+                    "/results/series/cached/type/passing",
+                    "/results/series/cached/test/test name"]:
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["Cache-Control"],
+                             app.config["CACHE_CONTROL"])
+
+            etag = response.headers["ETag"]
+            last_modified = response.headers["Last-Modified"]
+
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["Cache-Control"],
+                             app.config["CACHE_CONTROL"])
+
+            response = self.client.get(
+                            url, headers={"If-Modified-Since": last_modified})
+            self.assertEqual(response.status_code, 304)
+
+            # A non matching ETag takes precedence over the modified time
+            response = self.client.get(
+                            url, headers={"If-None-Match": "\"other\"",
+                                          "If-Modified-Since": last_modified})
+            self.assertEqual(response.status_code, 200)
+
+    def test_modified(self):
+        self.post_results(1)
+
+        series_response = self.client.get("/results/series/cached")
+        index_response = self.client.get("/")
+
+        self.post_results(2)
+
+        for url, response in [("/results/series/cached", series_response),
+                              ("/", index_response)]:
+            response = self.client.get(
+                            url,
+                            headers={"If-None-Match": response.headers["ETag"]})
+            self.assertEqual(response.status_code, 200)
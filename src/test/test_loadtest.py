@@ -0,0 +1,108 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import io
+import tempfile
+import common.database
+import tools.loadtest as loadtest
+from unittest import mock
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+
+class TestLoadTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        # Seeding the load test opens its own database
+        common.database.Database.shutdown()
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix("add_result=1, index=2.5"),
+                         dict(add_result=1, index=2.5))
+        self.assertRaises(ValueError, loadtest.parse_mix, "missing=1")
+        self.assertEqual(set(loadtest.parse_mix(loadtest.DEFAULT_MIX)) - set(loadtest.ROUTES),
+                         {"add_result"})
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(loadtest.percentile(values, 0.5), 50)
+        self.assertEqual(loadtest.percentile(values, 0.95), 95)
+        self.assertEqual(loadtest.percentile(values, 0.99), 99)
+        self.assertEqual(loadtest.percentile(values, 1), 100)
+        self.assertEqual(loadtest.percentile([3], 0.5), 3)
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+    def test_summarise(self):
+        samples = [("index", 0.1, 200), ("index", 0.3, 200), ("index", 0.2, 500),
+                   ("add_result", 1.0, 429)]
+
+        summary = loadtest.summarise(samples, 2.0, 1)
+
+        self.assertEqual(summary["requests"], 4)
+        self.assertEqual(summary["per_second"], 2)
+        self.assertEqual(summary["busy_errors"], 1)
+        self.assertEqual(summary["routes"]["index"]["p50"], 0.2)
+        self.assertEqual(summary["routes"]["index"]["max"], 0.3)
+        self.assertEqual(summary["routes"]["index"]["errors"], 1)
+        self.assertEqual(summary["routes"]["index"]["statuses"], {"200": 2, "500": 1})
+        self.assertEqual(summary["routes"]["add_result"]["errors"], 1)
+
+    def test_batch_source(self):
+        source = loadtest.BatchSource(3, loadtest.datetime.datetime(2018, 1, 1))
+
+        first = source("series 0")
+        second = source("series 0")
+
+        self.assertEqual(len(first), 3)
+        self.assertLess(first[0]["batch_timestamp"], second[0]["batch_timestamp"])
+
+    def test_gunicorn(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+
+            with mock.patch("sys.stdout", io.StringIO()):
+                loadtest.main(["--clients", "2", "--duration", "1",
+                               "--workers", "1", "--series", "2",
+                               "--batches", "2", "--tests", "5",
+                               "--output", output])
+
+            with open(output) as results_file:
+                results = json.load(results_file)
+
+        self.assertGreater(results["requests"], 0)
+        self.assertEqual(results["busy_errors"], 0)
+
+        for route, stats in results["routes"].items():
+            self.assertEqual(stats["errors"], 0, route)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import tracemalloc
+import common.database
+import common.memory as memory
+from common.memory import Account
+import models.batch
+from models.series_summary import SeriesSummary
+import app
+from unittest import mock
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_memory.sqlite"
+
+DELETE_DB = True
+
+SERIES_NAME = "memory"
+
+
+class TestMemory(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+        app.memory_profiler.enabled = True
+        app.memory_profiler.requests.clear()
+
+    def tearDown(self):
+        app.memory_profiler.enabled = app.app.config["MEMORY_PROFILING_ENABLED"]
+        memory.stop()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self):
+        models.batch.add_batch([{
+            "test_name": "test {}".format(test),
+            "series_name": SERIES_NAME,
+            "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+            "test_result": "PASS" if test % 3 else "FAIL",
+        } for day in range(1, 10) for test in range(100)], 0)
+
+    def test_account(self):
+        with Account() as account:
+            held = [bytearray(1000) for _ in range(100)]
+            freed = bytearray(500000)
+            del freed
+
+        self.assertTrue(tracemalloc.is_tracing())
+        if memory.PEAK_MEASURED:
+            self.assertGreaterEqual(account.peak, 600000)
+        self.assertGreaterEqual(account.retained, 100000)
+        self.assertLess(account.retained, 500000)
+        self.assertGreaterEqual(account.components["other"][0], 100000)
+        del held
+
+    def test_account_components(self):
+        self.add_results()
+
+        with Account() as account:
+            summary = SeriesSummary(SERIES_NAME)
+            account.hold()
+
+        self.assertEqual(len(summary.test_histories), 100)
+        self.assertGreater(account.components["TestHistory"][0], 0)
+        self.assertGreater(account.components["Database"][0], 0)
+        if memory.PEAK_MEASURED:
+            self.assertGreaterEqual(account.peak, account.retained)
+
+    def test_account_without_peak(self):
+        # As before Python 3.9, when the peak of a block can't be measured
+        with mock.patch.object(memory, "PEAK_MEASURED", False):
+            with Account() as account:
+                held = bytearray(100000)
+
+        self.assertIsNone(account.peak)
+        self.assertGreaterEqual(account.retained, 100000)
+        del held
+
+    def test_requests(self):
+        self.add_results()
+
+        response = self.client.get("/results/series/" + SERIES_NAME)
+        self.assertEqual(response.status_code, 200)
+        response.get_data()
+
+        measured = app.memory_profiler.requests[0]
+        self.assertEqual(measured["path"], "/results/series/" + SERIES_NAME)
+        self.assertEqual(measured["status"], "200 OK")
+        if memory.PEAK_MEASURED:
+            self.assertGreater(measured["peak"], 0)
+
+        response = self.client.get("/debug/memory")
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        self.assertIn("/results/series/" + SERIES_NAME, page)
+        self.assertIn("Largest Allocations", page)
+
+    def test_disabled(self):
+        app.memory_profiler.enabled = False
+
+        self.assertEqual(self.client.get("/debug/memory").status_code, 404)
+        self.client.get("/").get_data()
+        self.assertEqual(len(app.memory_profiler.requests), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
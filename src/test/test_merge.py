@@ -0,0 +1,155 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import tempfile
+import sqlite3
+from common.database import Database
+import tools.merge as merge
+from tools.dataset import DatasetShape, generate_batches, load
+from models.series_version import SeriesVersion
+from app import app, shutdown
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_merge.sqlite"
+
+DELETE_DB = True
+
+SHAPE = DatasetShape(series=2, batches_per_series=5, tests_per_batch=10)
+
+# Every result by name rather than id, to compare databases
+SQL_RESULTS = """
+SELECT
+    Series.series_name,
+    CAST(Batch.batch_timestamp AS TEXT),
+    Vcs.vcs_system,
+    Vcs.vcs_revision,
+    Test.test_name,
+    Test.test_result,
+    CAST(Test.test_timestamp AS TEXT),
+    Test.test_duration,
+    Metadata.metadata
+FROM Test
+    INNER JOIN Batch ON Test.batch_id = Batch.batch_id
+    INNER JOIN Series ON Batch.series_id = Series.series_id
+    LEFT JOIN Vcs ON Batch.vcs_id = Vcs.vcs_id
+    LEFT JOIN Metadata ON Test.metadata_id = Metadata.metadata_id
+"""
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.batches = list(generate_batches(SHAPE))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+        # The sources were opened in turn
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        Database.initialise(TEST_DATABASE_PATH)
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def source(self, name, batches):
+        database_file = os.path.join(self.directory.name, name)
+        load(batches, database_file)
+        return database_file
+
+    def results(self, database_file):
+        with sqlite3.connect(database_file) as connection:
+            return sorted(connection.execute(SQL_RESULTS), key=repr)
+
+    def test_merge(self):
+        # Overlapping, and added in a different order, so ids all differ
+        first = self.source("first.sqlite", self.batches[:6])
+        second = self.source("second.sqlite", list(reversed(self.batches[4:])))
+        everything = self.source("everything.sqlite", self.batches)
+
+        Database.initialise(TEST_DATABASE_PATH)
+        load(self.batches[:1], TEST_DATABASE_PATH)
+
+        added = merge.merge(first)
+        self.assertEqual(added["Batch"], 5)
+        self.assertEqual(added["Test"], sum(len(batch) for batch in self.batches[1:6]))
+
+        added = merge.merge(second)
+        self.assertEqual(added["Batch"], 4)
+        self.assertEqual(added["Series"], 0)
+
+        # Nothing is added twice
+        added = merge.merge(second)
+        self.assertEqual(set(added.values()), {0})
+
+        self.assertEqual(self.results(TEST_DATABASE_PATH), self.results(everything))
+
+        for series in ["series 0", "series 1"]:
+            self.assertEqual(SeriesVersion.get(series).last_batch_id,
+                             Database.query_one("""SELECT MAX(batch_id) FROM Batch
+                                                   INNER JOIN Series USING (series_id)
+                                                   WHERE series_name = ?""", (series,)))
+
+    def test_not_trapp(self):
+        other = os.path.join(self.directory.name, "other.sqlite")
+        with sqlite3.connect(other) as connection:
+            connection.execute("CREATE TABLE Test (test_id INTEGER)")
+
+        Database.initialise(TEST_DATABASE_PATH)
+        self.assertRaises(ValueError, merge.merge, other)
+
+        # Detached again
+        self.assertEqual([row[1] for row in Database.query_rows("PRAGMA database_list")], ["main"])
+
+    def test_main(self):
+        first = self.source("first.sqlite", self.batches[:3])
+        second = self.source("second.sqlite", self.batches[3:])
+
+        self.assertEqual(merge.main([TEST_DATABASE_PATH, first, second]), 0)
+        self.assertEqual(self.results(TEST_DATABASE_PATH),
+                         sorted(self.results(first) + self.results(second), key=repr))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import tempfile
+import subprocess
+import common.database
+from common.metrics import Registry, MetricsStore
+import app
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_metrics.sqlite"
+
+DELETE_DB = True
+
+
+def sample_value(text, sample):
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.metrics_file = os.path.join(self.directory.name, "metrics.sqlite")
+
+    def registry(self, store=True):
+        registry = Registry()
+        self.addCleanup(registry.stop)
+        if store:
+            registry.store = MetricsStore(self.metrics_file)
+        registry.counter("rows_total", "Rows.")
+        registry.histogram("latency_seconds", "Latency.", ["route"], buckets=[0.1, 1])
+        registry.gauge("size_bytes", "Size.", lambda: 42)
+        return registry
+
+    def test_render(self):
+        registry = self.registry(store=False)
+        rows, latency, size = registry.metrics
+
+        rows.inc(3)
+        latency.observe(0.05, route="/a")
+        latency.observe(0.5, route="/a")
+        latency.observe(5, route="/a")
+
+        text = registry.render()
+
+        self.assertIn("# TYPE rows_total counter", text)
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertEqual(sample_value(text, "rows_total"), 3)
+        self.assertEqual(sample_value(text, 'latency_seconds_bucket{route="/a",le="0.1"}'), 1)
+        self.assertEqual(sample_value(text, 'latency_seconds_bucket{route="/a",le="1"}'), 2)
+        self.assertEqual(sample_value(text, 'latency_seconds_bucket{route="/a",le="+Inf"}'), 3)
+        self.assertEqual(sample_value(text, 'latency_seconds_count{route="/a"}'), 3)
+        self.assertEqual(sample_value(text, 'latency_seconds_sum{route="/a"}'), 5.55)
+        self.assertEqual(sample_value(text, "size_bytes"), 42)
+
+    def test_labels_are_required(self):
+        registry = self.registry(store=False)
+        with self.assertRaises(ValueError):
+            registry.metrics[1].observe(1)
+
+    def test_processes_are_totalled(self):
+        # As two gunicorn workers sharing the metrics file
+        first = self.registry()
+        second = self.registry()
+
+        first.metrics[0].inc(2)
+        second.metrics[0].inc(5)
+        first.metrics[1].observe(0.5, route="/a")
+        second.metrics[1].observe(0.5, route="/a")
+
+        first.flush(force=True)
+        text = second.render()
+
+        self.assertEqual(sample_value(text, "rows_total"), 7)
+        self.assertEqual(sample_value(text, 'latency_seconds_count{route="/a"}'), 2)
+
+        # Flushing again replaces, rather than adds to, a process's totals
+        first.flush(force=True)
+        self.assertEqual(sample_value(second.render(), "rows_total"), 7)
+
+    def test_exited_processes_are_kept(self):
+        exited = self.registry()
+        exited.metrics[0].inc(4)
+        exited.flush(force=True)
+
+        self.assertEqual(sample_value(self.registry().render(), "rows_total"), 4)
+
+    def process_ids(self):
+        store = MetricsStore(self.metrics_file)
+        return {process_id
+                for (process_id,) in store._connection().execute(
+                    "SELECT DISTINCT process_id FROM Sample")}
+
+    def test_retire(self):
+        first = self.registry()
+        first.metrics[0].inc(2)
+        first.flush(force=True)
+        process_id = first.process_id
+
+        first.retire()
+        self.assertEqual(self.process_ids(), {MetricsStore.EXITED})
+        self.assertNotEqual(first.process_id, process_id)
+
+        # Counted afresh, under a new process_id
+        first.metrics[0].inc(3)
+        second = self.registry()
+        second.metrics[0].inc(4)
+        second.retire()
+
+        self.assertEqual(sample_value(first.render(), "rows_total"), 9)
+        self.assertEqual(self.process_ids(), {MetricsStore.EXITED, first.process_id})
+
+    def test_killed_processes_are_folded(self):
+        killed = self.registry()
+        killed.metrics[0].inc(4)
+        killed.flush(force=True)
+
+        # As though written by a process which has since exited
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        store = MetricsStore(self.metrics_file)
+        store._connection().execute("UPDATE Process SET pid = ?", (exited.pid,))
+
+        running = self.registry()
+        running.metrics[0].inc(1)
+
+        self.assertEqual(sample_value(running.render(), "rows_total"), 5)
+        self.assertEqual(self.process_ids(), {MetricsStore.EXITED, running.process_id})
+
+        self.assertEqual(store.fold_exited(), 0)
+        self.assertEqual(sample_value(running.render(), "rows_total"), 5)
+
+    def test_flush_interval(self):
+        first = self.registry()
+        second = self.registry()
+        first.flush_interval = 60
+
+        first.flush()
+        first.metrics[0].inc()
+        first.flush()
+
+        self.assertEqual(sample_value(second.render(), "rows_total"), 0)
+
+    def test_after_fork(self):
+        registry = self.registry()
+        registry.metrics[0].inc(2)
+        registry.flush(force=True)
+        process_id = registry.process_id
+
+        registry.after_fork()
+        registry.metrics[0].inc()
+
+        self.assertNotEqual(registry.process_id, process_id)
+        self.assertEqual(sample_value(registry.render(), "rows_total"), 3)
+
+
+class TestMetricsRoute(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def metrics(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        return response.get_data(as_text=True)
+
+    def test_ingest(self):
+        before = self.metrics()
+
+        results = [{"test_name": "test {}".format(test),
+                    "series_name": "metrics",
+                    "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+                    "test_result": "PASS"} for test in range(5)]
+        response = self.client.post("/add_result",
+                                    data=json.dumps(results),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+        after = self.metrics()
+
+        for sample, added in [("trapp_ingest_rows_total", 5),
+                              ("trapp_ingest_batches_total", 1),
+                              ('trapp_ingest_phase_seconds_count{phase="save"}', 1)]:
+            self.assertEqual(sample_value(after, sample) - sample_value(before, sample),
+                             added, sample)
+
+        route = 'trapp_http_request_duration_seconds_count{route="/add_result",method="POST",status="200"}'
+        self.assertEqual(sample_value(after, route) - sample_value(before, route), 1)
+
+        self.assertGreater(sample_value(after, 'trapp_db_query_duration_seconds_count{kind="write"}'),
+                           sample_value(before, 'trapp_db_query_duration_seconds_count{kind="write"}'))
+        self.assertEqual(sample_value(after, "trapp_database_bytes"),
+                         os.path.getsize(TEST_DATABASE_PATH))
+        self.assertNotIn("trapp_database_wal_bytes", after)
+
+    def test_cache(self):
+        before = self.metrics()
+
+        self.client.get("/api/series").get_data()
+        self.client.get("/api/series").get_data()
+
+        after = self.metrics()
+
+        hits = 'trapp_cache_requests_total{result="hit"}'
+        misses = 'trapp_cache_requests_total{result="miss"}'
+        self.assertGreaterEqual(sample_value(after, hits) - sample_value(before, hits), 1)
+        self.assertGreaterEqual(sample_value(after, misses) - sample_value(before, misses), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,9 @@ import models.batch
 import models.test_history
 import inspect
 import unittest
+import flask_table
+from app import app, HISTORY_TABLE, shutdown
+from models.series_summary import SERIES_TABLE
 import os
 import json
 
@@ -40,6 +43,27 @@ logging.basicConfig()
 logger.setLevel(logging.INFO)
 
 
+class FlaskSeriesTable(flask_table.Table):
+    classes = ["table table-striped"]
+    test_name = flask_table.LinkCol("Test Name",
+                                    "route_view_results_series_test",
+                                    url_kwargs=dict(test_name="test_name",
+                                                    series_name="series_name"),
+                                    attr_list="test_name")
+
+    is_stable = flask_table.Col("Considered Stable")
+
+
+class FlaskHistoryTable(flask_table.Table):
+    classes = ["table table-striped"]
+    test_result = flask_table.Col("Result")
+    batch_timestamp = flask_table.Col("Batch Timestamp")
+    vcs_system = flask_table.Col("VCS")
+    vcs_revision = flask_table.Col("VCS Revision")
+    test_timestamp = flask_table.Col("Test Timestamp")
+    metadata = flask_table.Col("Metadata")
+
+
 TEST_DATABASE_PATH = "test/data/test_performance.sqlite"
 
 DELETE_DB = True
@@ -60,7 +84,7 @@ class TestPerformance(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        common.database.Database.shutdown()
+        shutdown()
 
         if DELETE_DB is False:
             return
@@ -129,3 +153,45 @@ class TestPerformance(unittest.TestCase):
 
         db_size = os.path.getsize(TEST_DATABASE_PATH)
         logger.info("Database size: {}".format(db_size))
+
+    def compare_table_rendering(self, name, table, flask_table_class, items):
+
+        with app.test_request_context():
+            time_before = time.time()
+            expected = flask_table_class(items).__html__()
+            flask_table_delta = time.time() - time_before
+
+            time_before = time.time()
+            rendered = table.render(items)
+            table_delta = time.time() - time_before
+
+        logger.info("Rendering {} {} rows took {} seconds with flask_table "
+                    "and {} seconds with html_table".format(len(items),
+                                                            name,
+                                                            flask_table_delta,
+                                                            table_delta))
+
+        self.assertEqual(rendered, expected)
+
+    def test_table_rendering(self):
+
+        rows = 50000
+
+        tests = []
+        for i in range(rows):
+            temp = dict()
+            temp["test_name"] = "test name <{}>".format(i)
+            temp["series_name"] = "series/{}".format(i % 10)
+            temp["is_stable"] = i % 2 == 0
+            temp["test_result"] = "PASS"
+            temp["batch_timestamp"] = datetime.datetime.fromtimestamp(i)
+            temp["vcs_system"] = "git"
+            temp["vcs_revision"] = i
+            temp["test_timestamp"] = None
+            temp["metadata"] = "metadata & {}".format(i)
+            tests.append(temp)
+
+        self.compare_table_rendering("series", SERIES_TABLE,
+                                     FlaskSeriesTable, tests)
+        self.compare_table_rendering("history", HISTORY_TABLE,
+                                     FlaskHistoryTable, tests)
@@ -0,0 +1,160 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import tempfile
+import pstats
+import common.database
+import models.batch
+from common.profiling import ProfilerMiddleware, summarise_components
+import app
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_profiling.sqlite"
+
+DELETE_DB = True
+
+SERIES_NAME = "profiled"
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler_directory = app.profiler.directory
+        app.profiler.directory = self.directory.name
+        app.profiler.enabled = True
+
+    def tearDown(self):
+        app.profiler.enabled = app.app.config["PROFILING_ENABLED"]
+        app.profiler.directory = self.profiler_directory
+        self.directory.cleanup()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self):
+        models.batch.add_batch([{
+            "test_name": "test {}".format(test),
+            "series_name": SERIES_NAME,
+            "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+            "test_result": "PASS" if test % 3 else "FAIL",
+        } for day in range(1, 10) for test in range(200)], 0)
+
+    def saved(self, extension):
+        return sorted(name for name in os.listdir(self.directory.name)
+                      if name.endswith(extension))
+
+    def test_not_requested(self):
+        self.add_results()
+
+        self.assertEqual(self.client.get("/results/series/" + SERIES_NAME).status_code, 200)
+        self.assertEqual(self.saved(".json"), [])
+
+        app.profiler.enabled = False
+        self.assertEqual(self.client.get("/results/series/{}?profile".format(SERIES_NAME)).status_code, 200)
+        self.assertEqual(self.client.get("/debug/profiles").status_code, 404)
+        self.assertEqual(self.saved(".json"), [])
+
+    def test_profile(self):
+        self.add_results()
+
+        plain = self.client.get("/results/series/{}/type/passing".format(SERIES_NAME))
+
+        # Streamed, and previously cached, pages are profiled in full
+        for url, headers in [("/results/series/{}/type/passing?profile", {}),
+                             ("/results/series/{}/type/passing", {"X-Profile": "1"})]:
+            response = self.client.get(url.format(SERIES_NAME), headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(), plain.get_data())
+
+        self.assertEqual(len(self.saved(".json")), 2)
+        self.assertEqual(len(self.saved(".pstats")), 2)
+        self.assertEqual(len(self.saved(".collapsed")), 2)
+
+        summary = app.profiler.list_profiles()[0]
+        self.assertEqual(summary["path"], "/results/series/{}/type/passing".format(SERIES_NAME))
+        self.assertEqual(summary["status"], "200 OK")
+        self.assertGreater(summary["components"]["SeriesSummary"], 0)
+        self.assertGreater(summary["components"]["TestHistory"], 0)
+        self.assertGreater(summary["components"]["html_table"], 0)
+        self.assertGreater(summary["components"]["sqlite3"], 0)
+
+        stats = pstats.Stats(os.path.join(self.directory.name, summary["name"] + ".pstats"))
+        self.assertEqual(summarise_components(stats), summary["components"])
+
+        with open(os.path.join(self.directory.name, summary["name"] + ".collapsed")) as collapsed:
+            for line in collapsed:
+                stack, count = line.rsplit(" ", 1)
+                self.assertGreater(int(count), 0)
+
+        listing = self.client.get("/debug/profiles")
+        self.assertEqual(listing.status_code, 200)
+        self.assertIn(summary["name"].encode(), listing.get_data())
+
+        download = self.client.get("/debug/profiles/" + summary["name"] + ".collapsed")
+        self.assertEqual(download.status_code, 200)
+
+    def test_keep(self):
+        middleware = ProfilerMiddleware(app.app.wsgi_app.wsgi_app,
+                                        self.directory.name,
+                                        keep=2)
+
+        for _ in range(4):
+            environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/echo:x",
+                       "QUERY_STRING": "profile", "SERVER_NAME": "localhost",
+                       "SERVER_PORT": "80", "wsgi.url_scheme": "http"}
+            body = middleware(environ, lambda status, headers, exc_info=None: None)
+            self.assertIn(b"x", b"".join(body))
+
+        self.assertEqual(len(self.saved(".json")), 2)
+        self.assertEqual(len(self.saved(".pstats")), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import sqlite3
+import datetime
+from unittest import mock
+import common.database
+from common.database import Database
+import tools.dataset as dataset
+from models.batch import add_batch
+from models.series_summary import SeriesSummary
+from models.series_export import SeriesExport
+import models.test_history
+from models.archive import Archive
+from models.rollup import Trend
+import models.retention as retention
+import tempfile
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_query_plans.sqlite"
+
+DELETE_DB = True
+
+# Enough rows for SQLite to prefer an index over a scan, when there is one
+SHAPE = dataset.DatasetShape(series=5, batches_per_series=20, tests_per_batch=100,
+                             metadata_cardinality=50)
+
+QUERY_METHODS = ["query_one", "query_row", "query_rows", "query_iter", "execute"]
+
+
+def full_scans(plan):
+    """
+    The steps of an EXPLAIN QUERY PLAN which read a whole table, or a whole
+    index, rather than searching it. Scans of subqueries, and of common table
+    expressions, are fine.
+    """
+    subqueries = set(step.split()[1] for step in plan
+                     if step.startswith(("MATERIALIZE ", "CO-ROUTINE ")))
+
+    return [step for step in plan
+            if step.split()[1] not in subqueries and
+            ((step.startswith("SCAN ") and not step.startswith("SCAN (")) or
+             "AUTOMATIC" in step)]
+
+
+class TestQueryPlans(unittest.TestCase):
+    """
+    Runs adding results, summarising a series, reading test histories and
+    removing old results against a generated database, then checks that
+    every statement they ran searches indexes rather than scanning tables.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.isfile(TEST_DATABASE_PATH):
+            os.remove(TEST_DATABASE_PATH)
+
+        dataset.load(dataset.generate_batches(SHAPE), TEST_DATABASE_PATH)
+
+        cls.statements = {}
+
+        def recorder(method):
+            def record(command, args=()):
+                cls.statements.setdefault(command, args)
+                return method(command, args)
+            return record
+
+        patches = [mock.patch.object(Database, name, side_effect=recorder(getattr(Database, name)))
+                   for name in QUERY_METHODS]
+
+        for patch in patches:
+            patch.start()
+
+        try:
+            cls.run_workload()
+        finally:
+            for patch in patches:
+                patch.stop()
+
+    @classmethod
+    def tearDownClass(cls):
+        common.database.Database.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def run_workload(cls):
+        name = dataset.series_name(0)
+
+        add_batch([{"test_name": dataset.test_name(test),
+                    "series_name": name,
+                    "batch_timestamp": "2030-01-01T00:00:00",
+                    "test_result": "PASS",
+                    "vcs_system": "git",
+                    "vcs_revision": "a new revision",
+                    "metadata": "new metadata"} for test in range(10)], 0)
+
+        SeriesSummary(name)
+        SeriesSummary.count_tests(name, 1, datetime.datetime(2030, 1, 2))
+        list(SeriesSummary.iter_tests(name, "passing"))
+        list(models.test_history.TestHistory.iter_tests(name, dataset.test_name(0)))
+        list(SeriesExport(name, page_size=500).pages())
+        list(SeriesExport(name,
+                          since=datetime.datetime(2018, 1, 1),
+                          until=datetime.datetime(2030, 1, 1),
+                          test_names=[dataset.test_name(0)]).pages())
+
+        for test in range(10):
+            models.test_history.TestHistory(name, dataset.test_name(test)).cleanup_db(2)
+
+        Trend(name)
+        Trend(name, dataset.test_name(0), "day")
+
+        with tempfile.TemporaryDirectory() as directory:
+            retention.enforce(dataset.series_name(1), retention.RetentionPolicy(count=15, days=1),
+                              Archive(directory), now=datetime.datetime(2018, 1, 2, 5))
+
+    def explain(self, command, args):
+        conn = sqlite3.connect(TEST_DATABASE_PATH)
+        try:
+            return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + command, args)]
+        finally:
+            conn.close()
+
+    def check_plans(self):
+        for command, args in self.statements.items():
+            with self.subTest(statement=" ".join(command.split())):
+                plan = self.explain(command, args)
+                self.assertEqual(full_scans(plan), [], "\n".join(plan))
+
+    def test_workload(self):
+        # The statements the request asks about
+        commands = " ".join(" ".join(command.split()) for command in self.statements)
+
+        for statement in ["WHERE (Test.test_name = ? AND Series.series_name = ?)",
+                          "SELECT DISTINCT Test.test_name",
+                          "SELECT series_id FROM Series",
+                          "SELECT batch_id FROM Batch",
+                          "SELECT vcs_id FROM Vcs",
+                          "SELECT metadata_id FROM Metadata",
+                          "SELECT test_id FROM Test",
+                          "SELECT COUNT () FROM Test WHERE Test.batch_id",
+                          "SELECT COUNT () FROM Batch WHERE Batch.series_id",
+                          "SELECT COUNT () FROM Test WHERE Test.metadata_id",
+                          "SELECT COUNT () FROM Batch WHERE Batch.vcs_id",
+                          "DELETE FROM Vcs WHERE vcs_id = ?",
+                          "WITH History AS",
+                          "INSERT OR IGNORE INTO Rollup",
+                          "UPDATE Rollup SET",
+                          "FROM Rollup"]:
+            self.assertIn(statement, commands)
+
+    def test_without_statistics(self):
+        self.check_plans()
+
+    def test_with_statistics(self):
+        conn = sqlite3.connect(TEST_DATABASE_PATH)
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+
+        try:
+            self.check_plans()
+        finally:
+            conn = sqlite3.connect(TEST_DATABASE_PATH)
+            conn.execute("DROP TABLE IF EXISTS sqlite_stat1")
+            conn.commit()
+            conn.close()
+
+    def test_full_scans(self):
+        self.assertEqual(full_scans(["SCAN Batch", "SCAN (subquery-1)",
+                                     "MATERIALIZE History", "SCAN History",
+                                     "SEARCH History USING AUTOMATIC COVERING INDEX (test_name=?)",
+                                     "SCAN Test USING INDEX sqlite_autoindex_Test_1",
+                                     "SEARCH Batch USING INDEX batch_series (series_id=?)",
+                                     "SEARCH Test USING AUTOMATIC COVERING INDEX (batch_id=?)"]),
+                         ["SCAN Batch", "SCAN Test USING INDEX sqlite_autoindex_Test_1",
+                          "SEARCH Test USING AUTOMATIC COVERING INDEX (batch_id=?)"])
+
+
+if __name__ == '__main__':
+    unittest.main()
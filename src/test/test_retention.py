@@ -0,0 +1,244 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import tempfile
+import datetime
+import threading
+import time
+from common.database import Database
+from common.threads import PeriodicTask
+import models.batch
+import models.retention as retention
+from models.retention import RetentionPolicy, RetentionPolicies
+from models.test_history import TestHistory
+from models.series_version import SeriesVersion
+import tools.retention
+from tools.dataset import DatasetShape, generate_batches, load
+import app
+from unittest import mock
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_retention.sqlite"
+
+DELETE_DB = True
+
+SHAPE = DatasetShape(series=2, batches_per_series=12, tests_per_batch=20,
+                     flake_rate=0.3, fail_rate=0.3)
+
+# Every result by name and time
+SQL_RESULTS = """
+SELECT Series.series_name, Test.test_name, CAST(Batch.batch_timestamp AS TEXT)
+FROM Test
+    INNER JOIN Batch ON Test.batch_id = Batch.batch_id
+    INNER JOIN Series ON Batch.series_id = Series.series_id
+"""
+
+NO_LIMIT = RetentionPolicies({}, RetentionPolicy())
+
+
+class TestRetention(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        Database.initialise(TEST_DATABASE_PATH)
+
+        self.batches = list(generate_batches(SHAPE))
+        load(self.batches, TEST_DATABASE_PATH)
+
+    def tearDown(self):
+        Database.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def results(self):
+        return set(Database.query_rows(SQL_RESULTS))
+
+    def reload(self):
+        Database.shutdown()
+        os.remove(TEST_DATABASE_PATH)
+        load(self.batches, TEST_DATABASE_PATH)
+
+    def test_count_as_cleanup_db(self):
+        test_names = [row[0] for row in Database.query_rows("SELECT DISTINCT test_name FROM Test")]
+
+        for series_name in ["series 0", "series 1"]:
+            for test_name in test_names:
+                TestHistory(series_name, test_name).cleanup_db(3)
+
+        expected = self.results()
+        self.reload()
+
+        removed = retention.sweep(RetentionPolicies({}, RetentionPolicy(count=3)), chunk_rows=7)
+
+        self.assertEqual(self.results(), expected)
+        self.assertEqual(sum(removed.values()),
+                         sum(len(batch) for batch in self.batches) - len(expected))
+
+        # Nothing more to remove
+        self.assertEqual(sum(retention.sweep(RetentionPolicies({}, RetentionPolicy(count=3))).values()), 0)
+
+    def test_policies(self):
+        policies = RetentionPolicies({"series 0": dict(days=1), "other*": dict(count=1)},
+                                     RetentionPolicy(count=5))
+
+        self.assertEqual(policies.for_series("series 0").days, 1)
+        self.assertEqual(policies.for_series("other series").count, 1)
+        self.assertEqual(policies.for_series("series 1").count, 5)
+
+        version = SeriesVersion.get("series 0")
+
+        # Batches are an hour apart, the last at 11:00
+        now = datetime.datetime(2018, 1, 2, 6)
+        removed = retention.sweep(policies, now=now)
+
+        self.assertEqual(Database.query_one("""SELECT MIN(batch_timestamp) FROM Batch
+                                               INNER JOIN Series USING (series_id)
+                                               WHERE series_name = 'series 0'"""),
+                         "2018-01-01 06:00:00")
+        self.assertGreater(removed["series 0"], 0)
+        self.assertNotEqual(SeriesVersion.get("series 0").etag, version.etag)
+
+        for test_name in ["test 0", "test 7"]:
+            self.assertEqual(len(TestHistory("series 0", test_name).tests), 6)
+            self.assertLessEqual(len(TestHistory("series 1", test_name).tests), 5)
+
+    def test_unused_rows(self):
+        retention.sweep(RetentionPolicies({}, RetentionPolicy(days=0)))
+
+        self.assertEqual(self.results(), set())
+        for table in ["Series", "Batch", "Vcs", "Metadata"]:
+            self.assertEqual(Database.query_one("SELECT COUNT () FROM " + table), 0, table)
+
+    def test_incremental_vacuum(self):
+        self.assertEqual(Database.query_one("PRAGMA auto_vacuum"), 2)
+
+        size = os.path.getsize(TEST_DATABASE_PATH)
+        retention.sweep(RetentionPolicies({}, RetentionPolicy(count=1)))
+
+        self.assertLess(os.path.getsize(TEST_DATABASE_PATH), size * 0.75)
+        self.assertEqual(Database.query_one("PRAGMA freelist_count"), 0)
+
+    def test_add_batch(self):
+        self.reload()
+        Database.shutdown()
+        os.remove(TEST_DATABASE_PATH)
+        Database.initialise(TEST_DATABASE_PATH)
+
+        policies = RetentionPolicies({"series 1": dict(count=2)}, RetentionPolicy(count=4))
+
+        for batch in self.batches:
+            models.batch.add_batch(batch, policies)
+
+        self.assertLessEqual(len(TestHistory("series 0", "test 3").tests), 4)
+        self.assertLessEqual(len(TestHistory("series 1", "test 3").tests), 3)
+        self.assertGreater(len(TestHistory("series 0", "test 3").tests),
+                           len(TestHistory("series 1", "test 3").tests))
+
+    def test_main(self):
+        history_size = app.app.config["TEST_HISTORY_SIZE"]
+        app.app.config["TEST_HISTORY_SIZE"] = 2
+
+        try:
+            self.assertEqual(tools.retention.main(["--vacuum"]), 0)
+        finally:
+            app.app.config["TEST_HISTORY_SIZE"] = history_size
+
+        Database.initialise(TEST_DATABASE_PATH)
+        self.assertLessEqual(len(TestHistory("series 1", "test 3").tests), 3)
+
+    def test_periodic_task(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lock_file = os.path.join(directory, "task.lock")
+            running = threading.Event()
+            finish = threading.Event()
+            calls = []
+
+            def slow():
+                running.set()
+                finish.wait(5)
+                calls.append("slow")
+
+            first = PeriodicTask("first", 0.01, slow, lock_file)
+            first.start()
+            running.wait(5)
+
+            # The first holds the lock
+            second = PeriodicTask("second", 0, lambda: calls.append("second"), lock_file)
+            self.assertFalse(second.run_once())
+
+            finish.set()
+            first.stop()
+            self.assertTrue(second.run_once())
+            self.assertEqual(calls[-1], "second")
+
+    def test_periodic_task_across_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lock_file = os.path.join(directory, "task.lock")
+            calls = []
+
+            first = PeriodicTask("first", 60, lambda: calls.append("first"), lock_file)
+            second = PeriodicTask("second", 60, lambda: calls.append("second"), lock_file)
+
+            # Called by one worker, not again by the next within the interval
+            self.assertTrue(first.run_once())
+            self.assertFalse(second.run_once())
+            self.assertFalse(first.run_once())
+            self.assertEqual(calls, ["first"])
+
+            with mock.patch("time.time", return_value=time.time() + 61):
+                self.assertTrue(second.run_once())
+            self.assertEqual(calls, ["first", "second"])
+
+            # Not recorded if it fails, so it is tried again
+            def fail():
+                raise RuntimeError("failed")
+
+            failing = PeriodicTask("failing", 60, fail, os.path.join(directory, "failing.lock"))
+            self.assertRaises(RuntimeError, failing.run_once)
+            self.assertRaises(RuntimeError, failing.run_once)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import json
+from common.database import Database
+import models.batch
+import models.retention as retention
+from models.retention import RetentionPolicy, RetentionPolicies
+from models.rollup import Trend, period_start
+from models.archive import ArchivedResult
+import models.rollup as rollup
+from tools.dataset import DatasetShape, generate_batches, load
+import app
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_rollup.sqlite"
+
+DELETE_DB = True
+
+# A batch every 15 hours, over about seven weeks
+SHAPE = DatasetShape(series=2, batches_per_series=80, tests_per_batch=8,
+                     flake_rate=0.3, fail_rate=0.3, batch_interval=15)
+
+
+class TestRollup(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+        self.batches = list(generate_batches(SHAPE))
+
+    def tearDown(self):
+        Database.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def trends(self):
+        return [Trend(series_name, test_name, period).as_dict()
+                for series_name in ["series 0", "series 1"]
+                for test_name in [None, "test 0", "test 5"]
+                for period in ["day", "week"]]
+
+    def test_period_start(self):
+        # A Wednesday
+        timestamp = datetime.datetime(2018, 1, 3, 23, 59)
+
+        self.assertEqual(period_start(timestamp, "day"), "2018-01-03")
+        self.assertEqual(period_start(timestamp, "week"), "2018-01-01")
+        self.assertEqual(period_start(datetime.datetime(2018, 1, 7), "week"), "2018-01-01")
+
+        # The same as SQLite gives for results still in the database
+        for day in range(1, 15):
+            timestamp = datetime.datetime(2018, 1, day, 12)
+            self.assertEqual(Database.query_one("SELECT " + rollup.PERIODS["week"].replace(
+                                                    "Batch.batch_timestamp", "?"), (timestamp,)),
+                             period_start(timestamp, "week"))
+
+    def test_sweep(self):
+        load(self.batches, TEST_DATABASE_PATH)
+        before = self.trends()
+
+        removed = retention.sweep(RetentionPolicies({}, RetentionPolicy(count=3)), chunk_rows=50)
+        self.assertGreater(sum(removed.values()), 0)
+
+        # The same, though most results are gone
+        self.assertEqual(self.trends(), before)
+
+        weeks = Trend("series 0", "test 0").points
+        self.assertGreater(len(weeks), 6)
+        self.assertEqual(sum(point.pass_count + point.fail_count + point.skip_count for point in weeks),
+                         sum(1 for batch in self.batches for result in batch
+                             if result["series_name"] == "series 0" and result["test_name"] == "test 0"))
+
+        # Removing everything keeps the trend too
+        retention.sweep(RetentionPolicies({}, RetentionPolicy(days=0)))
+        self.assertEqual(Database.query_one("SELECT COUNT () FROM Test"), 0)
+        self.assertEqual(self.trends(), before)
+
+    def test_add_batch(self):
+        load(self.batches, TEST_DATABASE_PATH)
+        before = self.trends()
+
+        Database.shutdown()
+        os.remove(TEST_DATABASE_PATH)
+        Database.initialise(TEST_DATABASE_PATH)
+
+        for batch in self.batches:
+            models.batch.add_batch(batch, 2)
+
+        self.assertEqual(self.trends(), before)
+
+        # A row for each test and day or week with results removed
+        days = len(set(point["period_start"] for trend in before if trend["period"] == "day"
+                       for point in trend["points"]))
+        self.assertLess(Database.query_one("SELECT COUNT () FROM Rollup"),
+                        2 * 8 * days * 2)
+
+    def test_durations(self):
+        timestamp = datetime.datetime(2018, 1, 1, 10)
+        results = [ArchivedResult("test", "series", timestamp, "PASS", test_duration=4),
+                   ArchivedResult("test", "series", timestamp, "FAIL", test_duration=None),
+                   ArchivedResult("test", "series", timestamp, "SKIP", test_duration=1)]
+
+        rollup.fold(results[:2])
+        rollup.fold(results[2:])
+
+        point, = Trend("series", "test", "day").points
+        self.assertEqual(point.as_dict(),
+                         dict(period_start="2018-01-01", pass_count=1, fail_count=1, skip_count=1,
+                              pass_rate=0.5, duration_min=1, duration_mean=2.5, duration_max=4))
+
+    def test_routes(self):
+        for batch in self.batches:
+            models.batch.add_batch(batch, 2)
+
+        response = self.client.get("/api/trend/series/series 1?test=test 3&period=day")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data(as_text=True)),
+                         Trend("series 1", "test 3", "day").as_dict())
+
+        response = self.client.get("/api/trend/series/series 1")
+        self.assertEqual(json.loads(response.get_data(as_text=True))["period"], "week")
+
+        self.assertEqual(self.client.get("/api/trend/series/series 1?period=month").status_code, 400)
+
+        response = self.client.get("/trend/series/series 1?test=test 3")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True).count("<tr>") - 1,
+                         len(Trend("series 1", "test 3").points))
+
+        page = self.client.get("/results/series/series 1/test/test 3").get_data(as_text=True)
+        self.assertIn("/trend/series/series%201?test=test+3", page)
+
+
+if __name__ == '__main__':
+    unittest.main()
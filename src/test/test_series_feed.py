@@ -0,0 +1,234 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import common.database
+import models.batch
+from models.series_feed import SeriesFeed
+from models.series_summary import SeriesSummary
+from app import app, shutdown, stream_admission
+from unittest import mock
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_series_feed.sqlite"
+
+DELETE_DB = True
+
+SERIES_NAME = "feed"
+
+
+class TestSeriesFeed(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self, day, results):
+        models.batch.add_batch([{
+            "test_name": test_name,
+            "series_name": SERIES_NAME,
+            "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+            "test_result": test_result,
+        } for test_name, test_result in results.items()], 0)
+
+    def read_events(self, response, count):
+        events = []
+        buffer = ""
+
+        for chunk in response.response:
+            buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+
+            while "\n\n" in buffer:
+                message, buffer = buffer.split("\n\n", 1)
+                fields = dict(line.split(": ", 1) for line in message.split("\n")
+                              if not line.startswith(":"))
+                if "event" in fields:
+                    events.append(fields)
+
+            if len(events) >= count:
+                return events
+
+        return events
+
+    def test_feed(self):
+        self.add_results(1, {"a": "PASS", "b": "PASS", "c": "FAIL"})
+
+        feed = SeriesFeed(SERIES_NAME)
+        feed.refresh()
+
+        self.assertEqual(feed.summary, SeriesSummary.count_tests(SERIES_NAME))
+        self.assertEqual(feed.events_since(None), None)
+        self.assertEqual(feed.events_since(feed.event_id), [])
+        first_id = feed.event_id
+
+        # Nothing changed
+        feed.refresh()
+        self.assertEqual(len(feed.events), 0)
+
+        self.add_results(2, {"a": "FAIL", "b": "PASS", "d": "PASS"})
+        feed.refresh()
+
+        events = feed.events_since(first_id)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["id"], feed.event_id)
+        self.assertEqual(events[0]["data"]["counts"]["newly_failing"], 1)
+        self.assertEqual(events[0]["data"]["changes"], [
+            dict(test_name="a", state="newly_failing", previous_state="passing"),
+            dict(test_name="d", state="passing", previous_state=None)])
+
+        # Updates are only checked for once every poll interval unless this
+        # process added the results
+        feed.refresh(60)
+        self.add_results(3, {"b": "FAIL"})
+        SeriesFeed.notify({"another series"})
+        feed.refresh(60)
+        self.assertEqual(len(feed.events), 1)
+
+        feed.refresh()
+        self.assertEqual(len(feed.events), 2)
+        self.assertEqual(len(feed.events_since(first_id)), 2)
+
+        # Too old to replay
+        self.assertEqual(feed.events_since(first_id - 1), None)
+
+    def test_shared(self):
+        feed = SeriesFeed.get(SERIES_NAME)
+        self.assertIs(SeriesFeed.get(SERIES_NAME), feed)
+        other = SeriesFeed.get(SERIES_NAME, 1)
+        self.assertIsNot(other, feed)
+
+        # Kept for clients which reconnect once the last listener leaves
+        other.release()
+        feed.release()
+        feed.release()
+        self.assertIs(SeriesFeed.get(SERIES_NAME), feed)
+        feed.release()
+
+        # Then dropped
+        with mock.patch.object(SeriesFeed, "KEEP_IDLE", 0):
+            new = SeriesFeed.get(SERIES_NAME)
+            self.assertIsNot(new, feed)
+            new.release()
+            self.assertEqual(SeriesFeed._feeds, {})
+
+    def test_route(self):
+        self.add_results(1, {"a": "PASS", "b": "FAIL"})
+
+        poll_interval = app.config["SSE_POLL_INTERVAL"]
+        app.config["SSE_POLL_INTERVAL"] = 0.05
+        try:
+            response = self.client.get("/events/series/" + SERIES_NAME,
+                                       buffered=False)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "text/event-stream")
+
+            summary = self.read_events(response, 1)[0]
+            self.assertEqual(summary["event"], "summary")
+            self.assertEqual(json.loads(summary["data"]),
+                             SeriesSummary.count_tests(SERIES_NAME))
+
+            self.add_results(2, {"a": "FAIL", "b": "FAIL"})
+
+            update = self.read_events(response, 1)[0]
+            self.assertEqual(update["event"], "update")
+            self.assertGreater(int(update["id"]), int(summary["id"]))
+
+            data = json.loads(update["data"])
+            self.assertEqual(data["counts"]["newly_failing"], 1)
+            self.assertEqual(data["changes"], [
+                dict(test_name="a", state="newly_failing", previous_state="passing")])
+            response.close()
+
+            # A client reconnecting is sent what it missed
+            response = self.client.get("/events/series/" + SERIES_NAME,
+                                       headers={"Last-Event-ID": summary["id"]},
+                                       buffered=False)
+            replayed = self.read_events(response, 1)[0]
+            self.assertEqual(replayed, update)
+            response.close()
+
+            # Closed streams leave no feeds watched
+            self.assertEqual([feed._listeners for feed in SeriesFeed._feeds.values()], [0])
+
+        finally:
+            app.config["SSE_POLL_INTERVAL"] = poll_interval
+
+    def test_route_limit(self):
+        # Take every slot, as streams to other workers would
+        slots = [stream_admission.in_flight.try_acquire()
+                 for _ in range(app.config["SSE_MAX_STREAMS"] - 1)]
+
+        try:
+            response = self.client.get("/events/series/" + SERIES_NAME,
+                                       buffered=False)
+            self.assertEqual(response.status_code, 200)
+
+            rejected = self.client.get("/events/series/" + SERIES_NAME,
+                                       buffered=False)
+            self.assertEqual(rejected.status_code, 503)
+            self.assertEqual(rejected.headers["Retry-After"],
+                             str(app.config["SSE_RETRY_AFTER"]))
+
+            # Reading is unaffected
+            self.assertEqual(self.client.get("/api/series").status_code, 200)
+
+            # Closing a stream frees its slot
+            response.close()
+            response = self.client.get("/events/series/" + SERIES_NAME,
+                                       buffered=False)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        finally:
+            for slot in slots:
+                stream_admission.release(slot)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import random
+import common.database
+import models.batch
+from models.series_summary import SeriesSummary, CATEGORY_STATES
+from models.test_history import TestHistory
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_series_summary.sqlite"
+
+DELETE_DB = True
+
+
+class TestSeriesSummary(unittest.TestCase):
+
+    def setUp(self):
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        common.database.Database.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_random_results(self, series_name, test_count, batch_count):
+        generator = random.Random(series_name)
+
+        for day in range(1, batch_count + 1):
+            result_data = []
+
+            for test in range(test_count):
+                # Some tests are not run in every batch
+                if test % 5 == 0 and generator.random() < 0.5:
+                    continue
+
+                test_result = generator.choice(["PASS", "FAIL", "SKIP"])
+                # Some tests only ever skip or fail
+                if test % 7 == 0:
+                    test_result = "SKIP"
+                elif test % 11 == 0 and test_result == "PASS":
+                    test_result = "FAIL"
+
+                result_data.append({
+                    "test_name": "test {}".format(test),
+                    "series_name": series_name,
+                    "batch_timestamp": str(datetime.datetime(2018, 1, day, 12)),
+                    "test_result": test_result,
+                })
+
+            models.batch.add_batch(json.dumps(result_data), 0)
+
+    def check_series(self, series_name, days_until_result_stale, now):
+        series = SeriesSummary(series_name, days_until_result_stale)
+
+        histories = [TestHistory(series_name,
+                                 history.test_name,
+                                 days_until_result_stale,
+                                 datetime_utc_now=now)
+                     for history in series.test_histories]
+
+        test_states = list(SeriesSummary.query_test_states(
+                                series_name,
+                                days_until_result_stale,
+                                datetime_utc_now=now))
+
+        self.assertEqual(test_states,
+                         [(history.test_name, history.state)
+                          for history in histories])
+
+        for category, states in CATEGORY_STATES.items():
+            listed = [(test.test_name, test.is_stable) for test in
+                      SeriesSummary.iter_tests(series_name,
+                                               category,
+                                               days_until_result_stale,
+                                               datetime_utc_now=now)]
+
+            in_category = [history for history in histories
+                           if history.state in states]
+            in_category.sort(key=lambda history: not history.is_stable
+                             if category == "newly_failing" else 0)
+
+            self.assertEqual(listed,
+                             [(history.test_name, history.is_stable)
+                              for history in in_category])
+
+        counts = SeriesSummary.count_tests(series_name,
+                                           days_until_result_stale,
+                                           datetime_utc_now=now)
+        self.assertEqual(counts["total_tests"], len(histories))
+        self.assertEqual(counts["counts"]["newly_failing_stable"],
+                         len([history for history in histories
+                              if history.state.name == "newly_failing" and
+                              history.is_stable]))
+        for category, states in CATEGORY_STATES.items():
+            self.assertEqual(counts["counts"][category],
+                             len([history for history in histories
+                                  if history.state in states]))
+
+        return set(state for test_name, state in test_states)
+
+    def test_matches_test_history(self):
+        self.add_random_results("random", 60, 12)
+
+        states = self.check_series("random", 0, None)
+        self.assertEqual(len(states), 4)
+
+        # Stale threshold between the batches
+        states = self.check_series("random", 3, datetime.datetime(2018, 1, 14))
+        self.assertEqual(len(states), 5)
+
+        # Stale threshold on a batch timestamp
+        self.check_series("random", 3, datetime.datetime(2018, 1, 14, 12))
+
+    def test_unknown_series(self):
+        self.assertEqual(list(SeriesSummary.query_test_states("unknown")), [])
+        self.assertEqual(list(SeriesSummary.iter_tests("unknown", "passing")),
+                         [])
+        self.assertEqual(SeriesSummary.count_tests("unknown")["total_tests"], 0)
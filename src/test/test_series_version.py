@@ -0,0 +1,134 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import common.database
+import models.batch
+from models.series_version import SeriesVersion
+from models.test_history import TestHistory
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_series_version.sqlite"
+
+DELETE_DB = True
+
+
+class TestSeriesVersion(unittest.TestCase):
+
+    def setUp(self):
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        common.database.Database.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self, series_name, day, test_result="PASS"):
+        test_result_data = {
+            "test_name": "test name",
+            "series_name": series_name,
+            "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+            "test_result": test_result,
+        }
+
+        models.batch.add_batch(json.dumps(test_result_data), 0)
+
+    def test_unknown_series(self):
+        version = SeriesVersion.get("unknown")
+
+        self.assertEqual(version.last_batch_id, None)
+        self.assertEqual(version.batch_version, 0)
+        self.assertEqual(version.retention_version, 0)
+        self.assertEqual(version.last_modified, None)
+
+    def test_add_batch_changes_version(self):
+        self.add_results("series_1", 1)
+
+        first = SeriesVersion.get("series_1")
+        self.assertEqual(first.batch_version, 1)
+        self.assertIsNotNone(first.last_batch_id)
+        self.assertIsNotNone(first.last_modified)
+
+        # Unrelated series does not change this series
+        self.add_results("series_2", 1)
+        self.assertEqual(SeriesVersion.get("series_1").etag, first.etag)
+
+        # Adding to an existing batch still changes the version
+        self.add_results("series_1", 1, "FAIL")
+        second = SeriesVersion.get("series_1")
+        self.assertNotEqual(second.etag, first.etag)
+
+        self.add_results("series_1", 2)
+        third = SeriesVersion.get("series_1")
+        self.assertNotEqual(third.etag, second.etag)
+        self.assertGreater(third.last_batch_id, second.last_batch_id)
+
+    def test_cleanup_changes_version(self):
+        for day in range(1, 4):
+            self.add_results("series", day)
+
+        before = SeriesVersion.get("series")
+
+        # Nothing to remove - version unchanged
+        history = TestHistory("series", "test name")
+        history.cleanup_db(3)
+        self.assertEqual(SeriesVersion.get("series").etag, before.etag)
+
+        history.cleanup_db(2)
+        after = SeriesVersion.get("series")
+        self.assertEqual(after.retention_version, 1)
+        self.assertNotEqual(after.etag, before.etag)
+
+    def test_global_version(self):
+        empty = SeriesVersion.get_global()
+
+        self.add_results("series_1", 1)
+        first = SeriesVersion.get_global()
+        self.assertNotEqual(first.etag, empty.etag)
+
+        self.add_results("series_2", 1)
+        second = SeriesVersion.get_global()
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertEqual(second.last_modified,
+                         SeriesVersion.get("series_2").last_modified)
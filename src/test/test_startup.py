@@ -0,0 +1,163 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import tempfile
+import datetime
+import multiprocessing
+import common.database
+import models.batch
+from models.series_version import SeriesVersion
+from models.series_summary import SeriesSummary
+from common.database import Database
+from common.threads import ThreadPool
+import app
+from unittest import mock
+import unittest
+import os
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_startup.sqlite"
+
+DELETE_DB = True
+
+
+def count_in_child(pool):
+    # Uses the Database, and a ThreadPool, set up by the parent
+    counts = pool.map(SeriesSummary.count_tests, ["series 0", "series 1"])
+    os._exit(0 if [c["total_tests"] for c in counts] == [3, 3] else 1)
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self, series_count):
+        for series in range(series_count):
+            models.batch.add_batch([{
+                "test_name": "test {}".format(test),
+                "series_name": "series {}".format(series),
+                "batch_timestamp": str(datetime.datetime(2018, 1, 1)),
+                "test_result": "PASS",
+            } for test in range(3)], 0)
+
+    def test_recent_series(self):
+        self.add_results(4)
+
+        self.assertEqual(SeriesVersion.get_recent_series_names(2),
+                         ["series 3", "series 2"])
+        self.assertEqual(len(SeriesVersion.get_recent_series_names(10)), 4)
+
+    def test_warm_up(self):
+        self.add_results(4)
+
+        app.warm_up(2)
+
+        with mock.patch("models.series_summary.SeriesSummary.count_tests",
+                        return_value={}) as count_tests:
+            app.series_counts("series 3")
+            app.series_counts("series 2")
+            self.assertFalse(count_tests.called)
+
+            app.series_counts("series 0")
+            self.assertTrue(count_tests.called)
+
+    def test_startup(self):
+        self.add_results(1)
+
+        with mock.patch("app._started", False):
+            with mock.patch("app.warm_up") as warm_up:
+                with mock.patch("app.create_logger") as create_logger:
+                    app.startup()
+                    app.startup()
+
+        warm_up.assert_called_once_with(app.app.config["WARM_UP_SERIES"])
+        self.assertEqual(create_logger.call_count, 1)
+
+    def test_logger_added_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, "flask.log")
+            handlers = list(logging.getLogger().handlers)
+
+            try:
+                app.create_logger(logging.INFO, log_file, log_to_stdout=True)
+                added = list(logging.getLogger().handlers)
+                app.create_logger(logging.INFO, log_file, log_to_stdout=True)
+                self.assertEqual(logging.getLogger().handlers, added)
+
+                logger.info("logged once")
+                with open(log_file) as log:
+                    self.assertEqual(log.read().count("logged once"), 1)
+            finally:
+                for handler in logging.getLogger().handlers[len(handlers):]:
+                    logging.getLogger().removeHandler(handler)
+                    handler.close()
+
+    def test_old_sqlite(self):
+        with mock.patch("sqlite3.sqlite_version_info", (3, 24, 0)):
+            self.assertRaises(RuntimeError, Database.initialise, TEST_DATABASE_PATH)
+
+    def test_fork(self):
+        self.add_results(2)
+
+        pool = ThreadPool(2)
+        parent_counts = pool.map(SeriesSummary.count_tests, ["series 0", "series 1"])
+        self.assertEqual(len(parent_counts), 2)
+
+        process = multiprocessing.get_context("fork").Process(target=count_in_child,
+                                                              args=(pool,))
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+
+        # The parent's connection is unaffected
+        self.assertEqual(Database.query_one("SELECT COUNT(*) FROM Test"), 6)
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import threading
+import common.database
+import models.batch
+from models.series_summary import SeriesSummary, SERIES_TABLE
+from models.test_history import TestHistory
+from app import app, shutdown
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_streaming.sqlite"
+
+DELETE_DB = True
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self):
+        # Test n has n passes followed by a mix of results
+        results = ["PASS", "FAIL", "PASS", "SKIP", "FAIL", "FAIL"]
+        result_data = []
+
+        for test in range(len(results)):
+            for day in range(1, len(results) + 1):
+                test_result = results[(day + test) % len(results)]
+                if day <= test:
+                    test_result = "PASS"
+
+                result_data.append({
+                    "test_name": "test <{}>".format(test),
+                    "series_name": "streamed",
+                    "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+                    "test_result": test_result,
+                    "vcs_system": "git",
+                    "vcs_revision": "sha{}".format(day),
+                })
+
+        models.batch.add_batch(json.dumps(result_data), 0)
+
+    def test_stream_matches_summary(self):
+        self.add_results()
+
+        series = SeriesSummary("streamed")
+
+        with app.test_request_context():
+            expected = {
+                "newly_failing": series.get_newly_failing_test_table(),
+                "passing": series.get_passing_test_table(),
+                "always_failing": series.get_always_failing_test_table(),
+                "stale": series.get_stale_test_table(),
+            }
+
+            for category, table in expected.items():
+                streamed = SeriesSummary.stream_test_table("streamed",
+                                                           category)
+                self.assertEqual("".join(streamed), table)
+
+    def test_stream_empty(self):
+        with app.test_request_context():
+            self.assertEqual("".join(SERIES_TABLE.stream(iter([]))),
+                             SERIES_TABLE.render([]))
+
+    def test_history(self):
+        self.add_results()
+
+        for test in range(6):
+            test_name = "test <{}>".format(test)
+            history = TestHistory("streamed", test_name)
+
+            self.assertEqual(list(TestHistory.iter_tests("streamed",
+                                                         test_name)),
+                             history.tests)
+            self.assertEqual(TestHistory.query_is_stable("streamed",
+                                                         test_name),
+                             history.is_stable)
+
+    def test_history_pages(self):
+        self.add_results()
+
+        history = TestHistory("streamed", "test <3>")
+
+        for page_size in [1, 2, 6, 7]:
+            pages = list(TestHistory.query_pages("streamed", "test <3>", page_size))
+            self.assertTrue(all(len(page) <= page_size for page in pages))
+            self.assertEqual([test for page in pages for test in page],
+                             history.tests)
+
+    def add_batch_from_thread(self):
+        errors = []
+
+        def add():
+            try:
+                models.batch.add_batch(json.dumps([{
+                    "test_name": "written",
+                    "series_name": "streamed",
+                    "batch_timestamp": "2018-02-01 00:00:00",
+                    "test_result": "PASS"}]), 0)
+            except Exception as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=add)
+        thread.start()
+        thread.join()
+
+        return errors
+
+    def test_streams_do_not_block_writes(self):
+        # A client reading a page slowly mustn't stop results being added
+        self.add_results()
+
+        tests = SeriesSummary.iter_tests("streamed", "passing")
+        next(tests)
+        self.assertEqual(self.add_batch_from_thread(), [])
+
+        tests = TestHistory.iter_tests("streamed", "test <3>", page_size=2)
+        next(tests)
+        self.assertEqual(self.add_batch_from_thread(), [])
+
+        self.assertEqual(len(list(tests)), 5)
+
+    def test_routes_are_streamed(self):
+        self.add_results()
+
+        for url in ["/results/series/streamed/type/passing",
+                    "/results/series/streamed/test/test <1>"]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_streamed)
+            self.assertIn("</table>", response.get_data(as_text=True))
+
+        response = self.client.get("/results/series/streamed/type/unknown")
+        self.assertEqual(response.status_code, 404)
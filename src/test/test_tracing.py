@@ -0,0 +1,175 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+import logging
+import datetime
+import common.database
+import common.tracing as tracing
+from common.metrics import Registry
+import app
+import unittest
+import os
+import json
+
+logger = logging.getLogger()
+
+TEST_DATABASE_PATH = "test/data/test_tracing.sqlite"
+
+DELETE_DB = True
+
+
+def parse_server_timing(header):
+    timings = {}
+    for timing in header.split(", "):
+        name, duration = timing.split(";dur=")
+        timings[name] = float(duration)
+    return timings
+
+
+class TestSpans(unittest.TestCase):
+
+    def setUp(self):
+        tracing.enabled = True
+
+    def tearDown(self):
+        tracing.enabled = False
+
+    def test_disabled(self):
+        tracing.enabled = False
+
+        with tracing.trace("disabled") as trace:
+            self.assertIsNone(trace)
+            self.assertIs(tracing.span("phase"), tracing.span("other"))
+            tracing.annotate(rows=1)
+
+    def test_nested(self):
+        with tracing.trace("nested") as trace:
+            with tracing.span("save"):
+                for _ in range(3):
+                    with tracing.span("insert"):
+                        pass
+            with tracing.span("commit"):
+                pass
+            tracing.annotate(rows=3)
+
+        self.assertIsNone(tracing.current())
+        self.assertEqual(list(trace.durations), ["save.insert", "save", "commit"])
+        self.assertGreaterEqual(trace.duration,
+                                trace.durations["save"] + trace.durations["commit"])
+
+        self.assertEqual(list(parse_server_timing(trace.server_timing())),
+                         ["save.insert", "save", "commit", "total"])
+
+        line = json.loads(trace.log_line())
+        self.assertEqual(line["event"], "nested")
+        self.assertEqual(line["rows"], 3)
+        self.assertEqual(set(line["phases_ms"]), {"save", "save.insert", "commit"})
+
+    def test_histogram_without_trace(self):
+        tracing.enabled = False
+        histogram = Registry().histogram("phase_seconds", "Phases.", ["phase"])
+
+        with tracing.span("parse", histogram):
+            pass
+
+        self.assertEqual(histogram.samples()[-2][2], 1)
+
+
+class TestIngestTracing(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config["DATABASE"] = TEST_DATABASE_PATH
+        common.database.Database.initialise(TEST_DATABASE_PATH)
+        self.client = app.app.test_client()
+        self.history_size = app.app.config["TEST_HISTORY_SIZE"]
+
+    def tearDown(self):
+        tracing.enabled = app.app.config["TRACE_INGEST"]
+        app.app.config["TEST_HISTORY_SIZE"] = self.history_size
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.shutdown()
+
+        if DELETE_DB is False:
+            return
+
+        if os.path.isfile(TEST_DATABASE_PATH):
+            logger.debug("Deleting existing test database")
+            os.remove(TEST_DATABASE_PATH)
+
+    def add_results(self, day):
+        results = [{"test_name": "test {}".format(test),
+                    "series_name": "traced",
+                    "batch_timestamp": str(datetime.datetime(2018, 1, day)),
+                    "test_result": "PASS"} for test in range(10)]
+
+        return self.client.post("/add_result",
+                                data=json.dumps(results),
+                                content_type="application/json")
+
+    def test_disabled(self):
+        tracing.enabled = False
+
+        response = self.add_results(1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_server_timing(self):
+        tracing.enabled = True
+        app.app.config["TEST_HISTORY_SIZE"] = 1
+
+        self.add_results(1)
+
+        with self.assertLogs(logger, level="INFO") as logs:
+            response = self.add_results(2)
+
+        self.assertEqual(response.status_code, 200)
+
+        timings = parse_server_timing(response.headers["Server-Timing"])
+        for phase in ["parse", "save", "save.resolve", "save.insert", "version",
+                      "commit", "retention", "retention.history",
+                      "retention.delete", "total"]:
+            self.assertIn(phase, timings)
+
+        lines = [json.loads(record.getMessage()) for record in logs.records
+                 if record.getMessage().startswith("{")]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["event"], "add_batch")
+        self.assertEqual(lines[0]["rows"], 10)
+        self.assertEqual(lines[0]["series"], 1)
+        self.assertEqual(set(lines[0]["phases_ms"]) | {"total"}, set(timings))
+
+
+if __name__ == '__main__':
+    unittest.main()
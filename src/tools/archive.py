@@ -0,0 +1,95 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Moves results older than a given age out of the database into an archive.
+
+    cd src
+    python3 -m tools.archive data/flask_db.sqlite data/archive --days 180
+
+Run it regularly, e.g. from cron, with the same directory as ARCHIVE_DIRECTORY
+so the app still shows the archived results in the history of each test. The
+app can keep running, as results are moved a few hundred at a time.
+"""
+import sys
+import time
+import argparse
+import logging
+
+logger = logging.getLogger()
+
+
+def run(database_file, directory, days, series_names=None, now=None):
+    """
+    Moves every result of a batch more than days old into the archive in
+    directory. Returns the number of results moved from each series.
+    """
+    from common.database import Database
+    from models.archive import Archive
+    from models.retention import RetentionPolicy, enforce
+
+    Database.initialise(database_file)
+
+    try:
+        if series_names is None:
+            series_names = [row[0] for row in
+                            Database.query_rows("SELECT series_name FROM Series ORDER BY series_name")]
+
+        archive = Archive(directory)
+        policy = RetentionPolicy(days=days)
+
+        return {series_name: enforce(series_name, policy, archive, now=now)
+                for series_name in series_names}
+    finally:
+        Database.shutdown()
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Archive old trapp results")
+    parser.add_argument("database", help="database to move results from")
+    parser.add_argument("directory", help="archive to move them to")
+    parser.add_argument("--days", type=float, required=True,
+                        help="move results of batches older than this")
+    parser.add_argument("--series", action="append", dest="series_names",
+                        help="only this series, may be given more than once")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    started = time.monotonic()
+    moved = run(args.database, args.directory, args.days, args.series_names)
+
+    for series_name, count in sorted(moved.items()):
+        print("{:<40} {:>10}".format(series_name, count))
+
+    print("Moved {} results in {:.1f}s".format(sum(moved.values()),
+                                               time.monotonic() - started))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
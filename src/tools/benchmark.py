@@ -0,0 +1,408 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Times ingestion, retention, summaries and every route against generated data.
+
+    cd src
+    python3 -m tools.benchmark --shape small --output results.json
+    python3 -m tools.benchmark --shape small --baseline results.json
+
+With --baseline the run fails if any timing is more than --tolerance slower
+than in the baseline. --memory also measures the memory taken to build the
+models and answer each route, in a separate run as tracing allocations slows
+everything down.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import datetime
+from urllib.parse import quote
+from tools.dataset import DatasetShape, REALISTIC, generate_batches, series_name, test_name
+
+logger = logging.getLogger()
+
+SHAPES = {
+    "small": DatasetShape(series=2, batches_per_series=20, tests_per_batch=50),
+    "wide": DatasetShape(series=2, batches_per_series=10, tests_per_batch=2000),
+    "deep": DatasetShape(series=2, batches_per_series=200, tests_per_batch=20),
+    "flaky": DatasetShape(series=2, batches_per_series=50, tests_per_batch=200,
+                          flake_rate=0.5, fail_rate=0.2,
+                          metadata_cardinality=1000),
+    "realistic": REALISTIC,
+}
+
+# Pages and API routes timed for every series. Stale is empty unless
+# DAYS_UNTIL_TEST_RESULT_STALE is set, which times the query for it anyway.
+ROUTES = {
+    "index": "/",
+    "series": "/results/series/{series}",
+    "newly_failing": "/results/series/{series}/type/newly_failing",
+    "passing": "/results/series/{series}/type/passing",
+    "always_failing": "/results/series/{series}/type/always_failing",
+    "stale": "/results/series/{series}/type/stale",
+    "test": "/results/series/{series}/test/{test}",
+    "api_series": "/api/series/{series}",
+    "api_test": "/api/series/{series}/test/{test}",
+    "api_summary": "/api/summary",
+}
+
+# Histories loaded, and cleaned up, in each series
+SAMPLED_TESTS = 50
+
+# Measurements which are not timings
+UNITS = {
+    "db_size": "bytes",
+}
+
+# Memory measured by run_memory(), e.g. memory_series_summary_peak
+MEMORY_PREFIX = "memory_"
+
+
+def _unit(name):
+    if name.startswith(MEMORY_PREFIX):
+        return "bytes"
+    return UNITS.get(name, "seconds")
+
+
+class Timer(object):
+
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.started
+        self.results[self.name] = self.results.get(self.name, 0) + elapsed
+
+
+def _sampled_tests(shape):
+    return [test_name(test)
+            for test in range(min(shape.tests_per_batch, SAMPLED_TESTS))]
+
+
+def run_once(shape, directory):
+    """The time taken by each benchmark, and the number of results added."""
+    # Imported here so the app uses the benchmark's database
+    import app
+    from common.database import Database
+    from models.batch import add_batch
+    from models.series_summary import SeriesSummary
+    from models.test_history import TestHistory
+
+    database_file = os.path.join(directory, "benchmark.sqlite")
+
+    app.app.config["DATABASE"] = database_file
+    app.startup()
+    Database.initialise(database_file)
+
+    client = app.app.test_client()
+
+    results = {}
+    batches = list(generate_batches(shape))
+    rows = sum(len(batch) for batch in batches)
+
+    for batch in batches:
+        with Timer(results, "ingest"):
+            add_batch(batch, 0)
+
+    results["db_size"] = os.path.getsize(database_file)
+
+    series_names = [series_name(series) for series in range(shape.series)]
+    test_names = _sampled_tests(shape)
+    days = app.app.config["DAYS_UNTIL_TEST_RESULT_STALE"]
+
+    for name in series_names:
+        with Timer(results, "series_summary"):
+            SeriesSummary(name, days)
+
+        with Timer(results, "series_counts"):
+            SeriesSummary.count_tests(name, days)
+
+        for test in test_names:
+            with Timer(results, "test_history"):
+                TestHistory(name, test, days)
+
+    for route, pattern in ROUTES.items():
+        for name in series_names:
+            url = pattern.format(series=quote(name),
+                                 test=quote(test_names[0]))
+
+            with Timer(results, "route_" + route):
+                response = client.get(url)
+                response.get_data()
+
+            if response.status_code != 200:
+                raise Exception("{} returned {}".format(url, response.status_code))
+
+    keep_count = max(shape.batches_per_series // 2, 1)
+
+    for name in series_names:
+        for test in test_names:
+            with Timer(results, "retention"):
+                TestHistory(name, test).cleanup_db(keep_count)
+
+    return results, rows
+
+
+def _load(shape, directory):
+    import app
+    from common.database import Database
+    from models.batch import add_batch
+
+    database_file = os.path.join(directory, "benchmark.sqlite")
+
+    app.app.config["DATABASE"] = database_file
+    app.startup()
+    Database.initialise(database_file)
+
+    for batch in generate_batches(shape):
+        add_batch(batch, 0)
+
+
+def _record_memory(results, name, account):
+    """
+    Keeps the largest peak and retained memory of each measurement. Peaks
+    aren't known before Python 3.9, so are left out there.
+    """
+    measurements = {"retained": account.retained}
+    if account.peak is not None:
+        measurements["peak"] = account.peak
+    measurements.update((component, size)
+                        for component, (size, count) in account.components.items()
+                        if component != "other")
+
+    for measurement, size in measurements.items():
+        key = "{}{}_{}".format(MEMORY_PREFIX, name, measurement)
+        results[key] = max(size, results.get(key, size))
+
+
+def run_memory(shape, directory):
+    """
+    The most memory taken to build a SeriesSummary, count the tests of a
+    series and load a TestHistory, while the result is still held, and to
+    answer each route. Also split by the part of the app which allocated it.
+    """
+    import app
+    from common.memory import Account
+    from common.metrics import REGISTRY
+    import common.memory as memory
+    from models.series_summary import SeriesSummary
+    from models.test_history import TestHistory
+
+    _load(shape, directory)
+
+    client = app.app.test_client()
+    results = {}
+
+    series_names = [series_name(series) for series in range(shape.series)]
+    test_names = _sampled_tests(shape)
+    days = app.app.config["DAYS_UNTIL_TEST_RESULT_STALE"]
+
+    # Metrics are written out from a timer thread, which would be counted
+    REGISTRY.stop()
+    store = REGISTRY.store
+    REGISTRY.store = None
+
+    memory.start()
+
+    try:
+        for name in series_names:
+            with Account() as account:
+                summary = SeriesSummary(name, days)
+                account.hold()
+            _record_memory(results, "series_summary", account)
+            del summary
+
+            with Account() as account:
+                counts = SeriesSummary.count_tests(name, days)
+                account.hold()
+            _record_memory(results, "series_counts", account)
+            del counts
+
+            with Account() as account:
+                history = TestHistory(name, test_names[0], days)
+                account.hold()
+            _record_memory(results, "test_history", account)
+            del history
+
+        for route, pattern in ROUTES.items():
+            for name in series_names:
+                url = pattern.format(series=quote(name),
+                                     test=quote(test_names[0]))
+
+                with Account() as account:
+                    client.get(url).get_data()
+
+                if account.peak is not None:
+                    key = "{}route_{}_peak".format(MEMORY_PREFIX, route)
+                    results[key] = max(account.peak, results.get(key, 0))
+    finally:
+        memory.stop()
+        REGISTRY.store = store
+
+    return results
+
+
+def run(shape, repeat=3, measure_memory=False):
+    """
+    Runs every benchmark repeat times, each against a new database, and
+    returns the quickest time of each. With measure_memory, run_memory() is
+    run once more.
+    """
+    import app
+    from common.cache import MemoryCache
+
+    best = {}
+
+    # Every request is worked out from the database
+    response_cache = app.response_cache
+    app.response_cache = MemoryCache(0)
+
+    try:
+        for _ in range(repeat):
+            directory = tempfile.mkdtemp(prefix="trapp-benchmark-")
+            try:
+                results, rows = run_once(shape, directory)
+            finally:
+                shutil.rmtree(directory)
+
+            for name, value in results.items():
+                best[name] = min(value, best.get(name, value))
+
+        if measure_memory:
+            directory = tempfile.mkdtemp(prefix="trapp-benchmark-")
+            try:
+                best.update(run_memory(shape, directory))
+            finally:
+                shutil.rmtree(directory)
+    finally:
+        app.response_cache = response_cache
+        app.shutdown()
+
+    return dict(
+        date=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        shape=shape.as_dict(),
+        repeat=repeat,
+        rows=rows,
+        ingest_rows_per_second=rows / best["ingest"] if best["ingest"] else None,
+        results=best,
+        units={name: _unit(name) for name in best})
+
+
+def compare(results, baseline, tolerance=0.25, min_difference=0.005):
+    """
+    Returns (name, baseline, result) for each measurement more than tolerance
+    worse than the baseline. Timings within min_difference seconds of the
+    baseline are never counted, as they are mostly noise.
+    """
+    regressions = []
+
+    if results["shape"] != baseline["shape"]:
+        raise ValueError("Results and baseline are for different dataset shapes")
+
+    for name, previous in sorted(baseline["results"].items()):
+        current = results["results"].get(name)
+
+        if current is None:
+            continue
+
+        if current <= previous * (1 + tolerance):
+            continue
+
+        if _unit(name) == "seconds" and \
+           current - previous < min_difference:
+            continue
+
+        regressions.append((name, previous, current))
+
+    return regressions
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark trapp")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="small")
+    parser.add_argument("--series", type=int)
+    parser.add_argument("--batches", type=int, dest="batches_per_series")
+    parser.add_argument("--tests", type=int, dest="tests_per_batch")
+    parser.add_argument("--flake-rate", type=float)
+    parser.add_argument("--fail-rate", type=float)
+    parser.add_argument("--metadata", type=int, dest="metadata_cardinality")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true",
+                        help="also measure the memory taken by the models and routes")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fraction slower than the baseline allowed")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    shape = DatasetShape(**SHAPES[args.shape].as_dict())
+    for option in shape.as_dict():
+        if getattr(args, option, None) is not None:
+            setattr(shape, option, getattr(args, option))
+
+    results = run(shape, args.repeat, args.memory)
+
+    for name, value in sorted(results["results"].items()):
+        print("{:<24} {:>12.4f} {}".format(name, value, results["units"][name]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        for name, previous, current in regressions:
+            print("REGRESSION {}: {:.4f} -> {:.4f}".format(name, previous, current))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
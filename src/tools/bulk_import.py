@@ -0,0 +1,389 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Adds archived results straight to a database, without going through the app.
+
+    cd src
+    python3 -m tools.bulk_import archive/ data/flask_db.sqlite --relaxed-durability
+    python3 -m tools.bulk_import junit/ data/flask_db.sqlite --series nightly
+
+Every .json (a list of results, as posted to /add_result), .ndjson or .jsonl
+(a result per line) and .xml (JUnit) file under the directory is read and
+checked by a pool of processes. The results are added by this process alone,
+a file at a time, committing every --transaction-rows results. The files
+added are then recorded in a checkpoint, so an import which is stopped carries
+on where it left off when run again. A file which can't be read is reported
+and skipped, and no results from it are added.
+
+Results already in the database are skipped, so importing a file twice is
+harmless. Old results are not removed, whatever TEST_HISTORY_SIZE is. The
+ids of series, batches, revisions and metadata are remembered between files,
+so don't remove results from the database while an import runs.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import collections
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+logger = logging.getLogger()
+
+# File extensions read, and their format
+FORMATS = {
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".xml": "junit",
+}
+
+CHECKPOINT_SUFFIX = ".import-checkpoint.json"
+
+
+def find_files(directory):
+    """Every file under directory in one of FORMATS, in name order."""
+    paths = []
+
+    for parent, directories, file_names in os.walk(directory):
+        directories.sort()
+        for file_name in sorted(file_names):
+            if os.path.splitext(file_name)[1].lower() in FORMATS:
+                paths.append(os.path.join(parent, file_name))
+
+    return paths
+
+
+def parse_json(path, series_name=None):
+    with open(path) as input_file:
+        data = json.load(input_file)
+    return [data] if isinstance(data, dict) else data
+
+
+def parse_ndjson(path, series_name=None):
+    with open(path) as input_file:
+        return [json.loads(line) for line in input_file if line.strip()]
+
+
+def _junit_duration(duration):
+    if duration is None:
+        return None
+    return int(round(float(duration)))
+
+
+def parse_junit(path, series_name=None):
+    """
+    Results from a JUnit XML report. Each testsuite is a batch, at its
+    timestamp, in the series named by a series_name property or series_name.
+    vcs_system, vcs_revision and metadata properties are also used.
+    """
+    results = []
+
+    for suite in ElementTree.parse(path).getroot().iter("testsuite"):
+        properties = {prop.get("name"): prop.get("value")
+                      for prop in suite.findall("properties/property")}
+
+        timestamp = suite.get("timestamp")
+        if not timestamp:
+            raise ValueError("testsuite {} has no timestamp".format(suite.get("name")))
+
+        series = properties.get("series_name", series_name)
+        if not series:
+            raise ValueError("no series_name property, or --series")
+
+        for case in suite.findall("testcase"):
+            name = case.get("name")
+            if case.get("classname"):
+                name = case.get("classname") + "." + name
+
+            if case.find("failure") is not None or case.find("error") is not None:
+                result = "FAIL"
+            elif case.find("skipped") is not None:
+                result = "SKIP"
+            else:
+                result = "PASS"
+
+            results.append(dict(test_name=name,
+                                series_name=series,
+                                batch_timestamp=timestamp[:19],
+                                test_result=result,
+                                vcs_system=properties.get("vcs_system"),
+                                vcs_revision=properties.get("vcs_revision"),
+                                metadata=properties.get("metadata"),
+                                test_duration=_junit_duration(case.get("time"))))
+
+    return results
+
+
+PARSERS = {
+    "json": parse_json,
+    "ndjson": parse_ndjson,
+    "junit": parse_junit,
+}
+
+
+def parse_file(path, series_name=None):
+    """
+    Reads and checks the results in a file. Returns (path, results, problem),
+    where problem says why the file can't be added, or is None.
+    """
+    import models.error
+    from models.test_result import TestResult
+
+    file_format = FORMATS[os.path.splitext(path)[1].lower()]
+
+    try:
+        results = PARSERS[file_format](path, series_name)
+
+        if not isinstance(results, list):
+            raise ValueError("not a list of results")
+
+        # Timestamps are parsed here, rather than by the one writer
+        for index, entry in enumerate(results):
+            try:
+                results[index] = TestResult.validate(entry)
+            except models.error.UserError as err:
+                raise ValueError("result {}: {}".format(index, err.message))
+
+    except (OSError, ValueError, ElementTree.ParseError) as err:
+        return path, None, str(err)
+
+    return path, results, None
+
+
+def parse_files(paths, series_name=None, workers=1):
+    """
+    Yields parse_file() for each path, in order. With more than one worker
+    files are parsed by a pool of processes, a few ahead of those yielded.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield parse_file(path, series_name)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = collections.deque()
+
+        for path in paths:
+            futures.append(executor.submit(parse_file, path, series_name))
+            if len(futures) >= workers * 2:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
+
+
+class Checkpoint(object):
+    """The files, relative to the directory imported, already added."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.done = set(json.load(checkpoint_file)["done"])
+
+    def add(self, files):
+        self.done.update(files)
+
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as checkpoint_file:
+            json.dump(dict(done=sorted(self.done)), checkpoint_file, indent=1)
+        os.replace(temporary, self.path)
+
+
+@contextmanager
+def relaxed_durability():
+    """
+    Commits without waiting for the disk, keeping the rollback journal in
+    memory. A crash, or power cut, during the import can corrupt the database.
+    """
+    from common.database import Database
+
+    synchronous = Database.query_one("PRAGMA synchronous")
+    journal_mode = Database.query_one("PRAGMA journal_mode")
+
+    Database.query_one("PRAGMA synchronous = OFF")
+    Database.query_one("PRAGMA journal_mode = MEMORY")
+
+    try:
+        yield
+    finally:
+        Database.query_one("PRAGMA journal_mode = {}".format(journal_mode))
+        Database.query_one("PRAGMA synchronous = {}".format(synchronous))
+
+
+def run(directory,
+        database_file,
+        series_name=None,
+        workers=None,
+        transaction_rows=50000,
+        relaxed=False,
+        checkpoint_file=None,
+        progress=None,
+        progress_interval=5):
+    """
+    Imports every file under directory, skipping any in the checkpoint, and
+    returns a summary. progress is called with it every progress_interval
+    seconds.
+    """
+    from common.database import Database
+    from models.batch import save_results, IdCache
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if checkpoint_file is None:
+        checkpoint_file = database_file + CHECKPOINT_SUFFIX
+
+    Database.initialise(database_file)
+    checkpoint = Checkpoint(checkpoint_file)
+
+    paths = find_files(directory)
+    pending = [path for path in paths
+               if os.path.relpath(path, directory) not in checkpoint.done]
+
+    summary = dict(files=len(paths),
+                   skipped=len(paths) - len(pending),
+                   added=0,
+                   rows=0,
+                   errors=[],
+                   seconds=0,
+                   rows_per_second=0)
+
+    started = time.monotonic()
+    reported = started
+    uncommitted = []
+    uncommitted_rows = 0
+    id_cache = IdCache()
+
+    def update():
+        summary["seconds"] = time.monotonic() - started
+        if summary["seconds"]:
+            summary["rows_per_second"] = summary["rows"] / summary["seconds"]
+
+    def commit():
+        Database.end_batch()
+        checkpoint.add(uncommitted)
+        del uncommitted[:]
+
+    try:
+        with relaxed_durability() if relaxed else _nothing():
+            Database.start_batch()
+
+            for path, results, problem in parse_files(pending, series_name, workers):
+                name = os.path.relpath(path, directory)
+
+                if problem is not None:
+                    logger.error("Skipped {}: {}".format(name, problem))
+                    summary["errors"].append(dict(file=name, problem=problem))
+                    continue
+
+                save_results(results, id_cache)
+                uncommitted.append(name)
+                summary["added"] += 1
+                uncommitted_rows += len(results)
+                summary["rows"] += len(results)
+
+                if uncommitted_rows >= transaction_rows:
+                    commit()
+                    uncommitted_rows = 0
+                    Database.start_batch()
+
+                if progress is not None and \
+                   time.monotonic() - reported >= progress_interval:
+                    reported = time.monotonic()
+                    update()
+                    progress(summary)
+
+            commit()
+
+    finally:
+        # Anything not committed is rolled back when the connection closes
+        Database.shutdown()
+
+    update()
+    return summary
+
+
+@contextmanager
+def _nothing():
+    yield
+
+
+def _print_progress(summary):
+    done = summary["skipped"] + summary["added"] + len(summary["errors"])
+    print("{}/{} files, {} results, {:.0f} results/s".format(
+              done, summary["files"], summary["rows"], summary["rows_per_second"]),
+          file=sys.stderr)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Add archived results to a database")
+    parser.add_argument("directory")
+    parser.add_argument("database")
+    parser.add_argument("--series", help="series of JUnit results without a series_name property")
+    parser.add_argument("--workers", type=int, help="processes parsing files, default one per CPU")
+    parser.add_argument("--transaction-rows", type=int, default=50000,
+                        help="results added between each commit")
+    parser.add_argument("--relaxed-durability", action="store_true",
+                        help="don't wait for the disk when committing (back up the database first)")
+    parser.add_argument("--checkpoint",
+                        help="file recording the files added, default DATABASE" + CHECKPOINT_SUFFIX)
+    parser.add_argument("--progress-interval", type=float, default=5)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    summary = run(args.directory,
+                  args.database,
+                  series_name=args.series,
+                  workers=args.workers,
+                  transaction_rows=args.transaction_rows,
+                  relaxed=args.relaxed_durability,
+                  checkpoint_file=args.checkpoint,
+                  progress=_print_progress,
+                  progress_interval=args.progress_interval)
+
+    for problem in summary["errors"]:
+        print("Skipped {file}: {problem}".format(**problem), file=sys.stderr)
+
+    print("Added {} results from {} files in {:.1f}s, {:.0f} results/s. "
+          "{} files were already added, {} could not be read.".format(
+              summary["rows"], summary["added"], summary["seconds"],
+              summary["rows_per_second"], summary["skipped"], len(summary["errors"])))
+
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
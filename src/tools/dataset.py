@@ -0,0 +1,312 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Generates realistic, but made up, test results.
+
+    cd src
+    python3 -m tools.dataset --series 10 --format ndjson --output results.ndjson
+    python3 -m tools.dataset --series 10 --load data/flask_db.sqlite
+
+The same options, including --seed, always give the same results.
+"""
+import sys
+import json
+import math
+import random
+import argparse
+import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Largest series, relative to tests_per_batch, with a power law test count
+MAX_TEST_COUNT_FACTOR = 50
+
+
+class DatasetShape(object):
+    """
+    Describes a set of results.
+
+    series, batches_per_series: how many series, and batches in each.
+    tests_per_batch: tests in each series. With test_count_alpha the number of
+        tests in a series follows a power law with this as the minimum, so a
+        few series are much larger than the rest.
+    growth: fraction of tests added part way through a series.
+    flake_rate: fraction of tests whose result varies from batch to batch.
+    fail_rate: fraction of tests which start failing part way through, of
+        which fix_rate are later fixed.
+    skip_rate: fraction of tests which are skipped, always or sometimes.
+    batches_per_revision: batches run against each VCS revision.
+    metadata_cardinality: distinct metadata strings. A few are used often.
+    mean_duration, duration_sigma: log-normal distribution of the typical
+        duration of each test in seconds.
+    batch_interval: hours between batches.
+    """
+
+    def __init__(self,
+                 series=1,
+                 batches_per_series=10,
+                 tests_per_batch=100,
+                 test_count_alpha=None,
+                 growth=0.0,
+                 flake_rate=0.05,
+                 fail_rate=0.02,
+                 fix_rate=0.0,
+                 skip_rate=0.0,
+                 batches_per_revision=1,
+                 metadata_cardinality=10,
+                 mean_duration=5.0,
+                 duration_sigma=1.0,
+                 batch_interval=1.0,
+                 seed=0):
+
+        self.series = series
+        self.batches_per_series = batches_per_series
+        self.tests_per_batch = tests_per_batch
+        self.test_count_alpha = test_count_alpha
+        self.growth = growth
+        self.flake_rate = flake_rate
+        self.fail_rate = fail_rate
+        self.fix_rate = fix_rate
+        self.skip_rate = skip_rate
+        self.batches_per_revision = batches_per_revision
+        self.metadata_cardinality = metadata_cardinality
+        self.mean_duration = mean_duration
+        self.duration_sigma = duration_sigma
+        self.batch_interval = batch_interval
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    @property
+    def rows(self):
+        """The number of results, if tests_per_batch is the same for all."""
+        return self.series * self.batches_per_series * self.tests_per_batch
+
+
+# The shape of real test suites: some series much larger than others, growing
+# over time, with flaky, broken and skipped tests.
+REALISTIC = DatasetShape(series=20,
+                         batches_per_series=30,
+                         tests_per_batch=20,
+                         test_count_alpha=1.2,
+                         growth=0.2,
+                         flake_rate=0.05,
+                         fail_rate=0.05,
+                         fix_rate=0.5,
+                         skip_rate=0.03,
+                         batches_per_revision=2,
+                         metadata_cardinality=50)
+
+
+def series_name(index):
+    return "series {}".format(index)
+
+
+def test_name(index):
+    return "test {}".format(index)
+
+
+class _TestModel(object):
+    """How a single test behaves over the batches of a series."""
+
+    def __init__(self, shape, rng):
+        batches = shape.batches_per_series
+
+        self.introduced = rng.randrange(batches) if rng.random() < shape.growth else 0
+        self.flakiness = rng.uniform(0.05, 0.5) if rng.random() < shape.flake_rate else 0
+        self.breaks_at = batches
+        self.fixed_at = batches
+        self.skipped = 0
+
+        if rng.random() < shape.fail_rate:
+            self.breaks_at = rng.randrange(batches)
+            if rng.random() < shape.fix_rate:
+                self.fixed_at = rng.randint(self.breaks_at + 1, batches)
+
+        if rng.random() < shape.skip_rate:
+            self.skipped = 1 if rng.random() < 0.5 else rng.uniform(0.1, 0.5)
+
+        self.duration = rng.lognormvariate(math.log(shape.mean_duration),
+                                           shape.duration_sigma)
+
+    def result(self, batch, rng):
+        if self.skipped and rng.random() < self.skipped:
+            return "SKIP"
+        if self.breaks_at <= batch < self.fixed_at:
+            return "FAIL"
+        if self.flakiness and rng.random() < self.flakiness:
+            return "FAIL"
+        return "PASS"
+
+
+def _test_count(shape, rng):
+    if not shape.test_count_alpha:
+        return shape.tests_per_batch
+
+    count = int(shape.tests_per_batch * rng.paretovariate(shape.test_count_alpha))
+    return min(count, shape.tests_per_batch * MAX_TEST_COUNT_FACTOR)
+
+
+def _metadata(shape, rng):
+    if not shape.metadata_cardinality:
+        return None
+
+    # Zipf like: the first few are used far more than the rest
+    index = int(rng.paretovariate(1.0)) - 1
+    return "metadata {}".format(index % shape.metadata_cardinality)
+
+
+def generate_batches(shape, start=datetime.datetime(2018, 1, 1)):
+    """
+    Yields the results of each batch of shape as a list of dicts, in the
+    format accepted by add_batch. The same shape always gives the same data.
+    """
+    rng = random.Random(shape.seed)
+
+    for series in range(shape.series):
+        tests = [_TestModel(shape, rng) for _ in range(_test_count(shape, rng))]
+        vcs_revision = None
+
+        for batch in range(shape.batches_per_series):
+            batch_timestamp = start + datetime.timedelta(
+                                        hours=batch * shape.batch_interval,
+                                        minutes=series)
+            test_timestamp = batch_timestamp
+
+            if batch % max(shape.batches_per_revision, 1) == 0:
+                vcs_revision = "{:040x}".format(rng.getrandbits(160))
+
+            results = []
+            for index, test in enumerate(tests):
+
+                if batch < test.introduced:
+                    continue
+
+                test_result = test.result(batch, rng)
+                test_duration = 0
+                if test_result != "SKIP":
+                    test_duration = int(round(test.duration * rng.lognormvariate(0, 0.2)))
+
+                results.append({
+                    "test_name": test_name(index),
+                    "series_name": series_name(series),
+                    "batch_timestamp": batch_timestamp.strftime(TIMESTAMP_FORMAT),
+                    "test_result": test_result,
+                    "vcs_system": "git",
+                    "vcs_revision": vcs_revision,
+                    "metadata": _metadata(shape, rng),
+                    "test_timestamp": test_timestamp.strftime(TIMESTAMP_FORMAT),
+                    "test_duration": test_duration,
+                })
+
+                test_timestamp += datetime.timedelta(seconds=test_duration)
+
+            yield results
+
+
+def write_json(batches, output):
+    """Writes every result as a single payload for /add_result."""
+    output.write("[\n")
+
+    first = True
+    for batch in batches:
+        for result in batch:
+            if not first:
+                output.write(",\n")
+            first = False
+            output.write(json.dumps(result))
+
+    output.write("\n]\n")
+
+
+def write_ndjson(batches, output):
+    """Writes one result per line."""
+    for batch in batches:
+        for result in batch:
+            output.write(json.dumps(result))
+            output.write("\n")
+
+
+def load(batches, database_file, limit_test_results=0):
+    """Adds the results straight to the database, one batch at a time."""
+    from common.database import Database
+    from models.batch import add_batch
+
+    Database.initialise(database_file)
+
+    rows = 0
+    for batch in batches:
+        add_batch(batch, limit_test_results)
+        rows += len(batch)
+
+    return rows
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate test results")
+
+    defaults = REALISTIC.as_dict()
+    for option, default in sorted(defaults.items()):
+        parser.add_argument("--" + option.replace("_", "-"),
+                            type=int if isinstance(default, int) else float,
+                            default=default)
+
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json")
+    parser.add_argument("--output", help="file to write to, instead of stdout")
+    parser.add_argument("--load", metavar="DATABASE",
+                        help="add the results to this database instead")
+    parser.add_argument("--limit", type=int, default=0,
+                        help="results kept for each test when loading")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    shape = DatasetShape(**{option: getattr(args, option)
+                            for option in REALISTIC.as_dict()})
+    batches = generate_batches(shape)
+
+    if args.load:
+        rows = load(batches, args.load, args.limit)
+        print("Added {} results to {}".format(rows, args.load))
+        return 0
+
+    write = write_json if args.format == "json" else write_ndjson
+
+    if args.output:
+        with open(args.output, "w") as output:
+            write(batches, output)
+    else:
+        write(batches, sys.stdout)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Runs many clients against the app, served by gunicorn on this machine, and
+reports the throughput and latency of each route.
+
+    cd src
+    python3 -m tools.loadtest --clients 20 --duration 30 --workers 4
+
+The app is given its own database, seeded with generated results, and
+nothing is sent beyond localhost. --url tests an app which is already running
+instead.
+"""
+import os
+import sys
+import json
+import time
+import math
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import datetime
+import http.client
+import urllib.parse
+from tools.dataset import DatasetShape, generate_batches, series_name, test_name
+import tools.dataset as dataset
+
+SRC_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative weights of the requests made by each client
+DEFAULT_MIX = "add_result=1,index=2,series=4,type=4,test=4,api_series=2,api_summary=1"
+
+# Requests which are not for a particular series
+ROUTES = {
+    "index": "/",
+    "series": "/results/series/{series}",
+    "type": "/results/series/{series}/type/{type}",
+    "test": "/results/series/{series}/test/{test}",
+    "api_series": "/api/series/{series}",
+    "api_test": "/api/series/{series}/test/{test}",
+    "api_summary": "/api/summary",
+}
+
+RESULT_TYPES = ["newly_failing", "passing", "always_failing", "stale"]
+
+# Logged by the app when SQLite gave up waiting for another writer
+BUSY_ERRORS = ["database is locked", "database is busy"]
+
+
+def parse_mix(mix):
+    """Parses "route=weight,..." into a dict."""
+    weights = {}
+
+    for item in mix.split(","):
+        route, weight = item.split("=")
+        route = route.strip()
+
+        if route != "add_result" and route not in ROUTES:
+            raise ValueError("Unknown route: {}".format(route))
+
+        weights[route] = float(weight)
+
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """The nearest rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+
+    rank = int(math.ceil(fraction * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Server(object):
+    """gunicorn serving the app from a directory of its own."""
+
+    def __init__(self, directory, workers, worker_class="sync", threads=1):
+        self.directory = directory
+        self.port = _free_port()
+        self.url = "http://127.0.0.1:{}".format(self.port)
+        self.database_file = os.path.join(directory, "loadtest.sqlite")
+        self.log_file = os.path.join(directory, "app.log")
+        self.output_file = os.path.join(directory, "gunicorn.log")
+
+        settings_file = os.path.join(directory, "settings.py")
+        with open(settings_file, "w") as settings:
+            settings.write("DATABASE = {!r}\n".format(self.database_file))
+            settings.write("LOG_FILE = {!r}\n".format(self.log_file))
+            settings.write("SHARED_CACHE_FILE = {!r}\n".format(
+                            os.path.join(directory, "cache.sqlite")))
+            settings.write("ADMISSION_DIRECTORY = {!r}\n".format(
+                            os.path.join(directory, "admission")))
+            settings.write("METRICS_FILE = {!r}\n".format(
+                            os.path.join(directory, "metrics.sqlite")))
+            settings.write("PROFILE_DIRECTORY = {!r}\n".format(
+                            os.path.join(directory, "profiles")))
+
+        gunicorn = shutil.which("gunicorn",
+                                path=os.path.dirname(sys.executable) + os.pathsep + os.environ.get("PATH", ""))
+        if gunicorn is None:
+            raise Exception("gunicorn is needed to run the load test")
+
+        self.command = [gunicorn,
+                        "--config", os.path.join(SRC_DIRECTORY, "gunicorn_config.py"),
+                        "--bind", "127.0.0.1:{}".format(self.port),
+                        "--workers", str(workers),
+                        "--worker-class", worker_class,
+                        "--threads", str(threads),
+                        "app:app"]
+
+        self.env = dict(os.environ, TRAPP_SETTINGS=settings_file)
+        self.process = None
+
+    def start(self, timeout=30):
+        with open(self.output_file, "w") as output:
+            self.process = subprocess.Popen(self.command,
+                                            cwd=SRC_DIRECTORY,
+                                            env=self.env,
+                                            stdout=output,
+                                            stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise Exception("gunicorn exited, see {}".format(self.output_file))
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), 1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+
+        raise Exception("gunicorn did not start within {}s".format(timeout))
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(30)
+
+    def count_busy_errors(self):
+        count = 0
+
+        for path in [self.log_file, self.output_file]:
+            if not os.path.exists(path):
+                continue
+            with open(path, errors="replace") as log:
+                for line in log:
+                    if any(error in line for error in BUSY_ERRORS):
+                        count += 1
+
+        return count
+
+
+class Client(threading.Thread):
+    """Makes weighted random requests until the deadline."""
+
+    def __init__(self, index, url, weights, series_names, test_names, next_batch, deadline):
+        super().__init__(name="client {}".format(index))
+        self.rng = random.Random(index)
+        self.host = urllib.parse.urlsplit(url).hostname
+        self.port = urllib.parse.urlsplit(url).port
+        self.routes = list(weights)
+        self.weights = [weights[route] for route in self.routes]
+        self.series_names = series_names
+        self.test_names = test_names
+        self.next_batch = next_batch
+        self.deadline = deadline
+        self.samples = []
+
+    def _request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+
+        headers = {"Accept-Encoding": "gzip"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+
+        try:
+            connection.request(method, urllib.parse.quote(path), body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            return 0
+        finally:
+            connection.close()
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            route = self.rng.choices(self.routes, self.weights)[0]
+            series = self.rng.choice(self.series_names)
+
+            if route == "add_result":
+                method = "POST"
+                path = "/add_result"
+                body = json.dumps(self.next_batch(series))
+            else:
+                method = "GET"
+                path = ROUTES[route].format(series=series,
+                                            type=self.rng.choice(RESULT_TYPES),
+                                            test=self.rng.choice(self.test_names))
+                body = None
+
+            started = time.perf_counter()
+            status = self._request(method, path, body)
+            self.samples.append((route, time.perf_counter() - started, status))
+
+
+class BatchSource(object):
+    """
+    New batches for clients to post. Each has a later timestamp than any
+    before so they never collide with each other or the seeded results.
+    """
+
+    def __init__(self, tests, start):
+        self.tests = tests
+        self.next_timestamp = start
+        self.lock = threading.Lock()
+
+    def __call__(self, series):
+        with self.lock:
+            timestamp = self.next_timestamp
+            self.next_timestamp += datetime.timedelta(seconds=1)
+
+        return [{
+            "test_name": test_name(test),
+            "series_name": series,
+            "batch_timestamp": timestamp.strftime(dataset.TIMESTAMP_FORMAT),
+            "test_result": "PASS" if test % 10 else "FAIL",
+        } for test in range(self.tests)]
+
+
+def summarise(samples, elapsed, busy_errors=None):
+    routes = {}
+
+    for route in sorted(set(sample[0] for sample in samples)):
+        latencies = sorted(sample[1] for sample in samples if sample[0] == route)
+        statuses = {}
+        for sample in samples:
+            if sample[0] == route:
+                statuses[str(sample[2])] = statuses.get(str(sample[2]), 0) + 1
+
+        routes[route] = dict(
+            requests=len(latencies),
+            per_second=len(latencies) / elapsed,
+            statuses=statuses,
+            errors=sum(count for status, count in statuses.items()
+                       if not status.startswith(("2", "3"))),
+            mean=sum(latencies) / len(latencies),
+            p50=percentile(latencies, 0.50),
+            p95=percentile(latencies, 0.95),
+            p99=percentile(latencies, 0.99),
+            max=latencies[-1])
+
+    return dict(elapsed=elapsed,
+                requests=len(samples),
+                per_second=len(samples) / elapsed if elapsed else 0,
+                busy_errors=busy_errors,
+                routes=routes)
+
+
+def run(url, weights, shape, clients, duration):
+    series_names = [series_name(series) for series in range(shape.series)]
+    test_names = [test_name(test) for test in range(shape.tests_per_batch)]
+
+    start = datetime.datetime(2018, 1, 1) + \
+        datetime.timedelta(hours=shape.batches_per_series * shape.batch_interval + 1)
+    next_batch = BatchSource(shape.tests_per_batch, start)
+
+    deadline = time.monotonic() + duration
+    threads = [Client(index, url, weights, series_names, test_names, next_batch, deadline)
+               for index in range(clients)]
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return summarise([sample for thread in threads for sample in thread.samples], elapsed)
+
+
+def print_summary(summary, output=sys.stdout):
+    output.write("{:<14} {:>8} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}\n".format(
+                    "route", "requests", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+
+    for route, stats in sorted(summary["routes"].items()):
+        output.write("{:<14} {:>8} {:>8.1f} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}\n".format(
+                        route, stats["requests"], stats["per_second"], stats["errors"],
+                        stats["p50"] * 1000, stats["p95"] * 1000,
+                        stats["p99"] * 1000, stats["max"] * 1000))
+
+    output.write("{} requests in {:.1f}s, {:.1f} requests/s\n".format(
+                    summary["requests"], summary["elapsed"], summary["per_second"]))
+
+    if summary["busy_errors"] is not None:
+        output.write("SQLite busy errors: {}\n".format(summary["busy_errors"]))
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load test trapp")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="relative weight of each route, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--series", type=int, default=5, help="series seeded")
+    parser.add_argument("--batches", type=int, default=20, help="batches seeded in each series")
+    parser.add_argument("--tests", type=int, default=100, help="tests in each batch")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--threads", type=int, default=1, help="threads per gunicorn worker")
+    parser.add_argument("--url", help="test an app which is already running, without seeding it")
+    parser.add_argument("--output", help="write the results as JSON here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    weights = parse_mix(args.mix)
+    shape = DatasetShape(series=args.series,
+                         batches_per_series=args.batches,
+                         tests_per_batch=args.tests)
+
+    if args.url:
+        summary = run(args.url, weights, shape, args.clients, args.duration)
+    else:
+        directory = tempfile.mkdtemp(prefix="trapp-loadtest-")
+        try:
+            server = Server(directory, args.workers, args.worker_class, args.threads)
+
+            dataset.load(generate_batches(shape), server.database_file)
+
+            server.start()
+            try:
+                summary = run(server.url, weights, shape, args.clients, args.duration)
+            finally:
+                server.stop()
+
+            summary["busy_errors"] = server.count_busy_errors()
+        finally:
+            shutil.rmtree(directory)
+
+    summary["clients"] = args.clients
+    summary["mix"] = weights
+
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(summary, output, indent=4, sort_keys=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
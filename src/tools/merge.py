@@ -0,0 +1,208 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Merges the results in other trapp databases into one.
+
+    cd src
+    python3 -m tools.merge data/flask_db.sqlite lab1.sqlite lab2.sqlite
+
+Series, batches, revisions and metadata are matched by name, timestamp and
+value rather than id, so the databases needn't have anything in common.
+Results already in the target, the same test in the same batch of the same
+series, are kept as they are. Each source is merged in one transaction with a
+few INSERT ... SELECT statements. Old results are not removed, whatever
+TEST_HISTORY_SIZE is. Rollups of results the source removed are copied, unless
+the target has one for the same test and period already.
+"""
+import sys
+import time
+import argparse
+import logging
+
+logger = logging.getLogger()
+
+TABLES = ["Vcs", "Series", "Metadata", "Batch", "Test"]
+
+# Rows of each table in the source which aren't yet in the target. Rows which
+# break a UNIQUE constraint are already there, and are ignored.
+SQL_MERGE = [
+    ("Vcs", """
+        INSERT OR IGNORE INTO main.Vcs (vcs_system, vcs_revision)
+        SELECT vcs_system, vcs_revision FROM source.Vcs
+    """),
+    ("Series", """
+        INSERT OR IGNORE INTO main.Series (series_name)
+        SELECT series_name FROM source.Series
+    """),
+    ("Metadata", """
+        INSERT OR IGNORE INTO main.Metadata (metadata)
+        SELECT metadata FROM source.Metadata WHERE metadata IS NOT NULL
+    """),
+    ("Batch", """
+        INSERT OR IGNORE INTO main.Batch (batch_timestamp, series_id, vcs_id)
+        SELECT
+            SourceBatch.batch_timestamp,
+            Series.series_id,
+            Vcs.vcs_id
+        FROM source.Batch AS SourceBatch
+            INNER JOIN source.Series AS SourceSeries
+                ON SourceBatch.series_id = SourceSeries.series_id
+            INNER JOIN main.Series AS Series
+                ON Series.series_name = SourceSeries.series_name
+            LEFT JOIN source.Vcs AS SourceVcs
+                ON SourceBatch.vcs_id = SourceVcs.vcs_id
+            LEFT JOIN main.Vcs AS Vcs
+                ON Vcs.vcs_system = SourceVcs.vcs_system
+                AND Vcs.vcs_revision = SourceVcs.vcs_revision
+    """),
+    ("Test", """
+        INSERT OR IGNORE INTO main.Test
+            (test_name, test_result, test_timestamp, test_duration, batch_id, metadata_id)
+        SELECT
+            SourceTest.test_name,
+            SourceTest.test_result,
+            SourceTest.test_timestamp,
+            SourceTest.test_duration,
+            Batch.batch_id,
+            Metadata.metadata_id
+        FROM source.Test AS SourceTest
+            INNER JOIN source.Batch AS SourceBatch
+                ON SourceTest.batch_id = SourceBatch.batch_id
+            INNER JOIN source.Series AS SourceSeries
+                ON SourceBatch.series_id = SourceSeries.series_id
+            INNER JOIN main.Series AS Series
+                ON Series.series_name = SourceSeries.series_name
+            INNER JOIN main.Batch AS Batch
+                ON Batch.batch_timestamp = SourceBatch.batch_timestamp
+                AND Batch.series_id = Series.series_id
+            LEFT JOIN source.Metadata AS SourceMetadata
+                ON SourceTest.metadata_id = SourceMetadata.metadata_id
+            LEFT JOIN main.Metadata AS Metadata
+                ON Metadata.metadata = SourceMetadata.metadata
+    """),
+]
+
+# Only in databases which have removed results since rollups were added
+SQL_MERGE_ROLLUP = """
+    INSERT OR IGNORE INTO main.Rollup SELECT * FROM source.Rollup
+"""
+
+# The series given tests by the merge, and their latest batch. Tests are
+# numbered after every test already in the target.
+SQL_MERGED_SERIES = """
+SELECT
+    Series.series_name,
+    MAX(Batch.batch_id)
+FROM Test
+    INNER JOIN Batch
+        ON Test.batch_id = Batch.batch_id
+    INNER JOIN Series
+        ON Batch.series_id = Series.series_id
+WHERE Test.test_id > ?
+GROUP BY Series.series_name
+"""
+
+
+def merge(source_file):
+    """
+    Merges a database into the one Database was initialised with. Returns the
+    rows added to each table.
+    """
+    from common.database import Database
+    from models.series_version import SeriesVersion
+
+    # Can't be attached inside a transaction
+    Database.execute("ATTACH DATABASE ? AS source", (source_file,))
+
+    try:
+        tables = [row[0] for row in Database.query_rows(
+                      "SELECT name FROM source.sqlite_master WHERE type = 'table'")]
+
+        missing = [table for table in TABLES if table not in tables]
+        if missing:
+            raise ValueError("{} has no {} table".format(source_file, ", ".join(missing)))
+
+        Database.start_batch()
+
+        try:
+            last_test_id = Database.query_one("SELECT IFNULL(MAX(test_id), 0) FROM Test")
+
+            added = {}
+            for table, command in SQL_MERGE:
+                Database.execute(command)
+                added[table] = Database.query_one("SELECT changes()")
+
+            if "Rollup" in tables:
+                Database.execute(SQL_MERGE_ROLLUP)
+                added["Rollup"] = Database.query_one("SELECT changes()")
+
+            for series_name, batch_id in Database.query_rows(SQL_MERGED_SERIES, (last_test_id,)):
+                SeriesVersion.record_batch(series_name, batch_id)
+
+            Database.end_batch()
+
+        except BaseException:
+            Database.rollback()
+            raise
+
+    finally:
+        Database.execute("DETACH DATABASE source")
+
+    return added
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Merge trapp databases")
+    parser.add_argument("target", help="database to merge into, created if needed")
+    parser.add_argument("sources", nargs="+", help="databases to merge from")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from common.database import Database
+
+    args = _parse_args(argv)
+
+    Database.initialise(args.target)
+
+    try:
+        for source_file in args.sources:
+            started = time.monotonic()
+            added = merge(source_file)
+
+            print("Merged {} in {:.1f}s: {}".format(
+                      source_file,
+                      time.monotonic() - started,
+                      ", ".join("{} {}".format(count, table)
+                                for table, count in added.items())))
+    finally:
+        Database.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
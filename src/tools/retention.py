@@ -0,0 +1,91 @@
+################################################################################
+# Copyright (c) 2018, Alan Barr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+################################################################################
+"""
+Removes every result outside the retention policies now, rather than waiting
+for the app's next sweep.
+
+    cd src
+    python3 -m tools.retention
+    python3 -m tools.retention --vacuum
+
+The policies, database and archive are those the app is configured with, see
+RETENTION_POLICIES. --vacuum then rebuilds the database, which is needed once
+for a database created before auto_vacuum was made incremental. Stop the app
+before vacuuming.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+logger = logging.getLogger()
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Enforce trapp retention policies")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rebuild the database afterwards, giving back every free page")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    # Imported here so its settings can be given by TRAPP_SETTINGS
+    import app
+    from common.database import Database
+    import models.retention as retention
+
+    args = _parse_args(argv)
+    database_file = app.app.config["DATABASE"]
+
+    Database.initialise(database_file)
+
+    try:
+        size = os.path.getsize(database_file)
+        started = time.monotonic()
+
+        removed = retention.sweep(app.retention_policies(), app.archive,
+                                  app.app.config["RETENTION_CHUNK_ROWS"])
+
+        for series_name, count in sorted(removed.items()):
+            print("{:<40} {:>10}".format(series_name, count))
+
+        if args.vacuum:
+            Database.query_one("VACUUM")
+
+        print("Removed {} results in {:.1f}s, database {} -> {} bytes".format(
+                  sum(removed.values()),
+                  time.monotonic() - started,
+                  size,
+                  os.path.getsize(database_file)))
+    finally:
+        Database.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())